@@ -0,0 +1,58 @@
+# bench_parser.py — микробенчмарк: старые разрозненные регулярки против booking_parser
+#   python bench_parser.py [повторов]
+import re
+import sys
+import timeit
+
+from booking_parser import parse_booking_line
+
+LINES = [
+    "18:30 Анна 1ч 30мин 300 лари",
+    "15:00 Иван 300 лари",
+    "10:15 Катя 2 часа 1 000 лари",
+    "9:00 Света 45мин 100$",
+    "23:00 Лера 1ч 200 usdt",
+    "12:00 Саша 30 минут 50 евро",
+    "12:00 Кенди 1час 150 долларов + 100 лари",
+    "01:30 Саша 2ч 20000 драм",
+]
+
+MONEY_SUMMARY = r"(\d+)\s*(лари|лaри|лар|lari|доллар[аов]?|dollar|usd|\$|евро|euro|€|крипта|crypto|usdt|btc|eth|драм|драмм|драмов|драма|dram|amd|֏)"
+MONEY_REPORT = r"(\d[\d\s]*)\s*(лари|лaри|лар|lari|доллар[аов]?|dollar|usd|\$|евро|euro|€|крипта|crypto|usdt|btc|eth|драм|драмм|драмов|драма|dram|amd|֏)"
+
+
+def legacy(text: str):
+    """Что раньше делалось с одной строкой: add_booking + generate_summary_text + extract_booking_usd."""
+    time_part = text.split(maxsplit=1)[0]
+    rest = text[len(time_part):].strip()
+    low = rest.lower()
+    h = re.search(r"(\d+)\s*(ч|час)", low)
+    m = re.search(r"(\d+)\s*(мин|минут|м)", low)
+    hours = int(h.group(1)) if h else 0
+    minutes = int(m.group(1)) if m else 0
+    info = re.sub(r"\d+\s*(ч|час|мин|минут|м)\b.*$", "", rest, flags=re.I).strip() or "Без имени"
+    words = info.split()
+    operator = words[0] if words else "Неизвестно"
+    summary = re.findall(MONEY_SUMMARY, text.lower())   # generate_summary_text: итоги
+    summary2 = re.findall(MONEY_SUMMARY, text.lower())  # generate_summary_text: ЗП операторов
+    report = re.findall(MONEY_REPORT, text.lower())     # extract_booking_usd
+    return time_part, info, hours * 3600 + minutes * 60, operator, summary, summary2, report
+
+
+def single_pass(text: str):
+    return parse_booking_line(text)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    results = {}
+    for name, fn in (("старые регулярки", legacy), ("booking_parser", single_pass)):
+        elapsed = min(timeit.repeat(lambda: [fn(line) for line in LINES], number=number, repeat=5))
+        per_line = elapsed / (number * len(LINES)) * 1e6
+        results[name] = per_line
+        print(f"{name:>18}: {per_line:.2f} мкс/строка")
+    print(f"{'ускорение':>18}: ×{results['старые регулярки'] / results['booking_parser']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
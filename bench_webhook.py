@@ -0,0 +1,176 @@
+# bench_webhook.py — задержка «апдейт → хендлер»: long polling против webhook, всё локально
+#   python bench_webhook.py [апдейтов] [rtt_мс] [интервал_мс]
+#
+# Поднимается поддельный Bot API (getMe / getUpdates) и генератор апдейтов.
+# rtt — имитация сети до Telegram: половина на запрос, половина на ответ.
+# polling: апдейт ждёт, пока до сервера дойдёт очередной getUpdates и вернётся ответ;
+# webhook: генератор сам POST-ит апдейт в aiohttp-сервер бота с секретным заголовком.
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+TOKEN = "123456:bench-token"
+SECRET = "bench-secret"
+API_PORT = 18081
+HOOK_PORT = 18082
+
+
+class FakeTelegram:
+    """Поддельный Bot API: копит апдейты и отдаёт их long-poll'ом getUpdates."""
+
+    def __init__(self, rtt: float):
+        self.half_rtt = rtt / 2
+        self.updates = []
+        self.arrived = asyncio.Condition()
+
+    async def push(self, update: dict):
+        async with self.arrived:
+            self.updates.append(update)
+            self.arrived.notify_all()
+
+    async def handle(self, request: web.Request):
+        await asyncio.sleep(self.half_rtt)  # запрос летит до Telegram
+        method = request.match_info["method"].lower()
+        try:
+            params = await request.post()
+        except ConnectionResetError:
+            # stop_polling оборвал висящий getUpdates — отвечать уже некому
+            return web.Response()
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getupdates":
+            offset = int(params.get("offset") or 0)
+            timeout = float(params.get("timeout") or 0)
+            async with self.arrived:
+                # Всё, что младше offset, бот подтвердил — забываем
+                self.updates = [u for u in self.updates if u["update_id"] >= offset]
+                if timeout and not self.updates:
+                    try:
+                        await asyncio.wait_for(self.arrived.wait_for(lambda: self.updates), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                result = list(self.updates)
+        else:
+            result = True
+        await asyncio.sleep(self.half_rtt)  # ответ летит обратно
+        return web.json_response({"ok": True, "result": result})
+
+
+def fake_update(seq: int) -> dict:
+    return {
+        "update_id": seq,
+        "message": {
+            "message_id": seq,
+            "date": int(time.time()),
+            "chat": {"id": -100, "type": "group", "title": "bench"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Оператор"},
+            "text": f"{seq}",
+        },
+    }
+
+
+def make_dispatcher(sent_at: dict, latencies: list, done: asyncio.Event, total: int) -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def on_message(m: types.Message):
+        latencies.append(time.perf_counter() - sent_at[int(m.text)])
+        if len(latencies) == total:
+            done.set()
+
+    return dp
+
+
+async def generate(total: int, interval: float, emit):
+    """Апдейты с экспоненциальными паузами (в среднем interval), как живой чат."""
+    rnd = random.Random(1)
+    for seq in range(1, total + 1):
+        await emit(seq)
+        await asyncio.sleep(rnd.expovariate(1 / interval))
+
+
+async def run_mode(mode: str, total: int, rtt: float, interval: float) -> list:
+    fake = FakeTelegram(rtt)
+    api = web.Application()
+    api.router.add_route("*", "/bot{token}/{method}", fake.handle)
+    api_runner = web.AppRunner(api)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", API_PORT).start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{API_PORT}"))
+    bot = Bot(token=TOKEN, session=session)
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    dp = make_dispatcher(sent_at, latencies, done, total)
+
+    hook_runner = None
+    if mode == "polling":
+        async def emit(seq):
+            sent_at[seq] = time.perf_counter()
+            await fake.push(fake_update(seq))
+
+        worker = asyncio.create_task(dp.start_polling(bot, polling_timeout=10, handle_signals=False))
+    else:
+        app = web.Application()
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=SECRET).register(app, path="/webhook")
+        hook_runner = web.AppRunner(app)
+        await hook_runner.setup()
+        await web.TCPSite(hook_runner, "127.0.0.1", HOOK_PORT).start()
+        client = ClientSession()
+
+        async def post(update):
+            await asyncio.sleep(fake.half_rtt)  # Telegram → наш сервер
+            async with client.post(f"http://127.0.0.1:{HOOK_PORT}/webhook", json=update,
+                                   headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as resp:
+                assert resp.status == 200, resp.status
+
+        in_flight = set()
+
+        async def emit(seq):
+            sent_at[seq] = time.perf_counter()
+            task = asyncio.create_task(post(fake_update(seq)))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        worker = None
+
+    await asyncio.sleep(0.5)  # polling успевает сделать getMe и первый getUpdates
+    await generate(total, interval, emit)
+    await asyncio.wait_for(done.wait(), 30)
+
+    if worker:
+        await dp.stop_polling()
+        await worker
+    else:
+        await client.close()
+        await hook_runner.cleanup()
+        await bot.session.close()
+    await api_runner.cleanup()
+    return latencies
+
+
+def report(mode: str, latencies: list):
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(f"{mode:>8}: медиана {statistics.median(ms):6.1f} мс, p95 {p95:6.1f} мс, "
+          f"макс {ms[-1]:6.1f} мс ({len(ms)} апдейтов)")
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rtt = (float(sys.argv[2]) if len(sys.argv) > 2 else 80) / 1000
+    interval = (float(sys.argv[3]) if len(sys.argv) > 3 else 30) / 1000
+    print(f"{total} апдейтов, rtt {rtt * 1000:.0f} мс, средний интервал {interval * 1000:.0f} мс")
+    for mode in ("polling", "webhook"):
+        report(mode, await run_mode(mode, total, rtt, interval))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+# booking_parser.py — разбор строки брони за один проход + справочник валют
+import re
+
+# ==================== СПРАВОЧНИК ВАЛЮТ ====================
+# (ключ в отчётах, ключ курса в settings["rates"] или None если 1:1 к USD, алиасы)
+CURRENCIES = [
+    ("лари", "lari", ("лари", "лaри", "лар", "lari", "gel")),
+    ("$", None, ("долларов", "доллара", "доллар", "dollar", "usd", "$")),
+    ("евро", "euro", ("евро", "euro", "eur", "€")),
+    ("крипта", None, ("крипта", "crypto", "usdt", "btc", "eth")),
+    ("драм", "amd", ("драмов", "драмм", "драма", "драм", "dram", "amd", "֏")),
+]
+
+CURRENCY_RATE = {key: rate for key, rate, _ in CURRENCIES}          # {"лари": "lari", "$": None, ...}
+ALIAS_TO_CURRENCY = {alias: key for key, _, aliases in CURRENCIES for alias in aliases}
+# Длинные алиасы раньше коротких: "usdt" — крипта, а не "usd"; "euro" целиком, а не "eur"
+_ALIASES = sorted(ALIAS_TO_CURRENCY, key=len, reverse=True)
+
+
+def _alternation(words) -> str:
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+CURRENCY_PATTERN = _alternation(_ALIASES)
+RATE_CURRENCY_PATTERN = _alternation(a for a, key in ALIAS_TO_CURRENCY.items() if CURRENCY_RATE[key])
+
+
+def currency_key(name: str):
+    """'лари' / 'GEL' / '$' / 'долларов' -> ключ валюты ('лари', '$', ...). Неизвестная — None."""
+    name = (name or "").lower().strip()
+    if name in ALIAS_TO_CURRENCY:
+        return ALIAS_TO_CURRENCY[name]
+    for alias in _ALIASES:
+        if alias in name:
+            return ALIAS_TO_CURRENCY[alias]
+    return None
+
+
+# ==================== ГРАММАТИКА СТРОКИ БРОНИ ====================
+# "18:30 Анна 1ч 30мин 300 лари"
+#   время — первое слово; дальше токены «число + единица»:
+#   сумма (1 000 лари, 300$) или длительность (1ч, 30мин).
+HOUR_UNITS = ("час", "ч")
+MINUTE_UNITS = ("минут", "мин", "м")
+DURATION_UNITS = HOUR_UNITS + MINUTE_UNITS
+
+_TIME_RE = re.compile(r"^\d{1,2}:\d{2}")
+_TOKEN_RE = re.compile(
+    r"(?P<amount>\d{1,3}(?:\s\d{3})+|\d+)\s*(?P<cur>" + CURRENCY_PATTERN + r")"
+    r"|(?P<qty>\d+)\s*(?P<unit>" + _alternation(DURATION_UNITS) + r")"
+)
+
+
+def _unit_ends_word(text: str, pos: int) -> bool:
+    """Есть ли с позиции pos единица длительности, за которой кончается слово."""
+    for unit in DURATION_UNITS:
+        end = pos + len(unit)
+        if text.startswith(unit, pos) and (end == len(text) or not (text[end].isalnum() or text[end] == "_")):
+            return True
+    return False
+
+
+def format_duration(hours: int, minutes: int) -> str:
+    pretty = []
+    if hours: pretty.append(f"{hours}ч")
+    if minutes: pretty.append(f"{minutes}мин" if hours else f"{minutes} мин")
+    return " ".join(pretty) or "30 мин"
+
+
+def parse_booking_line(text: str) -> dict:
+    """Разбирает строку брони за один проход.
+
+    Возвращает {"time", "rest", "info", "duration_sec", "duration", "amounts", "operator"}:
+    amounts — {ключ валюты: целая сумма}, operator — первое слово info.
+    Если строка не начинается со времени, вся она считается текстом брони."""
+    text = (text or "").strip()
+    time_part = ""
+    if _TIME_RE.match(text):
+        time_part = text.split(maxsplit=1)[0]
+    rest = text[len(time_part):].strip()
+
+    low = rest.lower()
+    if len(low) != len(rest):
+        low = rest  # редкие символы, меняющие длину при lower() — позиции должны совпадать
+
+    hours = minutes = None
+    info_end = None
+    amounts = {}
+    for m in _TOKEN_RE.finditer(low):
+        cur = m.group("cur")
+        if cur:
+            key = ALIAS_TO_CURRENCY[cur]
+            amounts[key] = amounts.get(key, 0) + int(m.group("amount").replace(" ", "").replace(" ", ""))
+            continue
+        unit = m.group("unit")
+        if unit in HOUR_UNITS:
+            if hours is None:
+                hours = int(m.group("qty"))
+        elif minutes is None:
+            minutes = int(m.group("qty"))
+        if info_end is None and _unit_ends_word(low, m.start("unit")):
+            info_end = m.start()
+
+    info = (rest[:info_end] if info_end is not None else rest).strip() or "Без имени"
+    hours, minutes = hours or 0, minutes or 0
+    words = info.split()
+    return {
+        "time": time_part,
+        "rest": rest,
+        "info": info,
+        "duration_sec": hours * 3600 + minutes * 60,
+        "duration": format_duration(hours, minutes),
+        "amounts": amounts,
+        "operator": words[0] if words else "Неизвестно",
+    }
@@ -1,21 +1,39 @@
 # bot.py — ПОЛНАЯ ВЕРСИЯ С РАСХОДАМИ (ТОЛЬКО ОТОБРАЖЕНИЕ, БЕЗ ВЫЧИТАНИЯ ИЗ ВЫРУЧКИ)
 import asyncio
+import copy
+import functools
+import hashlib
+import heapq
+import html
+import inspect
+import itertools
 import json
 import re
+import signal
+import threading
+import time
 import requests
-from datetime import datetime, timedelta
-from typing import Optional
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, StateFilter
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import TOKEN, OWNERS, ALLOWED_CHATS, EXCLUDED_FROM_REPORTS
+from booking_parser import CURRENCY_PATTERN, CURRENCY_RATE, RATE_CURRENCY_PATTERN, currency_key, parse_booking_line
+from outbox import ALERT, BOARD, BULK, LANE_NAMES, Outbox, in_lane, lane
+from storage import (BookingIndex, ExpenseLedger, JsonStorage, RateHistory, ShiftArchive,
+                     SqliteStorage, WriteBehind, date_ordinal, write_json_atomic)
 try:
     from config import CRYPTO_WALLET, CRYPTO_CHAT
 except ImportError:
@@ -27,6 +45,33 @@ try:
 except ImportError:
     CRYPTO_TOPIC = None
 
+try:
+    from config import SUMMARY_DIGEST
+except ImportError:
+    SUMMARY_DIGEST = True  # итоги всех чатов одним дайджестом; False — сообщение на каждый чат
+
+try:
+    from config import WEBHOOK_URL
+except ImportError:
+    WEBHOOK_URL = ""  # пусто — long polling
+
+try:
+    from config import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH
+except ImportError:
+    WEBHOOK_HOST = "0.0.0.0"
+    WEBHOOK_PORT = 8080
+    WEBHOOK_PATH = "/webhook"
+
+try:
+    from config import WEBHOOK_SECRET
+except ImportError:
+    WEBHOOK_SECRET = hashlib.sha256(TOKEN.encode()).hexdigest()[:32]
+
+try:
+    from config import STORAGE_BACKEND
+except ImportError:
+    STORAGE_BACKEND = "json"  # "json" или "sqlite"
+
 try:
     from config import OPERATORS, GOOGLE_SHEET_ID, GOOGLE_SHEET_NAME, GOOGLE_CREDS_FILE
 except ImportError:
@@ -38,13 +83,20 @@ except ImportError:
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+outbox = Outbox()  # все отправки в чаты — через лимиты Telegram и полосы приоритета
+bot.session.middleware(outbox.middleware)
 
 DATA_FILE = "data.json"
-HISTORY_FILE = "history.json"
+HISTORY_FILE = "history.json"  # старый плоский архив, переносится в HISTORY_DIR
+HISTORY_DIR = "history"        # архив смен: history/ГГГГ-ММ.json
+EXPENSES_FILE = "expenses.json"
 SETTINGS_FILE = "settings.json"
+RATES_HISTORY_FILE = "rates_history.json"  # курсы по дням для отчётов за прошлые даты
+DB_FILE = "bot.db"
 data = {"chats": {}}
-history = {"shifts": []}  # архив смен для отчётов
+history = ShiftArchive()  # архив смен для отчётов, по месяцам
 settings = {}  # ручные курсы и проценты
+rate_history = RateHistory()  # {день: курсы}, пополняется обновлением курсов и ручным вводом
 
 # Fallback курсы
 FALLBACK_LARI_TO_USD = 0.37
@@ -55,28 +107,93 @@ current_lari_to_usd = FALLBACK_LARI_TO_USD
 current_euro_to_usd = FALLBACK_EURO_TO_USD
 current_amd_to_usd = FALLBACK_AMD_TO_USD
 
+# ==================== КУРСЫ ВАЛЮТ: КЭШ + ФОНОВОЕ ОБНОВЛЕНИЕ ====================
+# Отчёты и подсчёты никогда не ходят в сеть: берут курсы из кэша.
+# Кэш обновляет фоновая задача rates_refresher(); если кэш протух, а задача
+# почему-то не успела — отдаём старые курсы и тут же запускаем обновление в фоне.
+RATES_API_URL = "https://api.exchangerate.host/latest?base=USD"
+RATES_REFRESH_INTERVAL = 3600   # сек между плановыми обновлениями
+RATES_TTL = 6 * 3600            # сек, после которых кэш считается устаревшим
+rates_cache = {"lari": None, "euro": None, "amd": None, "fetched_at": None, "error": None}
+_rates_refresh_task = None
+
+
+def fetch_exchange_rates() -> dict:
+    """Блокирующий запрос к API курсов — вызывать только через executor."""
+    response = requests.get(RATES_API_URL, timeout=5)
+    response.raise_for_status()
+    rates = response.json()["rates"]
+    # base=USD: rates[X] — сколько X за 1$, нам нужно сколько $ за 1 X
+    return {
+        "lari": 1 / rates.get("GEL", 1 / FALLBACK_LARI_TO_USD),
+        "euro": 1 / rates.get("EUR", 1 / FALLBACK_EURO_TO_USD),
+        "amd": 1 / rates.get("AMD", 1 / FALLBACK_AMD_TO_USD),
+    }
+
+
+async def refresh_exchange_rates():
+    """Обновляет кэш курсов, не блокируя цикл событий. При ошибке кэш остаётся прежним."""
+    loop = asyncio.get_running_loop()
+    try:
+        fresh = await loop.run_in_executor(None, fetch_exchange_rates)
+        rates_cache.update(fresh)
+        rates_cache["fetched_at"] = datetime.now()
+        rates_cache["error"] = None
+    except Exception as e:
+        rates_cache["error"] = str(e)[:100]
+        print(f"Курсы валют не обновлены: {e}")
+        update_exchange_rates()
+        return
+    update_exchange_rates()
+    record_rates_for_today()
+
+
+def rates_cache_stale() -> bool:
+    fetched_at = rates_cache["fetched_at"]
+    return fetched_at is None or (datetime.now() - fetched_at).total_seconds() > RATES_TTL
+
+
+def _revalidate_rates():
+    """Фоновое обновление протухшего кэша (stale-while-revalidate), не чаще одного за раз."""
+    global _rates_refresh_task
+    if _rates_refresh_task and not _rates_refresh_task.done():
+        return
+    try:
+        _rates_refresh_task = asyncio.get_running_loop().create_task(refresh_exchange_rates())
+    except RuntimeError:
+        pass  # вне цикла событий (скрипты, импорт) — работаем на кэше/fallback
+
+
+async def rates_refresher():
+    while True:
+        await asyncio.sleep(RATES_REFRESH_INTERVAL)
+        await refresh_exchange_rates()
+
+
+def rates_updated_text() -> str:
+    fetched_at = rates_cache["fetched_at"]
+    text = fetched_at.strftime("%d.%m %H:%M") if fetched_at else "ещё не обновлялись (fallback)"
+    if rates_cache["error"]:
+        text += f" — ошибка: {rates_cache['error']}"
+    return text
+
 
 def update_exchange_rates():
+    """Применяет курсы без сетевых запросов: ручные из settings > кэш API > fallback."""
     global current_lari_to_usd, current_euro_to_usd, current_amd_to_usd
-    # Ручные курсы из settings имеют приоритет
     manual = settings.get("rates", {})
-    if manual:
-        if manual.get("lari"):
-            current_lari_to_usd = manual["lari"]
-        if manual.get("euro"):
-            current_euro_to_usd = manual["euro"]
-        if manual.get("amd"):
-            current_amd_to_usd = manual["amd"]
-        return
-    try:
-        response = requests.get("https://api.exchangerate.host/latest?base=USD", timeout=5)
-        if response.status_code == 200:
-            rates = response.json()["rates"]
-            current_lari_to_usd = 1 / rates.get("GEL", 1 / FALLBACK_LARI_TO_USD)
-            current_euro_to_usd = rates.get("EUR", FALLBACK_EURO_TO_USD)
-            current_amd_to_usd = 1 / rates.get("AMD", 1 / FALLBACK_AMD_TO_USD)
-    except:
-        pass
+    current_lari_to_usd = manual.get("lari") or rates_cache["lari"] or FALLBACK_LARI_TO_USD
+    current_euro_to_usd = manual.get("euro") or rates_cache["euro"] or FALLBACK_EURO_TO_USD
+    current_amd_to_usd = manual.get("amd") or rates_cache["amd"] or FALLBACK_AMD_TO_USD
+    if rates_cache_stale():
+        _revalidate_rates()
+
+
+def record_rates_for_today():
+    """Записывает действующие курсы (ручные > API) в историю на сегодняшний день."""
+    today = {"lari": current_lari_to_usd, "euro": current_euro_to_usd, "amd": current_amd_to_usd}
+    if rate_history.set(datetime.now(), today):
+        writer.mark_dirty("rates")
 
 
 # ==================== ПРОЦЕНТЫ ЗП ПО ИМЕНАМ ====================
@@ -114,6 +231,100 @@ def get_salary_percent(name: str) -> float:
     return SALARY_PERCENT.get(name, settings.get("default_percent", DEFAULT_PERCENT))
 
 
+# ==================== КЭШ НАЗВАНИЙ ЧАТОВ ====================
+# get_chat — сетевой запрос; название чата меняется редко. Кэш заполняется
+# при старте (все чаты разом), обновляется по new_chat_title / my_chat_member,
+# а на всякий случай перечитывается раз в CHAT_TITLE_TTL секунд.
+CHAT_TITLE_TTL = 6 * 3600
+
+chat_titles = {}  # {chat_id: (название или None, когда получено)}
+chat_title_stats = {"hits": 0, "fetches": 0, "errors": 0}
+
+
+def _title_of(chat) -> Optional[str]:
+    return (chat.title or chat.first_name or "").strip() or None
+
+
+def remember_chat_title(chat_id: int, title: Optional[str]):
+    chat_titles[int(chat_id)] = (title, datetime.now())
+
+
+async def get_chat_title(chat_id) -> Optional[str]:
+    """Название чата из кэша; при промахе или истёкшем TTL — bot.get_chat.
+    Ошибка запроса — отдаём что было в кэше (или None), ошибку не кэшируем."""
+    chat_id = int(chat_id)
+    cached = chat_titles.get(chat_id)
+    if cached and (datetime.now() - cached[1]).total_seconds() < CHAT_TITLE_TTL:
+        chat_title_stats["hits"] += 1
+        return cached[0]
+    chat_title_stats["fetches"] += 1
+    try:
+        chat = await bot.get_chat(chat_id)
+    except:
+        chat_title_stats["errors"] += 1
+        return cached[0] if cached else None
+    title = _title_of(chat)
+    remember_chat_title(chat_id, title)
+    return title
+
+
+async def warm_chat_titles():
+    """Названия всех рабочих чатов — параллельно, один раз при старте."""
+    await asyncio.gather(*(get_chat_title(ch_id) for ch_id in ALLOWED_CHATS))
+
+
+@dp.message(F.new_chat_title)
+async def on_new_chat_title(m: types.Message):
+    remember_chat_title(m.chat.id, m.new_chat_title.strip() or None)
+    if m.chat.id in ALLOWED_CHATS:
+        await ensure_chat(m.chat.id)
+
+
+@dp.my_chat_member()
+async def on_my_chat_member(event: types.ChatMemberUpdated):
+    remember_chat_title(event.chat.id, _title_of(event.chat))
+
+
+# ==================== ПОСЛЕДОВАТЕЛЬНАЯ ОБРАБОТКА ПО ЧАТАМ ====================
+# Апдейты одного чата обрабатываются строго по очереди (asyncio.Lock отдаёт
+# ожидающим в порядке прихода), разные чаты — параллельно. Так обработчики,
+# меняющие data вокруг await, не перетирают друг другу изменения.
+# Отчёты помечены REPORT_FLAGS: новый отчёт отменяет предыдущий (send_report),
+# поэтому ждать его в очереди он не должен.
+REPORT_FLAGS = {"serial": False}
+
+chat_locks = {}       # {chat_id: asyncio.Lock}
+chat_wait_stats = {}  # {chat_id: {"updates", "waited", "total", "max"}} — ожидание очереди, сек
+
+
+def _event_chat_id(event) -> int:
+    if isinstance(event, types.CallbackQuery):
+        return event.message.chat.id if event.message else event.from_user.id
+    return event.chat.id
+
+
+async def serialize_per_chat(handler, event, data_):
+    if get_flag(data_, "serial") is False:
+        return await handler(event, data_)
+    chat_id = _event_chat_id(event)
+    lock = chat_locks.setdefault(chat_id, asyncio.Lock())
+    loop = asyncio.get_running_loop()
+    queued = loop.time()
+    async with lock:
+        wait = loop.time() - queued
+        stats = chat_wait_stats.setdefault(chat_id, {"updates": 0, "waited": 0, "total": 0.0, "max": 0.0})
+        stats["updates"] += 1
+        stats["total"] += wait
+        stats["max"] = max(stats["max"], wait)
+        if wait > 0.001:
+            stats["waited"] += 1
+        return await handler(event, data_)
+
+
+dp.message.middleware(serialize_per_chat)
+dp.callback_query.middleware(serialize_per_chat)
+
+
 # ==================== СМЕНА 09:00 → 08:59 + НАЗВАНИЕ ЧАТА ====================
 async def get_shift_info(chat_id: int) -> tuple[str, str]:
     now = datetime.now()
@@ -122,14 +333,7 @@ async def get_shift_info(chat_id: int) -> tuple[str, str]:
     else:
         shift_start = now
     date_str = shift_start.strftime("%d.%m.%Y")
-
-    chat_title = "Салон"
-    try:
-        chat = await bot.get_chat(chat_id)
-        chat_title = (chat.title or chat.first_name or "Салон").strip()
-    except:
-        pass
-    return date_str, chat_title or "Салон"
+    return date_str, await get_chat_title(chat_id) or "Салон"
 
 
 async def ensure_chat(chat_id: int):
@@ -145,6 +349,7 @@ async def ensure_chat(chat_id: int):
             "chat_title": chat_title,
             "next_id": 1,
         }
+        journal("chat", s, state=data["chats"][s])
     else:
         if "expenses" not in data["chats"][s]:
             data["chats"][s]["expenses"] = []
@@ -156,36 +361,83 @@ async def ensure_chat(chat_id: int):
             data["chats"][s]["expenses"] = []
             data["chats"][s]["date"] = current_date
             data["chats"][s]["next_id"] = 1
-        data["chats"][s]["chat_title"] = chat_title
+            data["chats"][s]["chat_title"] = chat_title
+            journal("new_shift", s, date=current_date, chat_title=chat_title)
+        elif data["chats"][s].get("chat_title") != chat_title:
+            data["chats"][s]["chat_title"] = chat_title
+            journal("meta", s, fields={"chat_title": chat_title})
 
 
 # ==================== STORAGE ====================
+json_store = JsonStorage(DATA_FILE, HISTORY_FILE, EXPENSES_FILE, history_dir=HISTORY_DIR)
+if STORAGE_BACKEND == "sqlite":
+    store = SqliteStorage(DB_FILE)
+else:
+    store = json_store
+
+# Обработчики только помечают хранилище грязным, пишет фоновая задача (writer.run)
+WRITE_BEHIND_DELAY = 2.0  # секунд — максимум задержки записи на диск
+writer = WriteBehind(delay=WRITE_BEHIND_DELAY)
+
+
 def load_data():
     global data
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        data = {"chats": {}}
+    data = store.load_data()
+
+
+def save_data(chat_str: Optional[str] = None):
+    """Полный снимок data (для JSON — со сжатием журнала), в фоне.
+    chat_str — если менялся только один чат (SQLite пишет лишь его строки)."""
+    writer.mark_dirty("data", changed=[chat_str] if chat_str else None)
+
+
+def journal(op: str, chat_str: str, **payload):
+    """Одно изменение смены — одна строка журнала (add/done/cancel/delete/edit/new_shift/...).
+    Вместо перезаписи всего data.json; снимок делает journal_compactor."""
+    log_mutation({"op": op, "chat": chat_str, **payload})
+    mark_changed(chat_str)
 
 
-def save_data():
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def log_mutation(entry: dict):
+    """JSON — строка в журнал сразу (O(1)); SQLite — строки чата перепишет writer в потоке."""
+    if store.journaled:
+        store.log_mutation(entry, data)
+    else:
+        save_data(entry["chat"])
+
+
+def mark_changed(chat_str: str):
+    """Смена чата изменилась: сбрасываем кэш отчётов за её дату и переиндексируем брони."""
+    touch_dates(data["chats"].get(chat_str, {}).get("date", ""))
+    reindex_live_chat(chat_str)
+
+
+JOURNAL_COMPACT_EVERY = 500     # сжимать журнал после стольких записей
+JOURNAL_COMPACT_MINUTES = 10    # ...или не реже чем раз в столько минут
+
+
+async def journal_compactor():
+    """Фоновое сжатие журнала в снимок data.json."""
+    last_compact = datetime.now()
+    while True:
+        await asyncio.sleep(30)
+        entries = store.journal_entries
+        if not entries:
+            continue
+        overdue = datetime.now() - last_compact >= timedelta(minutes=JOURNAL_COMPACT_MINUTES)
+        if entries >= JOURNAL_COMPACT_EVERY or overdue:
+            save_data()
+            last_compact = datetime.now()
 
 
 def load_history():
     global history
-    try:
-        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-            history = json.load(f)
-    except FileNotFoundError:
-        history = {"shifts": []}
+    history = store.load_history()
 
 
-def save_history():
-    with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
+def save_history(added: Optional[list] = None):
+    """added — только что добавленные смены (SQLite вставляет лишь их)."""
+    writer.mark_dirty("history", added=added)
 
 
 def load_settings():
@@ -198,13 +450,62 @@ def load_settings():
 
 
 def save_settings():
-    with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump(settings, f, ensure_ascii=False, indent=2)
+    touch_settings()
+    writer.mark_dirty("settings")
+
+
+def load_rate_history():
+    global rate_history
+    try:
+        with open(RATES_HISTORY_FILE, "r", encoding="utf-8") as f:
+            rate_history = RateHistory(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        rate_history = RateHistory()
+
+
+# ----------- Функции записи -----------
+# Вызываются writer-ом в event loop: снимают копию и возвращают функцию,
+# которая пишет её в потоке writer.
+def _write_data(full: bool, changed=()):
+    return store.snapshot_data(data, changed=None if full else set(changed))
+
+
+def _write_history(full: bool, added=(), pruned=()):
+    # Архивные смены не меняются — достаточно копий списков сегментов
+    partitions = {month: list(shifts) for month, shifts in history.partitions.items()}
+    added = None if full else list(added)
+
+    def write():
+        if pruned:
+            store.prune_history(pruned)
+        if full or added:
+            store.save_history(partitions, added=added)
+    return write
+
+
+def _write_expenses(full: bool, added=(), removed=()):
+    records, next_id = [dict(e) for e in expenses.all()], expenses.next_id
+    if full:
+        return lambda: store.save_expenses(records, next_id)
+    added, removed = [dict(e) for e in added], [dict(e) for e in removed]
+    return lambda: store.save_expenses(records, next_id, added=added, removed=removed)
+
+
+def _write_settings(full: bool):
+    snapshot = copy.deepcopy(settings)
+    return lambda: write_json_atomic(SETTINGS_FILE, snapshot)
+
+
+def _write_rates(full: bool):
+    snapshot = rate_history.to_dict()
+    return lambda: write_json_atomic(RATES_HISTORY_FILE, snapshot)
 
 
-load_data()
-load_history()
-load_settings()
+writer.register("data", _write_data)
+writer.register("history", _write_history)
+writer.register("expenses", _write_expenses)
+writer.register("settings", _write_settings)
+writer.register("rates", _write_rates)
 
 
 class EditState(StatesGroup):
@@ -239,70 +540,57 @@ class OperatorSalaryState(StatesGroup):
 
 
 # ==================== ГЛОБАЛЬНЫЕ РАСХОДЫ (expenses.json) ====================
-EXPENSES_FILE = "expenses.json"
-global_expenses = []  # [{chat_id, chat_title, date, type, amount, currency, amount_usd, comment, created_at, id}]
+# {id: {chat_id, chat_title, date, type, amount, currency, amount_usd, comment, created_at, id}}
+expenses = ExpenseLedger()
 
 
 def load_expenses():
-    global global_expenses
-    try:
-        with open(EXPENSES_FILE, "r", encoding="utf-8") as f:
-            global_expenses = json.load(f)
-    except FileNotFoundError:
-        global_expenses = []
-
+    global expenses
+    records, next_id = store.load_expenses()
+    expenses = ExpenseLedger(records, next_id)
 
-def save_expenses():
-    with open(EXPENSES_FILE, "w", encoding="utf-8") as f:
-        json.dump(global_expenses, f, ensure_ascii=False, indent=2)
 
-
-def next_expense_id() -> int:
-    if not global_expenses:
-        return 1
-    return max(e.get("id", 0) for e in global_expenses) + 1
+def save_expenses(added: Optional[list] = None, removed: Optional[list] = None):
+    if added is None and removed is None:
+        touch_all()
+        writer.mark_dirty("expenses")
+    else:
+        touch_dates(*(e.get("date", "") for e in (added or []) + (removed or [])))
+        writer.mark_dirty("expenses", added=added or [], removed=removed or [])
 
 
 def get_expenses_for_period(date_from, date_to, chat_id=None):
+    """Расходы за период по порядку дат; копии записей с "d" (дата) и amount_usd,
+    пересчитанным по курсу на дату расхода."""
     result = []
-    for e in global_expenses:
-        d = parse_date_str(e.get("date", ""))
-        if not d:
-            continue
-        if date_from <= d <= date_to:
-            if chat_id is None or str(e.get("chat_id", "")) == str(chat_id):
-                result.append(e)
+    for ordinal, e in expenses.between(date_from, date_to, chat_id):
+        d = date.fromordinal(ordinal)
+        usd = expense_to_usd(e.get("amount", 0), e.get("currency", "$"), rates_on(d))
+        result.append({**e, "d": d, "amount_usd": round(usd, 2)})
     return result
 
 
-def expense_to_usd(amount, currency):
-    currency = currency.lower()
-    if any(x in currency for x in ["лари", "лар", "lari", "gel"]):
-        return amount * current_lari_to_usd
-    elif any(x in currency for x in ["доллар", "dollar", "usd", "$"]):
-        return amount
-    elif any(x in currency for x in ["евро", "euro", "€", "eur"]):
-        return amount * current_euro_to_usd
-    elif any(x in currency for x in ["драм", "dram", "amd", "֏"]):
-        return amount * current_amd_to_usd
-    return amount
+def expense_category_usd(date_from, date_to, chat_id=None) -> list:
+    """[(дата, категория, usd)] из накопительных итогов реестра — без обхода расходов;
+    USD каждого дня — по курсу на этот день."""
+    result = []
+    for ordinal, category, amounts in expenses.category_totals(date_from, date_to, chat_id):
+        d = date.fromordinal(ordinal)
+        rates = rates_on(d)
+        result.append((d, category, sum(expense_to_usd(a, cur, rates) for cur, a in amounts.items())))
+    return result
 
 
-load_expenses()
+def rate_to_usd(currency: str, rates: Optional[tuple] = None) -> float:
+    """Курс валюты (ключ из booking_parser.CURRENCIES) к USD; $ и крипта — 1:1.
+    rates — (лари, евро, драм) на нужную дату, по умолчанию текущие."""
+    lari, euro, amd = rates or current_rates()
+    return {"lari": lari, "euro": euro, "amd": amd}.get(CURRENCY_RATE.get(currency), 1.0)
 
 
-def parse_duration(text: str) -> tuple[int, str]:
-    text = (text or "").lower().strip()
-    hours = minutes = 0
-    h = re.search(r"(\d+)\s*(ч|час)", text)
-    if h: hours = int(h.group(1))
-    m = re.search(r"(\d+)\s*(мин|минут|м)", text)
-    if m: minutes = int(m.group(1))
-    seconds = hours * 3600 + minutes * 60
-    pretty = []
-    if hours: pretty.append(f"{hours}ч")
-    if minutes: pretty.append(f"{minutes}мин" if hours else f"{minutes} мин")
-    return seconds, " ".join(pretty) or "30 мин"
+def expense_to_usd(amount, currency, rates: Optional[tuple] = None):
+    key = currency_key(currency)
+    return amount * rate_to_usd(key, rates) if key else amount
 
 
 def find_booking_index(chat_str: str, bid: int) -> Optional[int]:
@@ -334,10 +622,41 @@ def personal_kb(bid: int, done: bool = False, cancelled: bool = False, deleted:
     return InlineKeyboardMarkup(inline_keyboard=kb) if kb else None
 
 
-async def refresh_board(chat_id: int):
-    chat_str = str(chat_id)
-    await ensure_chat(chat_id)
-    chat_data = data["chats"][chat_str]
+# ==================== ДОСКА БРОНЕЙ ====================
+# Изменения смены копятся BOARD_DEBOUNCE секунд, потом доска рендерится один раз.
+# Текст не изменился — вызова нет; доска всё ещё последнее сообщение чата —
+# правим её на месте; иначе удаляем старую и выкладываем заново внизу.
+BOARD_DEBOUNCE = 1.5
+
+board_pending = {}  # {chat_id: задача отложенного обновления}
+board_locks = {}    # {chat_id: asyncio.Lock} — одно обновление доски чата за раз
+board_hashes = {}   # {chat_id: hash текста, который сейчас на доске}
+latest_msg = {}     # {chat_id: message_id последнего известного сообщения чата}
+board_stats = {"requests": 0, "renders": 0, "calls": 0, "skipped": 0, "edits": 0, "reposts": 0}
+
+
+def note_message(chat_id: int, message_id: int):
+    """Запоминаем самое свежее сообщение чата (id в чате растут монотонно)."""
+    if message_id > latest_msg.get(chat_id, 0):
+        latest_msg[chat_id] = message_id
+
+
+@dp.message.outer_middleware()
+async def track_incoming(handler, event: types.Message, data_):
+    note_message(event.chat.id, event.message_id)
+    return await handler(event, data_)
+
+
+@bot.session.middleware()
+async def track_outgoing(make_request, bot_, method):
+    response = await make_request(bot_, method)
+    result = getattr(response, "result", None)
+    if isinstance(result, types.Message):
+        note_message(result.chat.id, result.message_id)
+    return response
+
+
+def render_board(chat_data: dict) -> str:
     bookings = sorted(chat_data["bookings"], key=lambda x: time_key(x["time"]))
 
     header = f"<b>Брони на {chat_data['date']} — {chat_data['chat_title']} (смена)</b>\n"
@@ -354,39 +673,196 @@ async def refresh_board(chat_id: int):
             elif b.get("cancelled"):
                 text = f"<s>{text} Не пришёл</s>"
             lines.append(text)
+    return "\n".join(lines)
+
+
+async def refresh_board(chat_id: int):
+    """Помечает доску чата устаревшей; обновится один раз через BOARD_DEBOUNCE секунд."""
+    board_stats["requests"] += 1
+    task = board_pending.get(chat_id)
+    if task is None or task.done():
+        board_pending[chat_id] = asyncio.create_task(_board_after_delay(chat_id))
+
+
+async def _board_after_delay(chat_id: int):
+    await asyncio.sleep(BOARD_DEBOUNCE)
+    # Изменения, пришедшие во время отрисовки, запланируют следующее обновление
+    board_pending.pop(chat_id, None)
+    try:
+        await update_board(chat_id)
+    except Exception as e:
+        print(f"Ошибка обновления доски {chat_id}: {e}")
+
+
+@in_lane(BOARD)
+async def update_board(chat_id: int):
+    async with board_locks.setdefault(chat_id, asyncio.Lock()):
+        chat_str = str(chat_id)
+        await ensure_chat(chat_id)
+        chat_data = data["chats"][chat_str]
+        full_text = render_board(chat_data)
+        text_hash = hash(full_text)
+        board_stats["renders"] += 1
+        msg_id = chat_data.get("board_msg")
+
+        # Доска всё ещё внизу чата — правим на месте (или ничего не делаем)
+        if msg_id and chat_id in latest_msg and msg_id >= latest_msg[chat_id]:
+            if board_hashes.get(chat_id) == text_hash:
+                board_stats["skipped"] += 1
+                return
+            try:
+                board_stats["calls"] += 1
+                await bot.edit_message_text(full_text, chat_id=chat_id, message_id=msg_id, parse_mode=ParseMode.HTML)
+                board_stats["edits"] += 1
+                board_hashes[chat_id] = text_hash
+                return
+            except TelegramBadRequest as e:
+                if "not modified" in str(e):
+                    board_hashes[chat_id] = text_hash
+                    return
+                # Доску удалили руками — выкладываем заново
+
+        # Удаляем старое сообщение-доску и постим новое внизу
+        if msg_id:
+            try:
+                board_stats["calls"] += 1
+                await bot.delete_message(chat_id, msg_id)
+            except:
+                pass
+
+        board_stats["calls"] += 1
+        msg = await bot.send_message(chat_id, full_text, parse_mode=ParseMode.HTML)
+        board_stats["reposts"] += 1
+        board_hashes[chat_id] = text_hash
+        note_message(chat_id, msg.message_id)
+        chat_data["board_msg"] = msg.message_id
+        journal("meta", chat_str, fields={"board_msg": msg.message_id})
+
+
+def board_calls_saved() -> int:
+    """Сколько вызовов Bot API сэкономили: раньше каждое обновление — удаление + отправка."""
+    return board_stats["requests"] * 2 - board_stats["calls"]
+
+
+# ==================== ТАЙМЕРЫ БРОНЕЙ ====================
+# Все таймеры — в одной min-куче по ближайшему сроку, её ждёт одна задача
+# timer_loop. Сроки (бронь, чат, когда «Время вышло!», когда удалить
+# «Таймер запущен») пишутся в TIMERS_FILE и переживают перезапуск: при старте
+# просроченные срабатывают сразу, а устаревшие сообщения о запуске удаляются.
+TIMERS_FILE = "timers.json"
+TIMER_CLEANUP_DELAY = 25  # сек после «Время вышло!» до удаления «Таймер запущен»
+TIMER_LATE_NOTE = 60      # опоздали больше — пишем об этом в сообщении
+
+timer_records = {}  # {id: {"id", "chat_id", "bid", "label", "start_msg", "fire_at", "cleanup_at", "fired"}}
+timer_heap = []     # [(срок, id, запись)] — срок fire_at, после срабатывания cleanup_at
+timer_ids = itertools.count(1)
+timer_wakeup = asyncio.Event()
+
+
+def _push_timer(record: dict):
+    deadline = record["cleanup_at"] if record["fired"] else record["fire_at"]
+    heapq.heappush(timer_heap, (deadline, record["id"], record))
+    timer_wakeup.set()
+
+
+def _write_timers(full: bool):
+    snapshot = [dict(r) for r in timer_records.values()]
+    return lambda: write_json_atomic(TIMERS_FILE, snapshot)
 
-    full_text = "\n".join(lines)
-    msg_id = chat_data.get("board_msg")
 
-    # Удаляем старое сообщение-доску и постим новое внизу
-    if msg_id:
+writer.register("timers", _write_timers)
+
+
+def load_timers():
+    global timer_ids
+    try:
+        with open(TIMERS_FILE, "r", encoding="utf-8") as f:
+            records = json.load(f)
+    except FileNotFoundError:
+        records = []
+    timer_records.clear()
+    timer_heap.clear()
+    for record in records:
+        timer_records[record["id"]] = record
+        _push_timer(record)
+    timer_ids = itertools.count(max(timer_records, default=0) + 1)
+    if records:
+        print(f"Таймеры: загружено {len(records)}, просроченные сработают сейчас")
+
+
+def schedule_timer(chat_id: int, bid: int, label: str, start_msg: int, duration: float):
+    now = time.time()
+    record = {
+        "id": next(timer_ids), "chat_id": chat_id, "bid": bid, "label": label, "start_msg": start_msg,
+        "fire_at": now + duration, "cleanup_at": now + duration + TIMER_CLEANUP_DELAY, "fired": False,
+    }
+    timer_records[record["id"]] = record
+    _push_timer(record)
+    writer.mark_dirty("timers")
+
+
+async def timer_loop():
+    """Единственная задача, которая ждёт: спит до ближайшего срока в куче."""
+    while True:
+        now = time.time()
+        while timer_heap and timer_heap[0][0] <= now:
+            _, _, record = heapq.heappop(timer_heap)
+            if record["fired"]:
+                asyncio.create_task(_cleanup_timer(record))
+            else:
+                asyncio.create_task(_fire_timer(record))
+        timer_wakeup.clear()
+        delay = timer_heap[0][0] - now if timer_heap else None
         try:
-            await bot.delete_message(chat_id, msg_id)
-        except:
+            await asyncio.wait_for(timer_wakeup.wait(), delay)
+        except asyncio.TimeoutError:
             pass
 
-    msg = await bot.send_message(chat_id, full_text, parse_mode=ParseMode.HTML)
-    chat_data["board_msg"] = msg.message_id
-    save_data()
+
+@in_lane(ALERT)
+async def _fire_timer(record: dict):
+    text = f"Время вышло!\n{record['label']}"
+    late = time.time() - record["fire_at"]
+    if late > TIMER_LATE_NOTE:
+        text += f"\n<i>(с опозданием {late / 60:.0f} мин — бот перезапускался)</i>"
+    try:
+        await bot.send_message(record["chat_id"], text, parse_mode=ParseMode.HTML)
+    except Exception as e:
+        print(f"Таймер брони {record['bid']} в чате {record['chat_id']}: {e}")
+    record["fired"] = True
+    record["cleanup_at"] = max(record["cleanup_at"], time.time() + TIMER_CLEANUP_DELAY)
+    _push_timer(record)
+    writer.mark_dirty("timers")
+
+
+@in_lane(ALERT)
+async def _cleanup_timer(record: dict):
+    try:
+        await bot.delete_message(record["chat_id"], record["start_msg"])
+    except:
+        pass
+    timer_records.pop(record["id"], None)
+    writer.mark_dirty("timers")
 
 
-# ==================== ТАЙМЕР ====================
+@in_lane(ALERT)
 async def booking_timer(chat_id: int, bid: int):
+    """«Таймер запущен» в чат и срок брони — в общую кучу таймеров."""
     chat_str = str(chat_id)
     idx = find_booking_index(chat_str, bid)
     if idx is None: return
     b = data["chats"][chat_str]["bookings"][idx]
     if b.get("deleted") or b.get("cancelled"): return
 
-    mins = max(1, b.get("duration_sec", 1800) // 60)
+    duration = b.get("duration_sec", 1800)
+    mins = max(1, duration // 60)
+    label = f"{b['time']} — {b['info']}"
     try:
-        start_msg = await bot.send_message(chat_id, f"Таймер запущен\n{b['time']} — {b['info']} — {mins} мин", parse_mode=ParseMode.HTML)
-        await asyncio.sleep(b.get("duration_sec", 1800))
-        await bot.send_message(chat_id, f"Время вышло!\n{b['time']} — {b['info']}", parse_mode=ParseMode.HTML)
-        await asyncio.sleep(25)
-        await bot.delete_message(chat_id, start_msg.message_id)
-    except:
-        pass
+        start_msg = await bot.send_message(chat_id, f"Таймер запущен\n{label} — {mins} мин", parse_mode=ParseMode.HTML)
+    except Exception as e:
+        print(f"Не удалось запустить таймер брони {bid} в чате {chat_id}: {e}")
+        return
+    schedule_timer(chat_id, bid, label, start_msg.message_id, duration)
 
 
 # ==================== ДОБАВЛЕНИЕ БРОНИ ====================
@@ -396,10 +872,9 @@ async def add_booking(m: types.Message, state: FSMContext):
     text = m.text.strip()
     if len(text.split()) < 2: return
 
-    time_part = text.split(maxsplit=1)[0]
-    rest = text[len(time_part):].strip()
-    sec, pretty = parse_duration(rest)
-    info = re.sub(r"\d+\s*(ч|час|мин|минут|м)\b.*$", "", rest, flags=re.I).strip() or "Без имени"
+    parsed = parse_booking_line(text)
+    time_part, info = parsed["time"], parsed["info"]
+    sec, pretty = parsed["duration_sec"], parsed["duration"]
 
     chat_str = str(m.chat.id)
     await ensure_chat(m.chat.id)
@@ -411,23 +886,75 @@ async def add_booking(m: types.Message, state: FSMContext):
         "author_id": m.from_user.id, "done": False, "cancelled": False, "deleted": False,
         "reply_msg_id": None,
         "original_text": text.strip(),
+        "amounts": parsed["amounts"], "operator": parsed["operator"],
     }
     data["chats"][chat_str]["bookings"].append(booking)
-    save_data()
 
     sorted_b = sorted(data["chats"][chat_str]["bookings"], key=lambda x: time_key(x["time"]))
     pos = next((i + 1 for i, b in enumerate(sorted_b) if b["id"] == bid), 0)
 
-    reply = await m.reply(f"Добавлено!\n{pos}. {time_part} — {info} ({pretty})", reply_markup=personal_kb(bid))
-    booking["reply_msg_id"] = reply.message_id
-    save_data()
+    try:
+        reply = await m.reply(f"Добавлено!\n{pos}. {time_part} — {info} ({pretty})", reply_markup=personal_kb(bid))
+        booking["reply_msg_id"] = reply.message_id
+    finally:
+        journal("add", chat_str, booking=booking)
     await refresh_board(m.chat.id)
 
 
+# ==================== ФОНОВЫЕ ДЕЙСТВИЯ ПО ЧАТАМ ====================
+# Нажатие кнопки: бронь меняется, пишется в журнал и нажатие подтверждается
+# сразу, а таймер и клавиатура брони уходят в фоновую очередь чата. Внутри
+# чата очередь выполняется по порядку; ошибка одного действия не держит остальные.
+ACK_SAMPLES = 500
+
+chat_pipelines = {}  # {chat_id: asyncio.Queue [(что, корутина-фабрика)]}
+pipeline_stats = {"jobs": 0, "errors": 0, "max_depth": 0, "last_error": ""}
+ack_latency = deque(maxlen=ACK_SAMPLES)  # сек от получения нажатия до ответа на него
+
+
+@dp.callback_query.outer_middleware()
+async def stamp_callback(handler, event: types.CallbackQuery, data_):
+    data_["received_at"] = asyncio.get_running_loop().time()
+    return await handler(event, data_)
+
+
+def record_ack(received_at: Optional[float]):
+    if received_at is not None:
+        ack_latency.append(asyncio.get_running_loop().time() - received_at)
+
+
+def defer(chat_id: int, what: str, job):
+    """Ставит job() в фоновую очередь чата."""
+    queue = chat_pipelines.get(chat_id)
+    if queue is None:
+        queue = chat_pipelines[chat_id] = asyncio.Queue()
+        asyncio.create_task(_run_pipeline(chat_id, queue))
+    queue.put_nowait((what, job))
+    pipeline_stats["max_depth"] = max(pipeline_stats["max_depth"], queue.qsize())
+
+
+async def _run_pipeline(chat_id: int, queue: asyncio.Queue):
+    while True:
+        what, job = await queue.get()
+        try:
+            await job()
+        except Exception as e:
+            pipeline_stats["errors"] += 1
+            pipeline_stats["last_error"] = f"{what} ({chat_id}): {e}"
+            print(f"Фоновое действие «{what}» в чате {chat_id} не выполнено: {e}")
+        pipeline_stats["jobs"] += 1
+
+
+def ack_latency_text() -> str:
+    if not ack_latency:
+        return "нажатий ещё не было"
+    ms = sorted(x * 1000 for x in ack_latency)
+    return f"медиана {ms[len(ms) // 2]:.0f} мс, p95 {ms[min(len(ms) - 1, int(len(ms) * 0.95))]:.0f} мс, макс {ms[-1]:.0f} мс"
+
+
 # ==================== ДЕЙСТВИЯ ====================
 @dp.callback_query(F.data.startswith(("done:", "cancel:", "delete:")))
-async def actions(c: types.CallbackQuery):
-    await c.answer()
+async def actions(c: types.CallbackQuery, received_at: Optional[float] = None):
     action, payload = c.data.split(":", 1)
     bid = int(payload)
     chat_id = c.message.chat.id
@@ -442,26 +969,38 @@ async def actions(c: types.CallbackQuery):
         await c.answer("Это не твоя бронь!", show_alert=True)
         return
 
+    alert = None
     if action == "done":
         if not b.get("done"):
             b["done"] = True
             b["cancelled"] = False
-            asyncio.create_task(booking_timer(chat_id, bid))
-            await c.answer("Клиент пришёл — таймер запущен!", show_alert=True)
+            alert = "Клиент пришёл — таймер запущен!"
     elif action == "cancel":
         b["cancelled"] = True
         b["done"] = False
     elif action == "delete":
         b["deleted"] = True
 
-    save_data()
-    await refresh_board(chat_id)
-    if b.get("reply_msg_id"):
+    # Запись в журнал — O(1), делаем до подтверждения; сеть (таймер, доска, клавиатура) — в фоне
+    journal(action, chat_str, booking=b)
+    await c.answer(alert, show_alert=bool(alert))
+    record_ack(received_at)
+    if alert:
+        defer(chat_id, "таймер", functools.partial(booking_timer, chat_id, bid))
+
+    async def update_keyboard():
+        if not b.get("reply_msg_id"):
+            return
         try:
             await bot.edit_message_reply_markup(chat_id, b["reply_msg_id"], reply_markup=personal_kb(bid, b.get("done"), b.get("cancelled"), b.get("deleted")))
-        except:
+        except TelegramBadRequest as e:
+            if "not modified" in str(e):
+                return
             b["reply_msg_id"] = None
-            save_data()
+            journal("update", chat_str, booking=b)
+
+    await refresh_board(chat_id)
+    defer(chat_id, "клавиатура брони", update_keyboard)
 
 
 # ==================== РЕДАКТИРОВАНИЕ ====================
@@ -528,32 +1067,33 @@ async def apply_edit(m: types.Message, state: FSMContext):
         await m.reply("Начни с времени: 17:30 ...")
         return
 
-    time_part = new_text.split(maxsplit=1)[0]
-    rest = new_text[len(time_part):].strip()
-    sec, pretty = parse_duration(rest)
-    info = re.sub(r"\d+\s*(ч|час|мин|минут|м)\b.*$", "", rest, flags=re.I).strip() or "Без имени"
+    parsed = parse_booking_line(new_text)
+    time_part, info = parsed["time"], parsed["info"]
+    sec, pretty = parsed["duration_sec"], parsed["duration"]
 
     b.update({"time": time_part, "info": info, "duration": pretty, "duration_sec": sec,
               "original_text": new_text,
+              "amounts": parsed["amounts"], "operator": parsed["operator"],
               "done": False, "cancelled": False, "deleted": False})
-    save_data()
 
     sorted_b = sorted(data["chats"][chat_str]["bookings"], key=lambda x: time_key(x["time"]))
     pos = next((i + 1 for i, bb in enumerate(sorted_b) if bb["id"] == bid), 0)
     reply_text = f"Обновлено!\n{pos}. {time_part} — {info} ({pretty})"
 
-    if b.get("reply_msg_id"):
-        try:
-            await bot.edit_message_text(chat_id=m.chat.id, message_id=b["reply_msg_id"],
-                                        text=reply_text, reply_markup=personal_kb(bid))
-        except:
+    try:
+        if b.get("reply_msg_id"):
+            try:
+                await bot.edit_message_text(chat_id=m.chat.id, message_id=b["reply_msg_id"],
+                                            text=reply_text, reply_markup=personal_kb(bid))
+            except:
+                r = await m.reply(reply_text, reply_markup=personal_kb(bid))
+                b["reply_msg_id"] = r.message_id
+        else:
             r = await m.reply(reply_text, reply_markup=personal_kb(bid))
             b["reply_msg_id"] = r.message_id
-    else:
-        r = await m.reply(reply_text, reply_markup=personal_kb(bid))
-        b["reply_msg_id"] = r.message_id
+    finally:
+        journal("edit", chat_str, booking=b)
 
-    save_data()
     await m.reply("Бронь обновлена!")
 
     try:
@@ -612,13 +1152,19 @@ async def cmd_expense(m: types.Message):
         "author_id": m.from_user.id
     }
     data["chats"][chat_str]["expenses"].append(expense)
-    save_data()
+    journal("expenses", chat_str, expenses=data["chats"][chat_str]["expenses"])
 
     await m.reply(f"Добавлен расход: {exp_type} {amount:.2f} USD\n{comment if comment else ''}")
 
 
 # ==================== ОБЩАЯ ФУНКЦИЯ ДЛЯ ГЕНЕРАЦИИ СООБЩЕНИЯ ====================
 async def generate_summary_text(chat_str: str) -> str:
+    return shift_summary(chat_str)["text"]
+
+
+def shift_summary(chat_str: str) -> dict:
+    """Итоги текущей смены чата: {"text", "chat_id", "totals" {валюта: сумма}, "usd",
+    "operators" {оператор: USD}} — текст для владельцев и числа для общего дайджеста."""
     update_exchange_rates()
 
     chat_data = data["chats"][chat_str]
@@ -641,31 +1187,19 @@ async def generate_summary_text(chat_str: str) -> str:
 
     board_text = "\n".join(lines)
 
-    totals = {"лари": 0, "доллар": 0, "евро": 0, "крипта": 0, "драм": 0}
+    totals = {"лари": 0, "$": 0, "евро": 0, "крипта": 0, "драм": 0}
     came = [b for b in bookings if b.get("done")]
 
+    # Один разбор на бронь: и общие итоги, и ЗП операторов
     total_usd = 0
+    operator_money = {}
     for b in came:
-        text = (b.get("original_text") or b["info"] or "").lower()
-        matches = re.findall(r"(\d+)\s*(лари|лaри|лар|lari|доллар[аов]?|dollar|usd|\$|евро|euro|€|крипта|crypto|usdt|btc|eth|драм|драмм|драмов|драма|dram|amd|֏)", text)
-        for amount_str, currency in matches:
-            amt = int(amount_str)
-            currency = currency.lower()
-            if any(x in currency for x in ["лари", "лар", "lari"]):
-                totals["лари"] += amt
-                total_usd += amt * current_lari_to_usd
-            elif any(x in currency for x in ["доллар", "dollar", "usd", "$"]):
-                totals["доллар"] += amt
-                total_usd += amt
-            elif any(x in currency for x in ["евро", "euro", "€"]):
-                totals["евро"] += amt
-                total_usd += amt * current_euro_to_usd
-            elif any(x in currency for x in ["крипта", "crypto", "usdt", "btc", "eth"]):
-                totals["крипта"] += amt
-                total_usd += amt
-            elif any(x in currency for x in ["драм", "драмм", "драмов", "драма", "dram", "amd", "֏"]):
-                totals["драм"] += amt
-                total_usd += amt * current_amd_to_usd
+        usd, currencies = extract_booking_usd(b)
+        for cur, amt in currencies.items():
+            totals[cur] = totals.get(cur, 0) + amt
+        total_usd += usd
+        name = extract_operator_name(b)
+        operator_money[name] = operator_money.get(name, 0) + usd
 
     result = "\n\n<b>Общие итоги смены:</b>\n"
     has_money = False
@@ -673,9 +1207,9 @@ async def generate_summary_text(chat_str: str) -> str:
         half = totals["лари"] / 2
         result += f"Лари: {totals['лари']} (на двоих: {half:.0f})\n"
         has_money = True
-    if totals["доллар"]:
-        half = totals["доллар"] / 2
-        result += f"Доллары: {totals['доллар']} (на двоих: {half:.2f})\n"
+    if totals["$"]:
+        half = totals["$"] / 2
+        result += f"Доллары: {totals['$']} (на двоих: {half:.2f})\n"
         has_money = True
     if totals["евро"]:
         half = totals["евро"] / 2
@@ -707,32 +1241,6 @@ async def generate_summary_text(chat_str: str) -> str:
         result += f"Итого расходов: {total_expenses:.2f} USD"
 
     # ЗП операторам (от полной суммы, без вычета расходов)
-    operator_money = {}
-    for b in came:
-        text = (b.get("original_text") or b["info"] or "").lower()
-        matches = re.findall(r"(\d+)\s*(лари|лaри|лар|lari|доллар[аов]?|dollar|usd|\$|евро|euro|€|крипта|crypto|usdt|btc|eth|драм|драмм|драмов|драма|dram|amd|֏)", text)
-        amount_usd = 0
-        for amount_str, currency in matches:
-            amt = int(amount_str)
-            currency = currency.lower()
-            if any(x in currency for x in ["лари", "лар", "lari"]):
-                amount_usd += amt * current_lari_to_usd
-            elif any(x in currency for x in ["доллар", "dollar", "usd", "$"]):
-                amount_usd += amt
-            elif any(x in currency for x in ["евро", "euro", "€"]):
-                amount_usd += amt * current_euro_to_usd
-            elif any(x in currency for x in ["крипта", "crypto", "usdt", "btc", "eth"]):
-                amount_usd += amt
-            elif any(x in currency for x in ["драм", "драмм", "драмов", "драма", "dram", "amd", "֏"]):
-                amount_usd += amt * current_amd_to_usd
-
-        info_words = b["info"].strip().split()
-        name = info_words[0] if info_words else "Неизвестно"
-
-        if name not in operator_money:
-            operator_money[name] = 0
-        operator_money[name] += amount_usd
-
     if operator_money:
         result += "\n\n<b>ЗП операторам (от полной суммы):</b>\n"
         for name, usd in operator_money.items():
@@ -753,7 +1261,39 @@ async def generate_summary_text(chat_str: str) -> str:
                 result += f"{aname}: {asal:.2f} USD ({apct*100:.1f}%)\n"
 
     full_message = header + board_text + result
-    return full_message
+    return {"text": full_message, "chat_id": chat_str, "totals": totals,
+            "usd": total_usd, "operators": operator_money}
+
+
+# ==================== РАССЫЛКА НЕСКОЛЬКИМ ПОЛУЧАТЕЛЯМ ====================
+FANOUT_LIMIT = 8  # одновременных запросов в одной рассылке (лимиты чатов держит outbox)
+
+
+async def fan_out(jobs, limit: int = FANOUT_LIMIT) -> dict:
+    """jobs — [(получатель, корутина)]; выполняются параллельно, не больше limit за раз.
+    Возвращает {получатель: None если доставлено, иначе исключение}."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    results = await asyncio.gather(*(run(coro) for _, coro in jobs), return_exceptions=True)
+    return {recipient: (result if isinstance(result, BaseException) else None)
+            for (recipient, _), result in zip(jobs, results)}
+
+
+async def broadcast(chat_ids, text: str, **kwargs) -> dict:
+    """Одно и то же сообщение всем chat_ids — см. fan_out."""
+    return await fan_out([(chat_id, bot.send_message(chat_id, text, **kwargs)) for chat_id in chat_ids])
+
+
+def log_failures(what: str, results: dict) -> int:
+    """Печатает недоставленные; возвращает, сколько доставлено."""
+    for recipient, error in results.items():
+        if error is not None:
+            print(f"{what}: не доставлено {recipient}: {error}")
+    return sum(error is None for error in results.values())
 
 
 # ==================== /summary ====================
@@ -768,18 +1308,16 @@ async def cmd_summary(m: types.Message):
 
     full_message = await generate_summary_text(chat_str)
 
-    for owner_id in OWNERS:
-        try:
-            await bot.send_message(owner_id, full_message, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            print(f"Не удалось отправить саммари владельцу {owner_id}: {e}")
+    with lane(BULK):
+        results = await broadcast(OWNERS, full_message, parse_mode=ParseMode.HTML)
+    log_failures("Саммари владельцам", results)
 
     await m.reply("Проверь личку!")
 
 
 # ==================== АВТО ИТОГИ В 08:59 ====================
 def archive_shift(chat_str: str):
-    """Сохраняет текущую смену в history.json перед сбросом."""
+    """Сохраняет текущую смену в архив (сегмент её месяца) перед сбросом."""
     chat_data = data["chats"].get(chat_str)
     if not chat_data:
         return
@@ -791,15 +1329,50 @@ def archive_shift(chat_str: str):
         "chat_id": chat_str,
         "date": chat_data.get("date", ""),
         "chat_title": chat_data.get("chat_title", ""),
-        "bookings": list(bookings),
-        "expenses": list(chat_data.get("expenses", [])),
+        # Копии, а не ссылки: живая бронь после архивации не должна менять архив
+        "bookings": copy.deepcopy(bookings),
+        "expenses": copy.deepcopy(chat_data.get("expenses", [])),
         "archived_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
     }
-    history["shifts"].append(shift_record)
-    save_history()
+    history.add(shift_record)
+    add_shift_to_rollups(shift_record)
+    index_archived_shift(shift_record)
+    touch_dates(shift_record["date"])
+    save_history(added=[shift_record])
+
+
+def digest_pieces(summaries: list) -> Iterator[str]:
+    """Дайджест итогов смены: секция на каждый чат и общий итог по всем чатам."""
+    yield f"<b>Итоги смены — {len(summaries)} чат(ов)</b>\n"
+    totals = {}
+    total_usd = 0
+    operator_money = {}
+    for summary in summaries:
+        yield "\n" + "━" * 30 + "\n"
+        yield summary["text"] + "\n"
+        for cur, amt in summary["totals"].items():
+            totals[cur] = totals.get(cur, 0) + amt
+        total_usd += summary["usd"]
+        for name, usd in summary["operators"].items():
+            operator_money[name] = operator_money.get(name, 0) + usd
+
+    yield "\n" + "━" * 30 + "\n"
+    yield "<b>Общий итог по всем чатам:</b>\n"
+    for cur, label in (("лари", "Лари"), ("$", "Доллары"), ("евро", "Евро"), ("крипта", "Крипта"), ("драм", "Драмы")):
+        if totals.get(cur):
+            yield f"{label}: {totals[cur]} (на двоих: {totals[cur] / 2:.0f})\n"
+    yield f"Общая выручка: {total_usd:.2f} USD\n"
+    yield f"На двоих: {total_usd / 2:.2f} USD\n"
+    if operator_money:
+        yield "\n<b>ЗП операторам за все чаты:</b>\n"
+        for name in sorted(operator_money):
+            percent = get_salary_percent(name)
+            yield f"{name}: {operator_money[name] * percent:.2f} USD ({int(percent*100)}%)\n"
 
 
+@in_lane(BULK)
 async def send_summary_for_all_chats():
+    summaries = []
     for chat_id in ALLOWED_CHATS:
         try:
             chat_str = str(chat_id)
@@ -809,12 +1382,26 @@ async def send_summary_for_all_chats():
             # Архивируем смену перед отправкой итогов
             archive_shift(chat_str)
 
-            full_message = await generate_summary_text(chat_str)
-
-            for owner_id in OWNERS:
-                await bot.send_message(owner_id, full_message, parse_mode=ParseMode.HTML)
+            # Итоги чата считаются один раз — для всех владельцев
+            summaries.append(shift_summary(chat_str))
         except Exception as e:
-            print(f"Ошибка при отправке итогов для чата {chat_id}: {e}")
+            print(f"Ошибка при подготовке итогов для чата {chat_id}: {e}")
+
+    if SUMMARY_DIGEST:
+        # Один дайджест на владельца, упакованный в минимум сообщений
+        chunks = list(pack_chunks(digest_pieces(summaries))) if summaries else []
+
+        async def send_digest(owner_id):
+            for chunk in chunks:
+                await bot.send_message(owner_id, chunk, parse_mode=ParseMode.HTML)
+
+        jobs = [(owner_id, send_digest(owner_id)) for owner_id in OWNERS] if chunks else []
+    else:
+        jobs = [((summary["chat_id"], owner_id), bot.send_message(owner_id, summary["text"], parse_mode=ParseMode.HTML))
+                for summary in summaries for owner_id in OWNERS]
+
+    # Всем владельцам разом — время доставки по самому медленному
+    log_failures("Итоги смены", await fan_out(jobs))
 
     # Очистка старых записей раз в день
     cleanup_old_history()
@@ -836,7 +1423,7 @@ async def cmd_new_shift(m: types.Message):
     data["chats"][chat_str]["date"] = current_date
     data["chats"][chat_str]["next_id"] = 1
     data["chats"][chat_str]["chat_title"] = chat_title
-    save_data()
+    journal("new_shift", chat_str, date=current_date, chat_title=chat_title)
     await m.reply("Смена сброшена вручную!")
     await refresh_board(m.chat.id)
 
@@ -861,40 +1448,89 @@ DAY_NAMES = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
 MAX_MSG_LEN = 4000
 
 
-async def safe_send(target, text: str, edit: bool = False):
-    """Отправляет длинный текст, разбивая на части по 4000 символов.
-    target — Message объект. edit=True — первую часть edit, остальные send."""
-    if len(text) <= MAX_MSG_LEN:
-        if edit:
-            await target.edit_text(text, parse_mode=ParseMode.HTML)
-        else:
-            await target.answer(text, parse_mode=ParseMode.HTML)
-        return
-
-    # Разбиваем по строкам, чтобы не резать теги
-    lines = text.split("\n")
-    parts = []
-    current = ""
-    for line in lines:
-        if len(current) + len(line) + 1 > MAX_MSG_LEN:
-            if current:
-                parts.append(current)
-            current = line
-        else:
-            current = current + "\n" + line if current else line
-    if current:
-        parts.append(current)
-
-    for i, part in enumerate(parts):
-        if i == 0 and edit:
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z]+)[^>]*>")
+TAG_RESERVE = 100  # запас в части под закрывающие теги
+
+
+def _safe_cut(text: str, n: int) -> int:
+    """Позиция ≤ n, на которой можно разрезать строку: не внутри тега и не внутри &сущности;."""
+    seg = text[:n]
+    cut = n
+    lt = seg.rfind("<")
+    if lt > seg.rfind(">"):
+        cut = lt
+    amp = seg.rfind("&", 0, cut)
+    if amp > seg.rfind(";", 0, cut):
+        cut = amp
+    space = seg.rfind(" ", 0, cut)
+    if space > cut // 2:
+        cut = space + 1
+    return cut or n
+
+
+def pack_chunks(pieces, limit: int = MAX_MSG_LEN):
+    """Собирает куски текста (строки/секции отчёта) в сообщения не длиннее limit.
+    Режет по строкам; тег, открытый на границе части, закрывается в ней
+    и открывается заново в следующей. Части отдаются по мере готовности."""
+    budget = limit - TAG_RESERVE
+    open_tags = []  # [(имя, открывающий тег)] — не закрытые к текущему месту
+    buf, size, has_text = [], 0, False
+
+    def track(text):
+        for m in _TAG_RE.finditer(text):
+            name = m.group(2).lower()
+            if not m.group(1):
+                open_tags.append((name, m.group(0)))
+                continue
+            for i in range(len(open_tags) - 1, -1, -1):
+                if open_tags[i][0] == name:
+                    del open_tags[i]
+                    break
+
+    def flush():
+        nonlocal buf, size, has_text
+        chunk = "".join(buf).rstrip("\n") + "".join(f"</{name}>" for name, _ in reversed(open_tags))
+        reopen = "".join(tag for _, tag in open_tags)
+        buf, size, has_text = [reopen], len(reopen), False
+        return chunk
+
+    for piece in pieces:
+        for line in piece.splitlines(keepends=True):
+            while size + len(line) > budget:
+                if has_text:
+                    yield flush()
+                    continue
+                cut = _safe_cut(line, budget - size)  # одна строка длиннее сообщения
+                buf.append(line[:cut])
+                track(line[:cut])
+                has_text = True
+                yield flush()
+                line = line[cut:]
+            buf.append(line)
+            size += len(line)
+            track(line)
+            has_text = has_text or bool(line.strip())
+    if has_text:
+        yield flush()
+
+
+async def send_chunks(target, chunks, edit: bool = False) -> bool:
+    """Отправляет части по одной, как только они готовы. edit=True — первая часть через edit.
+    Возвращает False, если частей не было."""
+    sent = False
+    for part in chunks:
+        if not sent and edit:
             await target.edit_text(part, parse_mode=ParseMode.HTML)
-        elif i == 0:
-            await target.answer(part, parse_mode=ParseMode.HTML)
         else:
-            if edit:
-                await target.answer(part, parse_mode=ParseMode.HTML)
-            else:
-                await target.answer(part, parse_mode=ParseMode.HTML)
+            await target.answer(part, parse_mode=ParseMode.HTML)
+        sent = True
+    return sent
+
+
+async def safe_send(target, text: str, edit: bool = False):
+    """Отправляет длинный текст, разбивая на части по MAX_MSG_LEN без разрыва HTML-тегов.
+    target — Message объект. edit=True — первую часть edit, остальные send."""
+    await send_chunks(target, pack_chunks([text]), edit)
 
 
 def parse_date_str(s: str) -> Optional[datetime]:
@@ -911,67 +1547,71 @@ def parse_date_str(s: str) -> Optional[datetime]:
 
 
 def get_shifts_for_period(date_from: datetime, date_to: datetime) -> list:
-    """Возвращает архивные смены за период + текущие смены если попадают."""
+    """Возвращает [(дата, смена)]: архивные смены за период + текущие смены если попадают.
+    Даты архива берутся из индекса — строки не разбираются заново."""
     excluded = set(str(c) for c in EXCLUDED_FROM_REPORTS)
-    result = []
-    for shift in history.get("shifts", []):
-        if shift.get("chat_id", "") in excluded:
-            continue
-        d = parse_date_str(shift.get("date", ""))
-        if d and date_from <= d <= date_to:
-            result.append(shift)
+    result = [(date.fromordinal(ordinal), shift) for ordinal, shift in history.index.between(date_from, date_to)
+              if shift.get("chat_id", "") not in excluded]
     # Добавляем текущие смены из data, если их дата попадает в период
-    for chat_str, chat_data in data.get("chats", {}).items():
+    for chat_str, chat_data in list(data.get("chats", {}).items()):
         if chat_str in excluded:
             continue
         d = parse_date_str(chat_data.get("date", ""))
         if d and date_from <= d <= date_to:
             if chat_data.get("bookings"):
-                result.append({
+                result.append((d.date(), {
                     "chat_id": chat_str,
                     "date": chat_data["date"],
                     "chat_title": chat_data.get("chat_title", ""),
-                    "bookings": chat_data["bookings"],
-                    "expenses": chat_data.get("expenses", []),
-                })
+                    "bookings": [dict(b) for b in chat_data["bookings"]],
+                    "expenses": list(chat_data.get("expenses", [])),
+                }))
     return result
 
 
-def extract_booking_usd(booking: dict) -> tuple[float, dict]:
-    """Извлекает сумму в USD из брони. Возвращает (usd, {валюта: сумма})."""
-    text = (booking.get("original_text") or booking.get("info") or "").lower()
-    matches = re.findall(
-        r"(\d[\d\s]*)\s*(лари|лaри|лар|lari|доллар[аов]?|dollar|usd|\$|евро|euro|€|крипта|crypto|usdt|btc|eth|драм|драмм|драмов|драма|dram|amd|֏)",
-        text
-    )
-    total_usd = 0.0
-    currencies = {}
-    for amount_str, currency in matches:
-        amt = int(amount_str.replace(" ", ""))
-        currency = currency.lower()
-        if any(x in currency for x in ["лари", "лар", "lari"]):
-            currencies["лари"] = currencies.get("лари", 0) + amt
-            total_usd += amt * current_lari_to_usd
-        elif any(x in currency for x in ["доллар", "dollar", "usd", "$"]):
-            currencies["$"] = currencies.get("$", 0) + amt
-            total_usd += amt
-        elif any(x in currency for x in ["евро", "euro", "€"]):
-            currencies["евро"] = currencies.get("евро", 0) + amt
-            total_usd += amt * current_euro_to_usd
-        elif any(x in currency for x in ["крипта", "crypto", "usdt", "btc", "eth"]):
-            currencies["крипта"] = currencies.get("крипта", 0) + amt
-            total_usd += amt
-        elif any(x in currency for x in ["драм", "драмм", "драмов", "драма", "dram", "amd", "֏"]):
-            currencies["драм"] = currencies.get("драм", 0) + amt
-            total_usd += amt * current_amd_to_usd
-    return total_usd, currencies
+def extract_booking_usd(booking: dict, rates: Optional[tuple] = None) -> tuple[float, dict]:
+    """Сумма брони в USD. Возвращает (usd, {валюта: сумма}).
+    Берёт разобранные при вводе amounts; текст разбирается только у старых записей."""
+    currencies = booking.get("amounts")
+    if currencies is None:
+        text = booking.get("original_text") or booking.get("info") or ""
+        currencies = parse_booking_line(text)["amounts"]
+    return currencies_to_usd(currencies, rates), dict(currencies)
 
 
 def extract_operator_name(booking: dict) -> str:
+    if booking.get("operator"):
+        return booking["operator"]
     info_words = booking.get("info", "").strip().split()
     return info_words[0] if info_words else "Неизвестно"
 
 
+def backfill_parsed_fields(bookings: list) -> int:
+    """Дописывает amounts / operator в старые брони. Возвращает число дополненных."""
+    count = 0
+    for b in bookings:
+        if "amounts" in b and "operator" in b:
+            continue
+        parsed = parse_booking_line(b.get("original_text") or b.get("info") or "")
+        b.setdefault("amounts", parsed["amounts"])
+        info_words = b.get("info", "").strip().split()
+        b.setdefault("operator", info_words[0] if info_words else "Неизвестно")
+        count += 1
+    return count
+
+
+def migrate_parsed_fields():
+    """Одноразово: amounts / operator для архива и текущих смен, записанных до их появления."""
+    archived = sum(backfill_parsed_fields(shift.get("bookings", [])) for shift in history.all())
+    live = sum(backfill_parsed_fields(chat.get("bookings", [])) for chat in data.get("chats", {}).values())
+    if archived:
+        save_history()
+    if live:
+        save_data()
+    if archived or live:
+        print(f"Дополнены суммы броней: архив — {archived}, текущие смены — {live}")
+
+
 def extract_girl_name(chat_title: str) -> str:
     """Извлекает имя девочки из названия чата, например '💞Ария💞Тбилиси 28.01' -> 'Ария'"""
     m = re.search(r"💞([^💞]+)💞", chat_title)
@@ -981,40 +1621,405 @@ def extract_girl_name(chat_title: str) -> str:
     return chat_title.split()[0] if chat_title else "Неизвестно"
 
 
-def generate_period_report(date_from: datetime, date_to: datetime) -> str:
-    """Генерирует общий отчёт за период: подробно по чатам + итоговая сводка."""
+def current_rates() -> tuple:
+    return (current_lari_to_usd, current_euro_to_usd, current_amd_to_usd)
+
+
+def rates_on(day) -> tuple:
+    """Курсы (лари, евро, драм) на дату смены: ближайший предыдущий день из истории курсов.
+    Пустая история или нет даты — текущие курсы."""
+    if isinstance(day, str):
+        day = parse_date_str(day)
+    rates = rate_history.lookup(day) if day else None
+    if not rates:
+        return current_rates()
+    return (rates.get("lari") or current_lari_to_usd,
+            rates.get("euro") or current_euro_to_usd,
+            rates.get("amd") or current_amd_to_usd)
+
+
+def usd_to_gel_rate(rates: tuple) -> float:
+    """Сколько gel за 1$ при курсах (лари, евро, драм)."""
+    return 1 / rates[0] if rates[0] > 0 else 2.70
+
+
+def currencies_to_usd(currencies: dict, rates: Optional[tuple] = None) -> float:
+    """{валюта: сумма} -> USD по курсам rates, по умолчанию текущим (ключи как в extract_booking_usd)."""
+    return sum(amt * rate_to_usd(cur, rates) for cur, amt in currencies.items())
+
+
+# ==================== РОЛЛАПЫ ПО ДНЯМ ====================
+# Одна строка на чат × дату смены × оператора: суммы по валютам, USD и счётчики броней.
+# Архив сворачивается один раз (при загрузке и в archive_shift), текущие смены
+# накладываются сверху при запросе. Сводки отчётов читают строки, а не брони.
+rollups = {}  # {"ДД.ММ.ГГГГ": {(chat_id, оператор): строка}}
+
+
+def shift_rollup_rows(shift: dict, rows: Optional[dict] = None) -> dict:
+    """Сворачивает брони смены в строки {(chat_id, оператор): строка}."""
+    rows = {} if rows is None else rows
+    chat_id = str(shift.get("chat_id", ""))
+    rates = rates_on(shift.get("date", ""))
+    for b in shift.get("bookings", []):
+        op_name = extract_operator_name(b)
+        row = rows.get((chat_id, op_name))
+        if row is None:
+            row = rows[(chat_id, op_name)] = {
+                "chat_id": chat_id, "chat_title": shift.get("chat_title", "Неизвестно"),
+                "date": shift.get("date", ""), "operator": op_name,
+                "currencies": {}, "usd": 0.0, "rates": rates,
+                "total": 0, "came": 0, "cancelled": 0, "no_show": 0,
+            }
+        row["total"] += 1
+        if b.get("deleted"):
+            row["cancelled"] += 1
+        elif b.get("cancelled"):
+            row["no_show"] += 1
+        elif b.get("done"):
+            row["came"] += 1
+            usd, currencies = extract_booking_usd(b, rates)
+            row["usd"] += usd
+            for cur, amt in currencies.items():
+                row["currencies"][cur] = row["currencies"].get(cur, 0) + amt
+    return rows
+
+
+def add_shift_to_rollups(shift: dict):
+    d = parse_date_str(shift.get("date", ""))
+    if not d:
+        return
+    shift_rollup_rows(shift, rollups.setdefault(d.strftime("%d.%m.%Y"), {}))
+
+
+def rebuild_rollups():
+    rollups.clear()
+    for shift in history.all():
+        add_shift_to_rollups(shift)
+
+
+def drop_rollup_months(months: list):
+    """Убирает дни выброшенных из архива месяцев (ключ месяца ГГГГ-ММ)."""
+    for date_str in list(rollups):
+        d = parse_date_str(date_str)
+        if d and d.strftime("%Y-%m") in months:
+            del rollups[date_str]
+
+
+def get_rollups_for_period(date_from: datetime, date_to: datetime,
+                           chat_id: Optional[str] = None, operator: Optional[str] = None) -> list:
+    """Строки роллапов за период: архив + текущие смены. Время — O(дни × чаты × операторы).
+    USD каждой строки — по курсу на дату её смены."""
+    excluded = set(str(c) for c in EXCLUDED_FROM_REPORTS)
+    op_key = operator.lower() if operator else None
+
+    def wanted(row):
+        if row["chat_id"] in excluded:
+            return False
+        if chat_id is not None and row["chat_id"] != str(chat_id):
+            return False
+        return op_key is None or row["operator"].lower() == op_key
+
+    result = []
+    current = date_from.replace(hour=0, minute=0, second=0, microsecond=0)
+    while current <= date_to:
+        day_rows = rollups.get(current.strftime("%d.%m.%Y"), {})
+        rates = rates_on(current) if day_rows else None
+        for row in list(day_rows.values()):
+            if not wanted(row):
+                continue
+            if row["rates"] != rates:
+                # Курс на эту дату поменялся — пересчитываем USD из сумм по валютам в копии:
+                # роллапы общие, их читают и потоки отчётов
+                row = {**row, "usd": currencies_to_usd(row["currencies"], rates), "rates": rates}
+            result.append(row)
+        current += timedelta(days=1)
+
+    # Текущие смены поверх архива
+    for chat_str, chat_data in list(data.get("chats", {}).items()):
+        d = parse_date_str(chat_data.get("date", ""))
+        if not d or not (date_from <= d <= date_to) or not chat_data.get("bookings"):
+            continue
+        live = {"chat_id": chat_str, "date": chat_data["date"],
+                "chat_title": chat_data.get("chat_title", ""), "bookings": chat_data["bookings"]}
+        result.extend(row for row in shift_rollup_rows(live).values() if wanted(row))
+    return result
+
+
+# ==================== ИНДЕКСЫ БРОНЕЙ ====================
+# Пришедшие брони по оператору и по чату: отчёт по одному сотруднику или одной
+# кассе берёт только свои брони, список сотрудников читается из индекса.
+# Архив индексируется при загрузке и в archive_shift, текущая смена чата —
+# при каждой записи в журнал. Чаты из EXCLUDED_FROM_REPORTS не индексируются.
+operator_bookings = BookingIndex(lambda shift, b: extract_operator_name(b))
+chat_bookings = BookingIndex(lambda shift, b: str(shift.get("chat_id", "")))
+BOOKING_INDEXES = (operator_bookings, chat_bookings)
+
+
+def is_came(b: dict) -> bool:
+    return bool(b.get("done")) and not b.get("deleted")
+
+
+def index_archived_shift(shift: dict):
+    if str(shift.get("chat_id", "")) in set(str(c) for c in EXCLUDED_FROM_REPORTS):
+        return
+    came = [b for b in shift.get("bookings", []) if is_came(b)]
+    ordinal = date_ordinal(shift.get("date", ""))
+    for index in BOOKING_INDEXES:
+        index.add_shift(shift, ordinal, came)
+
+
+def reindex_live_chat(chat_str: str):
+    chat_data = data["chats"].get(chat_str)
+    if not chat_data or chat_str in set(str(c) for c in EXCLUDED_FROM_REPORTS):
+        for index in BOOKING_INDEXES:
+            index.drop_live(chat_str)
+        return
+    d = parse_date_str(chat_data.get("date", ""))
+    header = {"chat_id": chat_str, "date": chat_data.get("date", ""), "chat_title": chat_data.get("chat_title", "")}
+    came = [b for b in chat_data.get("bookings", []) if is_came(b)]
+    for index in BOOKING_INDEXES:
+        index.set_live(chat_str, header, d.toordinal() if d else None, came)
+
+
+def rebuild_booking_indexes():
+    for index in BOOKING_INDEXES:
+        index.clear()
+    for shift in history.all():
+        index_archived_shift(shift)
+    for chat_str in data.get("chats", {}):
+        reindex_live_chat(chat_str)
+
+
+def sum_rollups(rows: list, key) -> dict:
+    """Группирует строки по key(row): {ключ: {"usd", валюты..., счётчики}}."""
+    totals = {}
+    for row in rows:
+        t = totals.setdefault(key(row), {"usd": 0, "total": 0, "came": 0, "cancelled": 0, "no_show": 0})
+        t["usd"] += row["usd"]
+        for field in ("total", "came", "cancelled", "no_show"):
+            t[field] += row[field]
+        for cur, amt in row["currencies"].items():
+            t[cur] = t.get(cur, 0) + amt
+    return totals
+
+
+# ==================== ВЕРСИИ ДАННЫХ И КЭШ ОТЧЁТОВ ====================
+# Готовый отчёт хранится по ключу (тип, период, фильтр, версия данных периода,
+# версия курсов периода, версия настроек). Версия периода — номер последнего
+# изменения среди его дней, поэтому правка сегодняшней брони не сбрасывает
+# закэшированную «прошлую неделю».
+REPORT_CACHE_SIZE = 64
+report_cache = OrderedDict()  # LRU: старые записи — в начале
+report_cache_stats = {"hits": 0, "misses": 0}
+data_versions = {"counter": 0, "global": 0, "settings": 0}
+date_versions = {}  # {ordinal дня: номер последнего изменения этого дня}
+
+
+def touch_dates(*date_strs):
+    """Отмечает изменение данных в днях (брони, расходы, архив)."""
+    data_versions["counter"] += 1
+    for date_str in date_strs:
+        d = parse_date_str(date_str or "")
+        if d:
+            date_versions[d.toordinal()] = data_versions["counter"]
+
+
+def touch_all():
+    """Изменение, затрагивающее любые периоды (полная перезапись, очистка архива)."""
+    data_versions["counter"] += 1
+    data_versions["global"] = data_versions["counter"]
+
+
+def touch_settings():
+    data_versions["counter"] += 1
+    data_versions["settings"] = data_versions["counter"]
+
+
+def period_version(date_from: datetime, date_to: datetime) -> int:
+    days = range(date_from.toordinal(), date_to.toordinal() + 1)
+    return max([data_versions["global"]] + [date_versions.get(o, 0) for o in days])
+
+
+def rates_version(date_from: datetime, date_to: datetime) -> tuple:
+    # Пустая история курсов — все даты считаются по текущим курсам
+    return rate_history.stamp(date_from, date_to) or current_rates()
+
+
+def report_versions(date_from: datetime, date_to: datetime) -> tuple:
+    """Всё, от чего зависит отчёт за период: данные его дней, курсы его дней, настройки."""
+    return (period_version(date_from, date_to), rates_version(date_from, date_to), data_versions["settings"])
+
+
+def report_key(kind: str, date_from: datetime, date_to: datetime, filters: tuple = ()) -> tuple:
     update_exchange_rates()
-    shifts = get_shifts_for_period(date_from, date_to)
+    return (kind, date_from.date(), date_to.date(), tuple(filters)) + report_versions(date_from, date_to)
+
+
+def report_cache_get(key: tuple):
+    if key in report_cache:
+        report_cache.move_to_end(key)
+        report_cache_stats["hits"] += 1
+        return report_cache[key]
+    report_cache_stats["misses"] += 1
+    return None
+
+
+def report_cache_put(key: tuple, result):
+    report_cache[key] = result
+    while len(report_cache) > REPORT_CACHE_SIZE:
+        report_cache.popitem(last=False)
+
+
+def cached_report(kind: str):
+    """Кэширует результат отчёта f(date_from, date_to, *фильтр) до изменения данных периода.
+    f может быть генератором секций — тогда кэшируется и возвращается склеенный текст.
+    Именованные аргументы (agg=) передаются дальше и в ключ не входят.
+    Некэширующая версия — wrapper.__wrapped__ (её по частям гонит пул отчётов)."""
+    def decorator(build):
+        @functools.wraps(build)
+        def wrapper(date_from: datetime, date_to: datetime, *filters, **kwargs):
+            key = report_key(kind, date_from, date_to, filters)
+            result = report_cache_get(key)
+            if result is None:
+                result = build(date_from, date_to, *filters, **kwargs)
+                if inspect.isgenerator(result):
+                    result = "".join(result)
+                report_cache_put(key, result)
+            return result
+        wrapper.kind = kind
+        return wrapper
+    return decorator
+
+
+# ==================== ДВИЖОК ОТЧЁТОВ ====================
+# Все отчёты за период рисуются из одного агрегата: строки роллапов (чат × дата ×
+# оператор: суммы по валютам, USD, счётчики статусов), пришедшие брони для
+# подробных списков и расходы. Агрегат строится один раз на версию данных
+# периода и переживает шаги диалога (период → выбор сотрудника) в FSM.
+class ReportAggregate:
+    def __init__(self, date_from: datetime, date_to: datetime):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.versions = report_versions(date_from, date_to)
+        # Снимок: строки роллапов копируются (USD архивных строк пересчитывается при смене
+        # курсов), брони текущих смен копирует get_shifts_for_period, архив не меняется
+        self.rows = [dict(r, currencies=dict(r["currencies"])) for r in get_rollups_for_period(date_from, date_to)]
+        self.expenses = get_expenses_for_period(date_from, date_to)
+        self._expenses_by_chat = None
+        self._shifts = [(d, shift, rates_on(d)) for d, shift in get_shifts_for_period(date_from, date_to)]
+        self._came = None
+
+    @property
+    def came(self) -> list:
+        """Пришедшие брони периода: {"chat_id", "chat_title", "date", "d", "operator", "usd",
+        "currencies", "booking"}; USD — по курсу даты смены. Собираются при первом обращении."""
+        if self._came is None:
+            self._came = [came_entry(d, shift, b, rates)
+                          for d, shift, rates in self._shifts
+                          for b in shift.get("bookings", []) if is_came(b)]
+        return self._came
+
+    def is_current(self) -> bool:
+        return self.versions == report_versions(self.date_from, self.date_to)
+
+    def rows_for(self, chat_id: Optional[str] = None, operator: Optional[str] = None) -> list:
+        op_key = operator.lower() if operator else None
+        return [r for r in self.rows
+                if (chat_id is None or r["chat_id"] == str(chat_id))
+                and (op_key is None or r["operator"].lower() == op_key)]
+
+    def came_for(self, chat_id: Optional[str] = None, operator: Optional[str] = None) -> list:
+        op_key = operator.casefold() if operator else None
+        if self._came is None and (chat_id is not None or op_key):
+            # Весь период ещё не разбирали — берём из индекса только нужные брони
+            if op_key:
+                entries = operator_bookings.between(op_key, self.date_from, self.date_to)
+            else:
+                entries = chat_bookings.between(str(chat_id), self.date_from, self.date_to)
+            rates_by_day = {}
+            result = []
+            for ordinal, shift, b in entries:
+                if chat_id is not None and str(shift.get("chat_id", "")) != str(chat_id):
+                    continue
+                d = date.fromordinal(ordinal)
+                if ordinal not in rates_by_day:
+                    rates_by_day[ordinal] = rates_on(d)
+                result.append(came_entry(d, shift, b, rates_by_day[ordinal]))
+            return result
+        return [e for e in self.came
+                if (chat_id is None or e["chat_id"] == str(chat_id))
+                and (op_key is None or e["operator"].casefold() == op_key)]
+
+    def expenses_for(self, chat_id: Optional[str] = None) -> list:
+        if chat_id is None:
+            return self.expenses
+        if self._expenses_by_chat is None:
+            by_chat = {}
+            for e in self.expenses:
+                by_chat.setdefault(str(e.get("chat_id", "")), []).append(e)
+            self._expenses_by_chat = by_chat
+        return self._expenses_by_chat.get(str(chat_id), [])
+
+    def operators(self) -> list:
+        """Сотрудники с пришедшими бронями за период — прямо из индекса."""
+        keys = operator_bookings.keys_between(self.date_from, self.date_to)
+        return sorted(operator_bookings.names[k] for k in keys)
+
+
+def came_entry(d, shift: dict, b: dict, rates: tuple) -> dict:
+    """Пришедшая бронь для отчётов: {"chat_id", "chat_title", "date", "d", "operator", "usd",
+    "currencies", "booking"}; USD — по курсам rates на дату смены."""
+    usd, currencies = extract_booking_usd(b, rates)
+    return {
+        "chat_id": str(shift.get("chat_id", "")),
+        "chat_title": shift.get("chat_title", "Неизвестно"),
+        "date": shift.get("date", ""), "d": d,
+        "operator": extract_operator_name(b),
+        "usd": usd, "currencies": currencies, "booking": b,
+    }
+
+
+@cached_report("aggregate")
+def build_aggregate(date_from: datetime, date_to: datetime) -> ReportAggregate:
+    return ReportAggregate(date_from, date_to)
+
+
+def aggregate_for(date_from: datetime, date_to: datetime, agg: Optional[ReportAggregate] = None) -> ReportAggregate:
+    """Переданный агрегат, если он за тот же период, иначе из кэша/заново.
+    Свежесть агрегата из FSM проверяет вызывающий (agg.is_current())."""
+    if agg is not None and agg.date_from.date() == date_from.date() and agg.date_to.date() == date_to.date():
+        return agg
+    return build_aggregate(date_from, date_to)
+
+
+@cached_report("period")
+def generate_period_report(date_from: datetime, date_to: datetime,
+                           agg: Optional[ReportAggregate] = None) -> Iterator[str]:
+    """Генерирует общий отчёт за период: подробно по чатам + итоговая сводка."""
+    agg = aggregate_for(date_from, date_to, agg)
 
     period_str = f"{date_from.strftime('%d.%m')} — {date_to.strftime('%d.%m.%Y')}"
 
-    # Группируем смены по chat_title -> по дате
-    # {chat_title: {date_str: [bookings]}}
+    # Пришедшие брони по chat_title -> по дате: {chat_title: {date_str: [записи агрегата]}}
     by_chat = {}
-    for shift in shifts:
-        title = shift.get("chat_title", "Неизвестно")
-        date_str = shift.get("date", "")
-        if title not in by_chat:
-            by_chat[title] = {}
-        if date_str not in by_chat[title]:
-            by_chat[title][date_str] = []
-        came = [b for b in shift.get("bookings", []) if b.get("done") and not b.get("deleted")]
-        by_chat[title][date_str].extend(came)
-
-    # Итоговые аккумуляторы
-    girl_totals = {}   # {chat_title: {"usd": X, "лари": X, ...}}
-    operator_totals = {}  # {имя: usd}
+    for row in agg.rows:
+        by_chat.setdefault(row["chat_title"], {}).setdefault(row["date"], [])
+    for e in agg.came:
+        by_chat.setdefault(e["chat_title"], {}).setdefault(e["date"], []).append(e)
+
+    # Итоги — из роллапов, а не из броней
+    rows = agg.rows
+    girl_totals = sum_rollups(rows, lambda r: r["chat_title"])   # {chat_title: {"usd": X, "лари": X, ...}}
+    operator_totals = {name: t["usd"] for name, t in sum_rollups(rows, lambda r: r["operator"]).items()
+                       if t["came"]}  # {имя: usd}
 
     # ===== ПОДРОБНЫЙ ОТЧЁТ ПО ЧАТАМ =====
-    text = f"<b>Отчёт за период: {period_str}</b>\n"
-    text += "━" * 30 + "\n\n"
+    yield f"<b>Отчёт за период: {period_str}</b>\n"
+    yield "━" * 30 + "\n\n"
 
     for title in sorted(by_chat.keys()):
         dates = by_chat[title]
-        text += f"<b>{title}</b>\n"
-
-        chat_usd = 0
-        chat_currencies = {"лари": 0, "$": 0, "евро": 0, "крипта": 0, "драм": 0}
+        yield f"<b>{title}</b>\n"
 
         for date_str in sorted(dates.keys(), key=lambda x: parse_date_str(x) or datetime.min):
             bookings = dates[date_str]
@@ -1022,26 +2027,18 @@ def generate_period_report(date_from: datetime, date_to: datetime) -> str:
                 continue
             d = parse_date_str(date_str)
             day_name = DAY_NAMES[d.weekday()].upper() if d else ""
-            text += f"  <b>{date_str} ({day_name}):</b>\n"
-
-            for b in sorted(bookings, key=lambda x: time_key(x.get("time", "00:00"))):
-                usd, currencies = extract_booking_usd(b)
-                op_name = extract_operator_name(b)
-                chat_usd += usd
-                for cur, amt in currencies.items():
-                    chat_currencies[cur] = chat_currencies.get(cur, 0) + amt
-
-                # ЗП оператора
-                if op_name not in operator_totals:
-                    operator_totals[op_name] = 0
-                operator_totals[op_name] += usd
+            yield f"  <b>{date_str} ({day_name}):</b>\n"
 
+            for e in sorted(bookings, key=lambda x: time_key(x["booking"].get("time", "00:00"))):
+                b, usd = e["booking"], e["usd"]
                 info = b.get("info", "")
                 duration = b.get("duration", "")
                 usd_note = f" ({usd:.0f}$)" if usd > 0 else ""
-                text += f"    {b.get('time', '')} — {info} ({duration}){usd_note}\n"
+                yield f"    {b.get('time', '')} — {info} ({duration}){usd_note}\n"
 
         # Итог по чату
+        chat_currencies = girl_totals.get(title, {"usd": 0})
+        chat_usd = chat_currencies["usd"]
         parts = []
         if chat_currencies.get("лари"): parts.append(f"{chat_currencies['лари']} лари")
         if chat_currencies.get("$"): parts.append(f"{chat_currencies['$']}$")
@@ -1049,15 +2046,11 @@ def generate_period_report(date_from: datetime, date_to: datetime) -> str:
         if chat_currencies.get("крипта"): parts.append(f"{chat_currencies['крипта']} крипта")
         if chat_currencies.get("драм"): parts.append(f"{chat_currencies['драм']} драм")
         cur_str = " + ".join(parts) if parts else "0"
-        text += f"  <b>Итог: {cur_str} ≈ {chat_usd:.0f}$ (на двоих: {chat_usd/2:.0f}$)</b>\n\n"
-
-        # Сохраняем для сводки
-        girl_totals[title] = {"usd": chat_usd}
-        girl_totals[title].update(chat_currencies)
+        yield f"  <b>Итог: {cur_str} ≈ {chat_usd:.0f}$ (на двоих: {chat_usd/2:.0f}$)</b>\n\n"
 
     # ===== ИТОГОВАЯ СВОДКА =====
-    text += "━" * 30 + "\n"
-    text += "<b>СВОДКА ПО КАССАМ:</b>\n"
+    yield "━" * 30 + "\n"
+    yield "<b>СВОДКА ПО КАССАМ:</b>\n"
     grand_total = 0
     if girl_totals:
         for title, tots in sorted(girl_totals.items()):
@@ -1071,26 +2064,26 @@ def generate_period_report(date_from: datetime, date_to: datetime) -> str:
             usd_total = tots["usd"]
             grand_total += usd_total
             half = usd_total / 2
-            text += f"  <b>{title}:</b> {cur_str} ≈ {usd_total:.0f}$ (на двоих: {half:.0f}$)\n"
-        text += f"\n  <b>ИТОГО:</b> {grand_total:.0f}$ (на двоих: {grand_total/2:.0f}$)\n"
+            yield f"  <b>{title}:</b> {cur_str} ≈ {usd_total:.0f}$ (на двоих: {half:.0f}$)\n"
+        yield f"\n  <b>ИТОГО:</b> {grand_total:.0f}$ (на двоих: {grand_total/2:.0f}$)\n"
     else:
-        text += "  Нет данных\n"
+        yield "  Нет данных\n"
 
     # ЗП операторов
-    text += "\n<b>ЗП операторов:</b>\n"
+    yield "\n<b>ЗП операторов:</b>\n"
     if operator_totals:
         total_salary = 0
         for name, usd in sorted(operator_totals.items()):
             percent = get_salary_percent(name)
             salary = usd * percent
             total_salary += salary
-            text += f"  {name}: {salary:.2f}$ ({int(percent*100)}%) — от кассы {usd:.0f}$\n"
-        text += f"\n  <b>Итого ЗП операторов:</b> {total_salary:.2f}$\n"
+            yield f"  {name}: {salary:.2f}$ ({int(percent*100)}%) — от кассы {usd:.0f}$\n"
+        yield f"\n  <b>Итого ЗП операторов:</b> {total_salary:.2f}$\n"
     else:
-        text += "  Нет данных\n"
+        yield "  Нет данных\n"
 
     # ЗП админов
-    text += "\n<b>ЗП админов:</b>\n"
+    yield "\n<b>ЗП админов:</b>\n"
     if grand_total > 0:
         admin_pct = settings.get("admin_salary_percent", {})
         all_admins = set(list(ADMIN_SALARY_PERCENT.keys()) + list(admin_pct.keys()))
@@ -1099,16 +2092,16 @@ def generate_period_report(date_from: datetime, date_to: datetime) -> str:
             apct = get_admin_salary_percent(aname)
             asal = grand_total * apct
             total_admin_salary += asal
-            text += f"  {aname}: {asal:.2f}$ ({apct*100:.1f}%) — от общей кассы {grand_total:.0f}$\n"
-        text += f"\n  <b>Итого ЗП админов:</b> {total_admin_salary:.2f}$\n"
+            yield f"  {aname}: {asal:.2f}$ ({apct*100:.1f}%) — от общей кассы {grand_total:.0f}$\n"
+        yield f"\n  <b>Итого ЗП админов:</b> {total_admin_salary:.2f}$\n"
     else:
-        text += "  Нет данных\n"
+        yield "  Нет данных\n"
 
     # Расходы из expenses.json за период
-    period_expenses = get_expenses_for_period(date_from, date_to)
+    period_expenses = agg.expenses
     if period_expenses:
-        text += "\n" + "━" * 30 + "\n"
-        text += "<b>Расходы за период:</b>\n"
+        yield "\n" + "━" * 30 + "\n"
+        yield "<b>Расходы за период:</b>\n"
         # Группируем по чату
         exp_by_chat = {}
         total_exp = 0
@@ -1120,53 +2113,57 @@ def generate_period_report(date_from: datetime, date_to: datetime) -> str:
             total_exp += e.get("amount_usd", 0)
 
         for title in sorted(exp_by_chat.keys()):
-            text += f"  <b>{title}:</b>\n"
-            for e in sorted(exp_by_chat[title], key=lambda x: parse_date_str(x.get("date", "")) or datetime.min):
+            yield f"  <b>{title}:</b>\n"
+            for e in exp_by_chat[title]:
                 cur_d = e.get("currency", "$")
                 if cur_d == "$": cur_d = "USD"
                 line = f"    {e['date']} — {e['type']}: {e['amount']:.0f} {cur_d} ≈ {e['amount_usd']:.0f}$"
                 if e.get("comment"):
                     line += f" ({e['comment']})"
-                text += line + "\n"
-        text += f"\n  <b>Итого расходов:</b> {total_exp:.0f}$\n"
+                yield line + "\n"
+        yield f"\n  <b>Итого расходов:</b> {total_exp:.0f}$\n"
 
-    return text
 
 
-def generate_girl_report(date_from: datetime, date_to: datetime, chat_id_filter: str) -> str:
+@cached_report("girl")
+def generate_girl_report(date_from: datetime, date_to: datetime, chat_id_filter: str,
+                         agg: Optional[ReportAggregate] = None) -> Iterator[str]:
     """Отчёт по кассе девочки (чату) в формате: день -> список броней -> итоги в gel."""
-    update_exchange_rates()
+    agg = aggregate_for(date_from, date_to, agg)
 
-    # gel за 1 доллар (обратный курс)
-    usd_to_gel = 1 / current_lari_to_usd if current_lari_to_usd > 0 else 2.70
-    euro_to_gel = current_euro_to_usd * usd_to_gel
-
-    shifts = get_shifts_for_period(date_from, date_to)
-    # Фильтруем по нужному чату
-    shifts = [s for s in shifts if str(s.get("chat_id", "")) == str(chat_id_filter)]
-
-    if not shifts:
-        return "Нет данных за этот период."
+    chat_rows = agg.rows_for(chat_id=chat_id_filter)
+    if not chat_rows:
+        yield "Нет данных за этот период."
+        return
 
-    chat_title = shifts[0].get("chat_title", "Неизвестно") if shifts else "Неизвестно"
+    first = min(chat_rows, key=lambda r: parse_date_str(r["date"]) or datetime.min)
+    chat_title = first["chat_title"] or "Неизвестно"
     girl_name = extract_girl_name(chat_title)
     period_str = f"{date_from.strftime('%d.%m')} — {date_to.strftime('%d.%m.%Y')}"
 
-    # Группируем по дате
+    # Группируем пришедшие брони по дате
     by_date = {}
-    for shift in shifts:
-        date_str = shift.get("date", "")
-        if date_str not in by_date:
-            by_date[date_str] = []
-        came = [b for b in shift.get("bookings", []) if b.get("done") and not b.get("deleted")]
-        by_date[date_str].extend(came)
+    for e in agg.came_for(chat_id=chat_id_filter):
+        by_date.setdefault(e["date"], []).append(e)
 
     # Генерируем все дни
-    text = f"<b>{girl_name}</b>\n"
-    text += f"<i>{chat_title}</i>\n"
-    text += f"<i>{period_str}</i>\n\n"
+    yield f"<b>{girl_name}</b>\n"
+    yield f"<i>{chat_title}</i>\n"
+    yield f"<i>{period_str}</i>\n\n"
 
+    # Половины кассы по валютам в USD и gel — каждый день по курсу своей даты
     totals = {"лари": 0, "$": 0, "евро": 0, "крипта": 0, "драм": 0}
+    half_usd = dict.fromkeys(totals, 0.0)
+    half_gel = dict.fromkeys(totals, 0.0)
+    for row in chat_rows:
+        for cur_name, amt in row["currencies"].items():
+            totals[cur_name] = totals.get(cur_name, 0) + amt
+            usd = amt / 2 * rate_to_usd(cur_name, row["rates"])
+            half_usd[cur_name] = half_usd.get(cur_name, 0) + usd
+            half_gel[cur_name] = half_gel.get(cur_name, 0) + usd * usd_to_gel_rate(row["rates"])
+
+    def avg_rate(value, base):
+        return value / base if base else 0
 
     current = date_from
     while current <= date_to:
@@ -1176,14 +2173,12 @@ def generate_girl_report(date_from: datetime, date_to: datetime, chat_id_filter:
         # Ищем смену за эту дату
         bookings = by_date.get(d_full, [])
 
-        text += f"<b>{d_str}</b>\n"
+        yield f"<b>{d_str}</b>\n"
         if not bookings:
-            text += "0\n"
+            yield "0\n"
         else:
-            for b in sorted(bookings, key=lambda x: time_key(x.get("time", "00:00"))):
-                _, currencies = extract_booking_usd(b)
-                op_name = extract_operator_name(b)
-                duration = b.get("duration", "")
+            for e in sorted(bookings, key=lambda x: time_key(x["booking"].get("time", "00:00"))):
+                currencies, op_name = e["currencies"], e["operator"]
 
                 # Форматируем сумму
                 parts = []
@@ -1201,149 +2196,147 @@ def generate_girl_report(date_from: datetime, date_to: datetime, chat_id_filter:
                             parts.append(f"{amt} драм")
                 amount_str = " + ".join(parts) if parts else "0"
 
-                text += f"  {amount_str}/2 {op_name}\n"
-
-                for cur_name, amt in currencies.items():
-                    totals[cur_name] = totals.get(cur_name, 0) + amt
+                yield f"  {amount_str}/2 {op_name}\n"
 
         current += timedelta(days=1)
 
     # ===== РАСЧЁТ =====
-    text += "\n<b>Расчёт:</b>\n"
+    yield "\n<b>Расчёт:</b>\n"
 
     total_gel = 0
 
     # Лари
     if totals["лари"] > 0:
         half = totals["лари"] / 2
-        text += f"\n<b>Лари:</b> {totals['лари']:.0f} gel\n"
-        text += f"  {totals['лари']:.0f} / 2 = {half:.0f} gel\n"
+        yield f"\n<b>Лари:</b> {totals['лари']:.0f} gel\n"
+        yield f"  {totals['лари']:.0f} / 2 = {half:.0f} gel\n"
         total_gel += half
 
     # USD
     if totals["$"] > 0:
         half = totals["$"] / 2
-        gel_val = half * usd_to_gel
-        text += f"\n<b>USD:</b> {totals['$']:.0f}$\n"
-        text += f"  {totals['$']:.0f} / 2 = {half:.0f}$\n"
-        text += f"  {half:.0f} × {usd_to_gel:.2f} = {gel_val:.2f} gel\n"
+        gel_val = half_gel["$"]
+        yield f"\n<b>USD:</b> {totals['$']:.0f}$\n"
+        yield f"  {totals['$']:.0f} / 2 = {half:.0f}$\n"
+        yield f"  {half:.0f} × {avg_rate(gel_val, half):.2f} = {gel_val:.2f} gel\n"
         total_gel += gel_val
 
     # Евро
     if totals["евро"] > 0:
         half = totals["евро"] / 2
-        usd_val = half * current_euro_to_usd
-        gel_val = usd_val * usd_to_gel
-        text += f"\n<b>Евро:</b> {totals['евро']:.0f}€\n"
-        text += f"  {totals['евро']:.0f} / 2 = {half:.0f}€\n"
-        text += f"  {half:.0f} × {current_euro_to_usd:.2f} = {usd_val:.2f}$\n"
-        text += f"  {usd_val:.2f} × {usd_to_gel:.2f} = {gel_val:.2f} gel\n"
+        usd_val = half_usd["евро"]
+        gel_val = half_gel["евро"]
+        yield f"\n<b>Евро:</b> {totals['евро']:.0f}€\n"
+        yield f"  {totals['евро']:.0f} / 2 = {half:.0f}€\n"
+        yield f"  {half:.0f} × {avg_rate(usd_val, half):.2f} = {usd_val:.2f}$\n"
+        yield f"  {usd_val:.2f} × {avg_rate(gel_val, usd_val):.2f} = {gel_val:.2f} gel\n"
         total_gel += gel_val
 
     # Крипта
     crypto_gel = 0
+    crypto_rate = 0
     if totals["крипта"] > 0:
         half = totals["крипта"] / 2
-        gel_val = half * usd_to_gel
-        text += f"\n<b>Крипта:</b> {totals['крипта']:.0f} USDT\n"
-        text += f"  {totals['крипта']:.0f} / 2 = {half:.0f} USDT\n"
-        text += f"  {half:.0f} × {usd_to_gel:.2f} = {gel_val:.2f} gel\n"
+        gel_val = half_gel["крипта"]
+        crypto_rate = avg_rate(gel_val, half)
+        yield f"\n<b>Крипта:</b> {totals['крипта']:.0f} USDT\n"
+        yield f"  {totals['крипта']:.0f} / 2 = {half:.0f} USDT\n"
+        yield f"  {half:.0f} × {crypto_rate:.2f} = {gel_val:.2f} gel\n"
         crypto_gel = gel_val
 
     # Драм
     if totals["драм"] > 0:
-        half_usd = totals["драм"] * current_amd_to_usd / 2
-        gel_val = half_usd * usd_to_gel
-        text += f"\n<b>Драм:</b> {totals['драм']:.0f} драм\n"
-        text += f"  ≈ {totals['драм'] * current_amd_to_usd:.2f}$ / 2 = {half_usd:.2f}$\n"
-        text += f"  {half_usd:.2f} × {usd_to_gel:.2f} = {gel_val:.2f} gel\n"
+        amd_half_usd = half_usd["драм"]
+        gel_val = half_gel["драм"]
+        yield f"\n<b>Драм:</b> {totals['драм']:.0f} драм\n"
+        yield f"  ≈ {amd_half_usd * 2:.2f}$ / 2 = {amd_half_usd:.2f}$\n"
+        yield f"  {amd_half_usd:.2f} × {avg_rate(gel_val, amd_half_usd):.2f} = {gel_val:.2f} gel\n"
         total_gel += gel_val
 
     cash_gel = total_gel
-    text += f"\n<b>Итого наличка:</b> {cash_gel:.2f} gel\n"
+    yield f"\n<b>Итого наличка:</b> {cash_gel:.2f} gel\n"
 
     if crypto_gel > 0:
-        text += f"\n<b>Крипта (вся наша):</b>\n"
-        text += f"  {totals['крипта']:.0f} / 2 = {totals['крипта']/2:.0f} USDT\n"
-        text += f"  {totals['крипта']/2:.0f} × {usd_to_gel:.2f} = {crypto_gel:.2f} gel\n"
+        yield f"\n<b>Крипта (вся наша):</b>\n"
+        yield f"  {totals['крипта']:.0f} / 2 = {totals['крипта']/2:.0f} USDT\n"
+        yield f"  {totals['крипта']/2:.0f} × {crypto_rate:.2f} = {crypto_gel:.2f} gel\n"
         cash_after_crypto = cash_gel - crypto_gel
-        text += f"\n<b>Наличка за вычетом крипты:</b>\n"
-        text += f"  {cash_gel:.2f} − {crypto_gel:.2f} = {cash_after_crypto:.2f} gel\n"
+        yield f"\n<b>Наличка за вычетом крипты:</b>\n"
+        yield f"  {cash_gel:.2f} − {crypto_gel:.2f} = {cash_after_crypto:.2f} gel\n"
     else:
         cash_after_crypto = cash_gel
 
     # Расходы из expenses.json
-    expenses = get_expenses_for_period(date_from, date_to, chat_id_filter)
+    expenses = agg.expenses_for(chat_id_filter)
     rent_gel = 0        # Квартира — девочка должна нам
     deduct_gel = 0      # Такси и прочее — вычитаем из кассы
     photo_gel = 0       # Фотосессия — только статистика
 
     if expenses:
-        text += "\n<b>Расходы:</b>\n"
-        for e in sorted(expenses, key=lambda x: parse_date_str(x.get("date", "")) or datetime.min):
+        yield "\n<b>Расходы:</b>\n"
+        for e in expenses:
             exp_usd = e.get("amount_usd", 0)
-            exp_gel = exp_usd * usd_to_gel
+            exp_gel = exp_usd * usd_to_gel_rate(rates_on(e["d"]))
             cur_d = e.get("currency", "$")
             exp_type = e.get("type", "").lower()
 
             if "кварт" in exp_type:
-                text += f"  {e['date']} {e['type']}: {e['amount']:.0f} {cur_d} ≈ {exp_gel:.0f} gel (долг девочки)\n"
-                rent_gel += exp_gel
+                yield f"  {e['date']} {e['type']}: {e['amount']:.0f} {cur_d} ≈ {exp_gel:.0f} gel (долг девочки)\n"
             elif "фото" in exp_type:
-                text += f"  {e['date']} {e['type']}: {e['amount']:.0f} {cur_d} ≈ {exp_gel:.0f} gel (наш расход, не в кассе)\n"
-                photo_gel += exp_gel
+                yield f"  {e['date']} {e['type']}: {e['amount']:.0f} {cur_d} ≈ {exp_gel:.0f} gel (наш расход, не в кассе)\n"
             else:
-                text += f"  {e['date']} {e['type']}: {e['amount']:.0f} {cur_d} ≈ {exp_gel:.0f} gel\n"
-                deduct_gel += exp_gel
+                yield f"  {e['date']} {e['type']}: {e['amount']:.0f} {cur_d} ≈ {exp_gel:.0f} gel\n"
+
+        # Суммы по категориям — из итогов реестра по дням
+        for d, category, usd in expense_category_usd(date_from, date_to, chat_id_filter):
+            gel = usd * usd_to_gel_rate(rates_on(d))
+            if "кварт" in category:
+                rent_gel += gel
+            elif "фото" in category:
+                photo_gel += gel
+            else:
+                deduct_gel += gel
 
         if rent_gel > 0:
-            text += f"  <b>Квартира (долг):</b> +{rent_gel:.0f} gel\n"
+            yield f"  <b>Квартира (долг):</b> +{rent_gel:.0f} gel\n"
         if deduct_gel > 0:
-            text += f"  <b>Расходы (вычет):</b> −{deduct_gel:.0f} gel\n"
+            yield f"  <b>Расходы (вычет):</b> −{deduct_gel:.0f} gel\n"
         if photo_gel > 0:
-            text += f"  <b>Фотосессии (справочно):</b> {photo_gel:.0f} gel\n"
+            yield f"  <b>Фотосессии (справочно):</b> {photo_gel:.0f} gel\n"
 
     # Финальный расчёт
-    text += "\n<b>Финальный расчёт:</b>\n"
+    yield "\n<b>Финальный расчёт:</b>\n"
     final = cash_after_crypto + rent_gel - deduct_gel
     parts_calc = [f"{cash_after_crypto:.2f}"]
     if rent_gel > 0:
         parts_calc.append(f"+ {rent_gel:.0f} (квартира)")
     if deduct_gel > 0:
         parts_calc.append(f"− {deduct_gel:.0f} (расходы)")
-    text += f"  {' '.join(parts_calc)} = <b>{final:.2f} gel</b>\n"
+    yield f"  {' '.join(parts_calc)} = <b>{final:.2f} gel</b>\n"
 
-    return text
 
 
-def generate_operator_report(date_from: datetime, date_to: datetime, op_name: str) -> str:
+@cached_report("operator")
+def generate_operator_report(date_from: datetime, date_to: datetime, op_name: str,
+                             agg: Optional[ReportAggregate] = None) -> Iterator[str]:
     """Генерирует детальный отчёт по одному оператору (как в примере по Саше)."""
-    update_exchange_rates()
-    shifts = get_shifts_for_period(date_from, date_to)
+    agg = aggregate_for(date_from, date_to, agg)
 
     period_str = f"{date_from.strftime('%d.%m')} — {date_to.strftime('%d.%m.%Y')}"
 
     # Группируем по дням
-    days = {}  # {date_str: [(booking, chat_title, shift_date_obj)]}
-    for shift in shifts:
-        chat_title = shift.get("chat_title", "Неизвестно")
-        shift_date = parse_date_str(shift.get("date", ""))
-        if not shift_date:
-            continue
-        came = [b for b in shift.get("bookings", []) if b.get("done") and not b.get("deleted")]
-        for b in came:
-            name = extract_operator_name(b)
-            if name.lower() == op_name.lower():
-                date_key = shift.get("date", "")
-                if date_key not in days:
-                    days[date_key] = []
-                days[date_key].append((b, chat_title, shift_date))
-
-    text = f"<b>Отчёт по оператору: {op_name}</b>\n"
-    text += f"<b>Период: {period_str}</b>\n\n"
-
-    chat_totals = {}  # {chat_title: {"usd": X, currencies...}}
-    total_usd = 0
+    days = {}  # {date_str: [записи агрегата]}
+    for e in agg.came_for(operator=op_name):
+        if e["d"]:
+            days.setdefault(e["date"], []).append(e)
+
+    yield f"<b>Отчёт по оператору: {op_name}</b>\n"
+    yield f"<b>Период: {period_str}</b>\n\n"
+
+    # Итоги — из роллапов оператора
+    op_rows = [r for r in agg.rows_for(operator=op_name) if r["came"]]
+    chat_totals = sum_rollups(op_rows, lambda r: r["chat_title"])  # {chat_title: {"usd": X, currencies...}}
+    total_usd = sum(t["usd"] for t in chat_totals.values())
 
     # Генерируем все дни периода для показа "НИКОГО"
     current = date_from
@@ -1364,27 +2357,18 @@ def generate_operator_report(date_from: datetime, date_to: datetime, op_name: st
         entries = days_by_date.get(d_str, [])
 
         if not entries:
-            text += f"<b>{day_name}</b> НИКОГО\n"
+            yield f"<b>{day_name}</b> НИКОГО\n"
         else:
-            text += f"<b>{day_name}</b>\n"
-            entries_sorted = sorted(entries, key=lambda x: time_key(x[0].get("time", "00:00")))
-            for b, chat_title, _ in entries_sorted:
-                usd, currencies = extract_booking_usd(b)
-                total_usd += usd
-
-                # Касса по чату
-                if chat_title not in chat_totals:
-                    chat_totals[chat_title] = {"usd": 0, "лари": 0, "$": 0, "евро": 0, "крипта": 0, "драм": 0}
-                chat_totals[chat_title]["usd"] += usd
-                for cur, amt in currencies.items():
-                    chat_totals[chat_title][cur] = chat_totals[chat_title].get(cur, 0) + amt
-
+            yield f"<b>{day_name}</b>\n"
+            entries_sorted = sorted(entries, key=lambda x: time_key(x["booking"].get("time", "00:00")))
+            for e in entries_sorted:
+                b, chat_title, usd = e["booking"], e["chat_title"], e["usd"]
                 info = b.get("info", "")
                 duration = b.get("duration", "")
                 usd_note = f" ({usd:.0f}$)" if usd > 0 else ""
-                text += f"  {b.get('time', '')} {info} ({duration}) — {chat_title}{usd_note}\n"
+                yield f"  {b.get('time', '')} {info} ({duration}) — {chat_title}{usd_note}\n"
 
-    text += "\n<b>Итоги по чатам:</b>\n"
+    yield "\n<b>Итоги по чатам:</b>\n"
     for title, tots in sorted(chat_totals.items()):
         parts = []
         if tots.get("лари"): parts.append(f"{tots['лари']} лари")
@@ -1393,97 +2377,65 @@ def generate_operator_report(date_from: datetime, date_to: datetime, op_name: st
         if tots.get("драм"): parts.append(f"{tots['драм']:.0f} драм")
         if tots.get("евро"): parts.append(f"{tots['евро']} евро")
         cur_str = " + ".join(parts) if parts else ""
-        text += f"  {title}: {cur_str} ≈ {tots['usd']:.0f}$\n"
+        yield f"  {title}: {cur_str} ≈ {tots['usd']:.0f}$\n"
 
     percent = get_salary_percent(op_name)
     salary = total_usd * percent
-    text += f"\n<b>ИТОГО касса:</b> {total_usd:.0f}$\n"
-    text += f"<b>ЗП {op_name} ({int(percent*100)}%):</b> {salary:.2f}$\n"
+    yield f"\n<b>ИТОГО касса:</b> {total_usd:.0f}$\n"
+    yield f"<b>ЗП {op_name} ({int(percent*100)}%):</b> {salary:.2f}$\n"
 
-    return text
 
 
-def generate_admin_report(date_from: datetime, date_to: datetime, admin_name: str) -> str:
+@cached_report("admin")
+def generate_admin_report(date_from: datetime, date_to: datetime, admin_name: str,
+                          agg: Optional[ReportAggregate] = None) -> Iterator[str]:
     """Генерирует отчёт ЗП по админу — от общей кассы за период."""
-    update_exchange_rates()
-    shifts = get_shifts_for_period(date_from, date_to)
+    agg = aggregate_for(date_from, date_to, agg)
 
     period_str = f"{date_from.strftime('%d.%m')} — {date_to.strftime('%d.%m.%Y')}"
 
-    # Считаем общую кассу по чатам
-    chat_totals = {}  # {chat_title: usd}
-    grand_total = 0
-
-    for shift in shifts:
-        chat_title = shift.get("chat_title", "Неизвестно")
-        came = [b for b in shift.get("bookings", []) if b.get("done") and not b.get("deleted")]
-        for b in came:
-            usd, _ = extract_booking_usd(b)
-            if chat_title not in chat_totals:
-                chat_totals[chat_title] = 0
-            chat_totals[chat_title] += usd
-            grand_total += usd
+    # Общая касса по чатам — из роллапов
+    rows = [r for r in agg.rows if r["came"]]
+    chat_totals = {title: t["usd"] for title, t in sum_rollups(rows, lambda r: r["chat_title"]).items()}
+    grand_total = sum(chat_totals.values())
 
     percent = get_admin_salary_percent(admin_name)
     salary = grand_total * percent
 
-    text = f"<b>Отчёт по админу: {admin_name}</b>\n"
-    text += f"<b>Период: {period_str}</b>\n\n"
+    yield f"<b>Отчёт по админу: {admin_name}</b>\n"
+    yield f"<b>Период: {period_str}</b>\n\n"
 
-    text += "<b>Касса по чатам:</b>\n"
+    yield "<b>Касса по чатам:</b>\n"
     for title, usd in sorted(chat_totals.items()):
-        text += f"  {title}: {usd:.0f}$\n"
+        yield f"  {title}: {usd:.0f}$\n"
 
-    text += f"\n<b>Общая касса:</b> {grand_total:.0f}$\n"
-    text += f"<b>ЗП {admin_name} ({percent*100:.1f}%):</b> {salary:.2f}$\n"
+    yield f"\n<b>Общая касса:</b> {grand_total:.0f}$\n"
+    yield f"<b>ЗП {admin_name} ({percent*100:.1f}%):</b> {salary:.2f}$\n"
 
-    return text
 
 
-def get_all_operators(date_from: datetime, date_to: datetime) -> list[str]:
+def get_all_operators(date_from: datetime, date_to: datetime, agg: Optional[ReportAggregate] = None) -> list[str]:
     """Возвращает список уникальных операторов за период."""
-    shifts = get_shifts_for_period(date_from, date_to)
-    operators = set()
-    for shift in shifts:
-        came = [b for b in shift.get("bookings", []) if b.get("done") and not b.get("deleted")]
-        for b in came:
-            operators.add(extract_operator_name(b))
-    return sorted(operators)
+    return aggregate_for(date_from, date_to, agg).operators()
 
 
-def generate_operator_stats(date_from: datetime, date_to: datetime) -> str:
+@cached_report("operator_stats")
+def generate_operator_stats(date_from: datetime, date_to: datetime,
+                            agg: Optional[ReportAggregate] = None) -> Iterator[str]:
     """Генерирует статистику по операторам: всего броней, пришёл, отменено, не пришёл."""
-    update_exchange_rates()
-    shifts = get_shifts_for_period(date_from, date_to)
+    agg = aggregate_for(date_from, date_to, agg)
 
     period_str = f"{date_from.strftime('%d.%m')} — {date_to.strftime('%d.%m.%Y')}"
 
-    # {оператор: {"total": X, "came": X, "cancelled": X, "no_show": X, "usd": X}}
-    stats = {}
-
-    for shift in shifts:
-        for b in shift.get("bookings", []):
-            op_name = extract_operator_name(b)
-            if op_name not in stats:
-                stats[op_name] = {"total": 0, "came": 0, "cancelled": 0, "no_show": 0, "usd": 0}
-
-            stats[op_name]["total"] += 1
-
-            if b.get("deleted"):
-                stats[op_name]["cancelled"] += 1
-            elif b.get("cancelled"):
-                stats[op_name]["no_show"] += 1
-            elif b.get("done"):
-                stats[op_name]["came"] += 1
-                usd, _ = extract_booking_usd(b)
-                stats[op_name]["usd"] += usd
+    # {оператор: {"total": X, "came": X, "cancelled": X, "no_show": X, "usd": X}} — из роллапов
+    stats = sum_rollups(agg.rows, lambda r: r["operator"])
 
-    text = f"<b>Статистика операторов за {period_str}</b>\n"
-    text += "━" * 30 + "\n\n"
+    yield f"<b>Статистика операторов за {period_str}</b>\n"
+    yield "━" * 30 + "\n\n"
 
     if not stats:
-        text += "Нет данных за этот период.\n"
-        return text
+        yield "Нет данных за этот период.\n"
+        return
 
     for name in sorted(stats.keys()):
         s = stats[name]
@@ -1494,15 +2446,97 @@ def generate_operator_stats(date_from: datetime, date_to: datetime) -> str:
         # Процент успешных от общего
         success_pct = (came / total * 100) if total > 0 else 0
 
-        text += f"<b>{name}</b>\n"
-        text += f"  Всего броней: {total}\n"
-        text += f"  Пришёл: {came}\n"
-        text += f"  Отменено: {cancelled}\n"
-        text += f"  Не пришёл: {no_show}\n"
-        text += f"  Конверсия: {success_pct:.0f}%\n"
-        text += f"  Касса (пришедшие): {s['usd']:.0f}$\n\n"
+        yield f"<b>{name}</b>\n"
+        yield f"  Всего броней: {total}\n"
+        yield f"  Пришёл: {came}\n"
+        yield f"  Отменено: {cancelled}\n"
+        yield f"  Не пришёл: {no_show}\n"
+        yield f"  Конверсия: {success_pct:.0f}%\n"
+        yield f"  Касса (пришедшие): {s['usd']:.0f}$\n\n"
+
+
+
+# ==================== ПУЛ ДЛЯ СБОРКИ ОТЧЁТОВ ====================
+# Отчёт за квартал — секунды чистого CPU. Сборка идёт в потоке, а цикл событий
+# продолжает принимать брони. В поток уходит агрегат со снимком данных периода
+# (копии строк роллапов и текущих смен), поэтому правки во время сборки ему не мешают.
+# Рендереры — генераторы секций: первая часть уходит в чат, пока остальные ещё строятся.
+REPORT_WORKERS = 2      # потоков на все отчёты
+REPORTS_PER_USER = 1    # одновременных сборок у одного пользователя
+report_pool = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+_report_slots = {}  # {user_id: asyncio.Semaphore}
+_report_cancel = {}  # {user_id: threading.Event} — флаг отмены последней запрошенной сборки
 
-    return text
+
+def _stream_report(render, args: tuple, agg, loop, queue: asyncio.Queue, cancelled: threading.Event):
+    """Выполняется в потоке пула: гонит части отчёта в очередь цикла событий.
+    Последний элемент очереди — ("done", весь текст), ("cancelled", None) или ("error", исключение)."""
+    pieces = []
+
+    def tee():
+        for piece in render(*args, agg=agg):
+            if cancelled.is_set():
+                return
+            pieces.append(piece)
+            yield piece
+
+    try:
+        for chunk in pack_chunks(tee()):
+            loop.call_soon_threadsafe(queue.put_nowait, ("chunk", chunk))
+        final = ("cancelled", None) if cancelled.is_set() else ("done", "".join(pieces))
+    except Exception as e:
+        final = ("error", e)
+    loop.call_soon_threadsafe(queue.put_nowait, final)
+
+
+@in_lane(BULK)
+async def send_report(target, user_id: int, render, date_from: datetime, date_to: datetime, *filters,
+                      agg: Optional[ReportAggregate] = None, edit: bool = False) -> bool:
+    """Строит отчёт render (генератор с @cached_report) в пуле потоков и шлёт его частями.
+    Готовый отчёт из кэша отправляется сразу. Новый запрос того же пользователя отменяет
+    предыдущий: сборка останавливается, неотправленные части не уходят, результат — False."""
+    # Сначала гасим прошлую сборку: иначе её части продолжат приходить после ответа из кэша
+    previous = _report_cancel.get(user_id)
+    if previous:
+        previous.set()
+    key = report_key(render.kind, date_from, date_to, filters)
+    cached = report_cache_get(key)
+    if cached is not None:
+        await safe_send(target, cached, edit=edit)
+        return True
+
+    cancelled = _report_cancel[user_id] = threading.Event()
+    agg = aggregate_for(date_from, date_to, agg)  # снимок данных берётся здесь, в цикле событий
+    loop = asyncio.get_running_loop()
+    slot = _report_slots.setdefault(user_id, asyncio.Semaphore(REPORTS_PER_USER))
+    try:
+        await slot.acquire()
+        if cancelled.is_set():
+            slot.release()
+            return False
+        queue = asyncio.Queue()
+        future = report_pool.submit(_stream_report, render.__wrapped__, (date_from, date_to, *filters),
+                                    agg, loop, queue, cancelled)
+        # Слот освобождается, когда поток реально закончил
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(slot.release))
+        first = True
+        while True:
+            kind, value = await queue.get()
+            if kind == "error":
+                raise value
+            if kind == "done":
+                report_cache_put(key, value)
+                return True
+            if kind == "cancelled" or cancelled.is_set():
+                return False
+            await send_chunks(target, [value], edit=edit and first)
+            first = False
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+    finally:
+        if _report_cancel.get(user_id) is cancelled:
+            del _report_cancel[user_id]
 
 
 # ----------- Постоянная клавиатура в ЛС -----------
@@ -1562,12 +2596,7 @@ async def handle_my_salary_button(m: types.Message, state: FSMContext):
     await m.answer(f"<b>{op_name}, выбери период:</b>", reply_markup=kb, parse_mode=ParseMode.HTML)
 
 
-def generate_my_salary_report(date_from: datetime, date_to: datetime, op_name: str) -> str:
-    """Отчёт ЗП для оператора — используем полный отчёт по оператору."""
-    return generate_operator_report(date_from, date_to, op_name)
-
-
-@dp.callback_query(F.data.startswith("mysalary:"))
+@dp.callback_query(F.data.startswith("mysalary:"), flags=REPORT_FLAGS)
 async def my_salary_callbacks(c: types.CallbackQuery, state: FSMContext):
     op_name = get_operator_name_by_tg_id(c.from_user.id)
     if not op_name:
@@ -1582,8 +2611,7 @@ async def my_salary_callbacks(c: types.CallbackQuery, state: FSMContext):
         date_from = monday.replace(hour=0, minute=0, second=0, microsecond=0)
         date_to = now
         try:
-            report = generate_my_salary_report(date_from, date_to, op_name)
-            await safe_send(c.message, report)
+            await send_report(c.message, c.from_user.id, generate_operator_report, date_from, date_to, op_name)
         except Exception as e:
             await bot.send_message(c.from_user.id, f"Ошибка: {e}")
 
@@ -1594,8 +2622,7 @@ async def my_salary_callbacks(c: types.CallbackQuery, state: FSMContext):
         date_from = monday.replace(hour=0, minute=0, second=0, microsecond=0)
         date_to = sunday.replace(hour=23, minute=59, second=59)
         try:
-            report = generate_my_salary_report(date_from, date_to, op_name)
-            await safe_send(c.message, report)
+            await send_report(c.message, c.from_user.id, generate_operator_report, date_from, date_to, op_name)
         except Exception as e:
             await bot.send_message(c.from_user.id, f"Ошибка: {e}")
 
@@ -1609,7 +2636,7 @@ async def my_salary_callbacks(c: types.CallbackQuery, state: FSMContext):
     await c.answer()
 
 
-@dp.message(StateFilter(OperatorSalaryState.waiting_for_period))
+@dp.message(StateFilter(OperatorSalaryState.waiting_for_period), flags=REPORT_FLAGS)
 async def handle_operator_salary_period(m: types.Message, state: FSMContext):
     if m.chat.type != "private":
         return
@@ -1640,12 +2667,11 @@ async def handle_operator_salary_period(m: types.Message, state: FSMContext):
         await m.reply("Неверная дата. Формат: <code>01.02-15.02</code>", parse_mode=ParseMode.HTML)
         return
 
-    report = generate_my_salary_report(date_from, date_to, op_name)
+    await state.clear()
     try:
-        await safe_send(m, report)
+        await send_report(m, m.from_user.id, generate_operator_report, date_from, date_to, op_name)
     except Exception as e:
         await m.reply(f"Ошибка: {e}")
-    await state.clear()
 
 
 # ----------- Обработка нажатия текстовой кнопки «Отчёты» -----------
@@ -1689,7 +2715,7 @@ async def cmd_report(m: types.Message, state: FSMContext):
 
 
 # ----------- Callback: выбор типа отчёта -----------
-@dp.callback_query(F.data.startswith("rep:"))
+@dp.callback_query(F.data.startswith("rep:"), flags=REPORT_FLAGS)
 async def report_callbacks(c: types.CallbackQuery, state: FSMContext):
     if c.from_user.id not in OWNERS:
         await c.answer("Нет доступа", show_alert=True)
@@ -1704,16 +2730,14 @@ async def report_callbacks(c: types.CallbackQuery, state: FSMContext):
         sunday = monday + timedelta(days=6)
         date_from = monday.replace(hour=0, minute=0, second=0, microsecond=0)
         date_to = sunday.replace(hour=23, minute=59, second=59)
-        report = generate_period_report(date_from, date_to)
-        await safe_send(c.message, report, edit=True)
+        await send_report(c.message, c.from_user.id, generate_period_report, date_from, date_to, edit=True)
 
     elif action == "last_week":
         monday = now - timedelta(days=now.weekday() + 7)
         sunday = monday + timedelta(days=6)
         date_from = monday.replace(hour=0, minute=0, second=0, microsecond=0)
         date_to = sunday.replace(hour=23, minute=59, second=59)
-        report = generate_period_report(date_from, date_to)
-        await safe_send(c.message, report, edit=True)
+        await send_report(c.message, c.from_user.id, generate_period_report, date_from, date_to, edit=True)
 
     elif action == "custom":
         await state.set_state(ReportState.waiting_for_period)
@@ -1741,18 +2765,7 @@ async def report_callbacks(c: types.CallbackQuery, state: FSMContext):
 
     elif action == "girl":
         # Показываем список чатов
-        excluded = set(str(ch) for ch in EXCLUDED_FROM_REPORTS)
-        buttons = []
-        for ch_id in ALLOWED_CHATS:
-            if str(ch_id) in excluded:
-                continue
-            try:
-                chat = await bot.get_chat(ch_id)
-                title = (chat.title or chat.first_name or str(ch_id)).strip()
-            except:
-                title = str(ch_id)
-            buttons.append([InlineKeyboardButton(text=title, callback_data=f"girlchat:{ch_id}")])
-        kb = InlineKeyboardMarkup(inline_keyboard=buttons)
+        kb = await get_chat_list_kb("girlchat")
         await c.message.edit_text("Выбери чат:", reply_markup=kb)
 
     await c.answer()
@@ -1776,7 +2789,7 @@ async def girl_chat_selected(c: types.CallbackQuery, state: FSMContext):
 
 
 # ----------- Ввод периода вручную -----------
-@dp.message(StateFilter(ReportState.waiting_for_period))
+@dp.message(StateFilter(ReportState.waiting_for_period), flags=REPORT_FLAGS)
 async def handle_period_input(m: types.Message, state: FSMContext):
     if m.from_user.id not in OWNERS:
         return
@@ -1802,8 +2815,10 @@ async def handle_period_input(m: types.Message, state: FSMContext):
     mode = user_data.get("mode", "")
 
     if mode == "operator":
-        # Показываем список операторов за период кнопками
-        operators = get_all_operators(date_from, date_to)
+        # Показываем список операторов за период кнопками; агрегат пригодится для отчёта.
+        # За квартал это заметная работа — собираем его в пуле отчётов, не в цикле событий
+        agg = await asyncio.get_running_loop().run_in_executor(report_pool, build_aggregate, date_from, date_to)
+        operators = get_all_operators(date_from, date_to, agg=agg)
         if not operators:
             await m.reply("За этот период нет данных по сотрудникам.")
             await state.clear()
@@ -1812,6 +2827,7 @@ async def handle_period_input(m: types.Message, state: FSMContext):
         await state.update_data(
             date_from=date_from.strftime("%d.%m.%Y"),
             date_to=date_to.strftime("%d.%m.%Y"),
+            aggregate=agg,
         )
         await state.set_state(ReportState.waiting_for_operator)
 
@@ -1842,23 +2858,19 @@ async def handle_period_input(m: types.Message, state: FSMContext):
 
         kb = InlineKeyboardMarkup(inline_keyboard=buttons)
         await m.reply("Выбери сотрудника:", reply_markup=kb)
-    elif mode == "stats":
-        report = generate_operator_stats(date_from, date_to)
-        await safe_send(m, report)
-        await state.clear()
-    elif mode == "girl":
-        girl_chat_id = user_data.get("girl_chat_id", "")
-        report = generate_girl_report(date_from, date_to, girl_chat_id)
-        await safe_send(m, report)
-        await state.clear()
     else:
-        report = generate_period_report(date_from, date_to)
-        await safe_send(m, report)
         await state.clear()
+        if mode == "stats":
+            await send_report(m, m.from_user.id, generate_operator_stats, date_from, date_to)
+        elif mode == "girl":
+            girl_chat_id = user_data.get("girl_chat_id", "")
+            await send_report(m, m.from_user.id, generate_girl_report, date_from, date_to, girl_chat_id)
+        else:
+            await send_report(m, m.from_user.id, generate_period_report, date_from, date_to)
 
 
 # ----------- Выбор оператора -----------
-@dp.callback_query(F.data.startswith("op:"), StateFilter(ReportState.waiting_for_operator))
+@dp.callback_query(F.data.startswith("op:"), StateFilter(ReportState.waiting_for_operator), flags=REPORT_FLAGS)
 async def handle_operator_select(c: types.CallbackQuery, state: FSMContext):
     if c.from_user.id not in OWNERS:
         await c.answer("Нет доступа", show_alert=True)
@@ -1877,37 +2889,33 @@ async def handle_operator_select(c: types.CallbackQuery, state: FSMContext):
 
     date_from = date_from.replace(hour=0, minute=0, second=0)
     date_to = date_to.replace(hour=23, minute=59, second=59)
+    agg = user_data.get("aggregate")  # собран на шаге ввода периода
+    if agg is not None and not agg.is_current():
+        agg = None  # пока выбирали сотрудника, данные периода поменялись
+    await state.clear()
+    await c.answer()
 
+    uid = c.from_user.id
     if op_name == "__ALL__":
-        report = generate_period_report(date_from, date_to)
+        await send_report(c.message, uid, generate_period_report, date_from, date_to, agg=agg, edit=True)
     elif op_name.startswith("admin_"):
         # Отчёт по админу
         admin_name = op_name[6:]  # убираем "admin_"
-        report = generate_admin_report(date_from, date_to, admin_name)
+        await send_report(c.message, uid, generate_admin_report, date_from, date_to, admin_name, agg=agg, edit=True)
     else:
-        report = generate_operator_report(date_from, date_to, op_name)
-
-    await safe_send(c.message, report, edit=True)
-
-    await state.clear()
-    await c.answer()
+        await send_report(c.message, uid, generate_operator_report, date_from, date_to, op_name, agg=agg, edit=True)
 
 
 # ==================== РАСХОДЫ В ЛИЧКЕ ====================
 
-async def get_chat_list_kb():
-    """Генерирует кнопки со списком рабочих чатов (кроме исключённых)."""
+async def get_chat_list_kb(prefix: str = "expchat"):
+    """Генерирует кнопки со списком рабочих чатов (кроме исключённых).
+    Названия — из кэша, промахи запрашиваются параллельно."""
     excluded = set(str(c) for c in EXCLUDED_FROM_REPORTS)
-    buttons = []
-    for chat_id in ALLOWED_CHATS:
-        if str(chat_id) in excluded:
-            continue
-        try:
-            chat = await bot.get_chat(chat_id)
-            title = (chat.title or chat.first_name or str(chat_id)).strip()
-        except:
-            title = str(chat_id)
-        buttons.append([InlineKeyboardButton(text=title, callback_data=f"expchat:{chat_id}")])
+    chat_ids = [chat_id for chat_id in ALLOWED_CHATS if str(chat_id) not in excluded]
+    titles = await asyncio.gather(*(get_chat_title(chat_id) for chat_id in chat_ids))
+    buttons = [[InlineKeyboardButton(text=title or str(chat_id), callback_data=f"{prefix}:{chat_id}")]
+               for chat_id, title in zip(chat_ids, titles)]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
@@ -1954,12 +2962,7 @@ async def expense_chat_selected(c: types.CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
     exp_action = user_data.get("exp_action", "")
 
-    # Получаем название чата
-    try:
-        chat = await bot.get_chat(int(chat_id))
-        chat_title = (chat.title or chat.first_name or chat_id).strip()
-    except:
-        chat_title = chat_id
+    chat_title = await get_chat_title(chat_id) or chat_id
 
     await state.update_data(exp_chat_id=chat_id, exp_chat_title=chat_title)
 
@@ -2020,6 +3023,10 @@ async def expense_date_input(m: types.Message, state: FSMContext):
 
 
 # ----------- Ввод расхода -----------
+# тип сумма [валюта] [комментарий]; валюты — из справочника booking_parser
+EXPENSE_RE = re.compile(r"^(\S+)\s+(\d+(?:\.\d+)?)\s*(" + CURRENCY_PATTERN + r")?\s*(.*)?$", re.I)
+
+
 @dp.message(StateFilter(ExpenseState.waiting_for_input))
 async def expense_input(m: types.Message, state: FSMContext):
     if m.from_user.id not in OWNERS or m.chat.type != "private":
@@ -2027,10 +3034,7 @@ async def expense_input(m: types.Message, state: FSMContext):
 
     text = m.text.strip()
     # Парсим: тип сумма валюта [комментарий]
-    match = re.match(
-        r"^(\S+)\s+(\d+(?:\.\d+)?)\s*(лари|лар|lari|gel|доллар[аов]?|dollar|usd|\$|евро|euro|€|eur|драм|драмов|dram|amd|֏)?\s*(.*)?$",
-        text, re.I
-    )
+    match = EXPENSE_RE.match(text)
 
     if not match:
         await m.reply(
@@ -2052,8 +3056,7 @@ async def expense_input(m: types.Message, state: FSMContext):
     chat_title = user_data.get("exp_chat_title", "")
     date_str = user_data.get("exp_date", "")
 
-    expense = {
-        "id": next_expense_id(),
+    expense = expenses.add({
         "chat_id": chat_id,
         "chat_title": chat_title,
         "date": date_str,
@@ -2063,9 +3066,8 @@ async def expense_input(m: types.Message, state: FSMContext):
         "amount_usd": round(amount_usd, 2),
         "comment": comment,
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-    }
-    global_expenses.append(expense)
-    save_expenses()
+    })
+    save_expenses(added=[expense])
 
     cur_display = currency if currency != "$" else "USD"
     msg = (
@@ -2105,9 +3107,9 @@ async def expense_period_view(m: types.Message, state: FSMContext):
     chat_id = user_data.get("exp_chat_id", "")
     chat_title = user_data.get("exp_chat_title", "")
 
-    expenses = get_expenses_for_period(date_from, date_to, chat_id)
+    period_expenses = get_expenses_for_period(date_from, date_to, chat_id)
 
-    if not expenses:
+    if not period_expenses:
         await m.reply(f"Нет расходов по <b>{chat_title}</b> за этот период.", parse_mode=ParseMode.HTML)
         await state.clear()
         return
@@ -2115,9 +3117,8 @@ async def expense_period_view(m: types.Message, state: FSMContext):
     period_str = f"{date_from.strftime('%d.%m')} — {date_to.strftime('%d.%m.%Y')}"
     text_msg = f"<b>Расходы: {chat_title}</b>\n<b>Период: {period_str}</b>\n\n"
 
-    total_usd = 0
     buttons = []
-    for e in sorted(expenses, key=lambda x: parse_date_str(x.get("date", "")) or datetime.min):
+    for e in period_expenses:
         cur_display = e.get("currency", "$")
         if cur_display == "$":
             cur_display = "USD"
@@ -2125,13 +3126,19 @@ async def expense_period_view(m: types.Message, state: FSMContext):
         if e.get("comment"):
             line += f" ({e['comment']})"
         text_msg += line + "\n"
-        total_usd += e.get("amount_usd", 0)
         buttons.append([InlineKeyboardButton(
             text=f"Удалить: {e['date']} {e['type']} {e['amount']:.0f}",
             callback_data=f"expdel:{e['id']}"
         )])
 
-    text_msg += f"\n<b>Итого расходов:</b> {total_usd:.0f}$"
+    by_category = {}
+    for _, category, usd in expense_category_usd(date_from, date_to, chat_id):
+        by_category[category] = by_category.get(category, 0) + usd
+    if len(by_category) > 1:
+        text_msg += "\n<b>По категориям:</b>\n"
+        for category, usd in sorted(by_category.items(), key=lambda kv: -kv[1]):
+            text_msg += f"  {category.capitalize()}: {usd:.0f}$\n"
+    text_msg += f"\n<b>Итого расходов:</b> {sum(by_category.values()):.0f}$"
 
     kb = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
     await m.reply(text_msg, parse_mode=ParseMode.HTML, reply_markup=kb)
@@ -2146,15 +3153,10 @@ async def expense_delete(c: types.CallbackQuery):
         return
 
     exp_id = int(c.data.split(":", 1)[1])
-    found = None
-    for i, e in enumerate(global_expenses):
-        if e.get("id") == exp_id:
-            found = i
-            break
-
-    if found is not None:
-        removed = global_expenses.pop(found)
-        save_expenses()
+    removed = expenses.remove(exp_id)
+
+    if removed is not None:
+        save_expenses(removed=[removed])
         await c.answer(f"Удалён: {removed['type']} {removed['amount']:.0f}", show_alert=True)
         # Обновляем сообщение — убираем удалённую кнопку
         try:
@@ -2207,7 +3209,8 @@ async def handle_settings_button(m: types.Message, state: FSMContext):
     text = (
         f"<b>Настройки</b>\n\n"
         f"<b>Курсы валют:</b> {rates_info}\n"
-        f"<b>Текущие:</b> 1 лари = {current_lari_to_usd:.4f}$, 1 драм = {current_amd_to_usd:.5f}$\n\n"
+        f"<b>Текущие:</b> 1 лари = {current_lari_to_usd:.4f}$, 1 драм = {current_amd_to_usd:.5f}$\n"
+        f"<b>API обновлён:</b> {rates_updated_text()}\n\n"
         f"<b>Проценты ЗП операторов:</b>\n{pct_info}\n"
         f"  По умолчанию: {int(settings.get('default_percent', DEFAULT_PERCENT)*100)}%\n\n"
         f"<b>Проценты ЗП админов:</b>\n{admin_pct_info}\n\n"
@@ -2255,6 +3258,7 @@ async def settings_callbacks(c: types.CallbackQuery, state: FSMContext):
         settings.pop("rates", None)
         save_settings()
         update_exchange_rates()
+        record_rates_for_today()
         await c.message.edit_text("Курсы сброшены на автоматические (API).")
 
     elif action == "percent":
@@ -2369,6 +3373,12 @@ async def handle_dayoff_dates_input(m: types.Message, state: FSMContext):
 
     await m.reply(f"Выходные {op_name}: {', '.join(dates)}")
     await state.clear()
+
+
+RATE_INPUT_RE = re.compile(r"(" + RATE_CURRENCY_PATTERN + r")\s+([\d.]+)", re.I)
+
+
+@dp.message(StateFilter(SettingsState.waiting_for_rate))
 async def handle_rate_input(m: types.Message, state: FSMContext):
     if m.from_user.id not in OWNERS or m.chat.type != "private":
         return
@@ -2379,23 +3389,17 @@ async def handle_rate_input(m: types.Message, state: FSMContext):
     parts = m.text.strip().split(",")
     results = []
     for part in parts:
-        match = re.match(r"(лари|лар|евро|euro|драм|dram|amd)\s+([\d.]+)", part.strip(), re.I)
+        match = RATE_INPUT_RE.match(part.strip())
         if match:
-            cur = match.group(1).lower()
+            key = currency_key(match.group(1))
             val = float(match.group(2))
-            if any(x in cur for x in ["лари", "лар"]):
-                settings["rates"]["lari"] = val
-                results.append(f"лари = {val}$")
-            elif any(x in cur for x in ["евро", "euro"]):
-                settings["rates"]["euro"] = val
-                results.append(f"евро = {val}$")
-            elif any(x in cur for x in ["драм", "dram", "amd"]):
-                settings["rates"]["amd"] = val
-                results.append(f"драм = {val}$")
+            settings["rates"][CURRENCY_RATE[key]] = val
+            results.append(f"{key} = {val}$")
 
     if results:
         save_settings()
         update_exchange_rates()
+        record_rates_for_today()
         await m.reply(f"Курсы обновлены:\n" + "\n".join(results))
     else:
         await m.reply("Не удалось распознать. Формат: <code>лари 0.37</code>", parse_mode=ParseMode.HTML)
@@ -2533,18 +3537,68 @@ async def cmd_save_current(m: types.Message):
     await m.reply(f"Сохранено {count} смен в архив.")
 
 
+@dp.message(Command("perf"))
+async def cmd_perf(m: types.Message):
+    """Счётчики кэшей и фоновой записи (только владельцам, в личке)."""
+    if m.from_user.id not in OWNERS or m.chat.type != "private":
+        return
+    hits, misses = report_cache_stats["hits"], report_cache_stats["misses"]
+    hit_rate = f" ({hits * 100 / (hits + misses):.0f}%)" if hits + misses else ""
+    text = (
+        f"<b>Производительность</b>\n\n"
+        f"<b>Кэш отчётов:</b> {len(report_cache)}/{REPORT_CACHE_SIZE}, "
+        f"попаданий {hits}, промахов {misses}{hit_rate}\n"
+        f"<b>Запись на диск:</b> запросов {writer.requests}, записей {writer.writes}, ошибок {writer.errors}\n"
+        f"<b>Расходы:</b> {len(expenses)} записей, {len(expenses.totals)} чатов\n"
+        f"<b>Доска:</b> запросов {board_stats['requests']}, отрисовок {board_stats['renders']}, "
+        f"вызовов API {board_stats['calls']} (правок {board_stats['edits']}, перевыкладок {board_stats['reposts']}, "
+        f"без изменений {board_stats['skipped']}), сэкономлено {board_calls_saved()}\n"
+        f"<b>Названия чатов:</b> в кэше {len(chat_titles)}, попаданий {chat_title_stats['hits']}, "
+        f"запросов get_chat {chat_title_stats['fetches']}, ошибок {chat_title_stats['errors']}\n"
+        f"<b>Очередь отправки:</b> {outbox_depth_text()}, максимум {outbox.stats['max_depth']}; "
+        f"отправлено {outbox.stats['sent']}, ждали лимита {outbox.stats['throttled']}, "
+        f"повторов {outbox.stats['retries']}, потеряно {outbox.stats['drops']}\n"
+        f"<b>Нажатие → ответ:</b> {ack_latency_text()}\n"
+        f"<b>Фоновые действия:</b> выполнено {pipeline_stats['jobs']}, ошибок {pipeline_stats['errors']}, "
+        f"макс. очередь {pipeline_stats['max_depth']}\n"
+        f"<b>Таймеры броней:</b> активных {len(timer_records)}, в куче {len(timer_heap)}\n"
+        f"<b>Очередь апдейтов по чатам</b> (ждали / всего, среднее и макс. ожидание):\n{chat_wait_text()}"
+    )
+    if pipeline_stats["last_error"]:
+        text += f"\n<b>Последняя ошибка фоновых действий:</b> {html.escape(pipeline_stats['last_error'])}\n"
+    await m.answer(text)
+
+
+def chat_wait_text(limit: int = 5) -> str:
+    """Чаты с самым долгим ожиданием своей очереди апдейтов."""
+    if not chat_wait_stats:
+        return "  пока пусто\n"
+    lines = []
+    top = sorted(chat_wait_stats.items(), key=lambda item: item[1]["max"], reverse=True)[:limit]
+    for chat_id, st in top:
+        title = (chat_titles.get(chat_id) or (None,))[0] or str(chat_id)
+        avg = st["total"] / st["updates"] * 1000
+        lines.append(f"  {title}: {st['waited']}/{st['updates']}, {avg:.0f} / {st['max'] * 1000:.0f} мс\n")
+    return "".join(lines)
+
+
+def outbox_depth_text() -> str:
+    depth = outbox.depth()
+    if not depth:
+        return "пусто"
+    return ", ".join(f"{LANE_NAMES[p]} {n}" for p, n in sorted(depth.items()))
+
+
 def cleanup_old_history():
-    """Удаляет записи из history.json старше 90 дней."""
+    """Удаляет из архива месяцы, целиком лежащие раньше чем 90 дней назад."""
     cutoff = datetime.now() - timedelta(days=90)
-    before = len(history.get("shifts", []))
-    history["shifts"] = [
-        s for s in history.get("shifts", [])
-        if (parse_date_str(s.get("date", "")) or datetime.min) >= cutoff
-    ]
-    after = len(history["shifts"])
-    if before != after:
-        save_history()
-        print(f"Очистка history: удалено {before - after} старых записей")
+    dropped = history.drop_before(cutoff)
+    if dropped:
+        drop_rollup_months(dropped)
+        rebuild_booking_indexes()
+        touch_all()
+        writer.mark_dirty("history", pruned=dropped)
+        print(f"Очистка history: удалены месяцы {', '.join(dropped)}")
 
 
 # ==================== РОТАЦИЯ АНКЕТ (Google Sheets) ====================
@@ -2611,6 +3665,7 @@ def get_active_anketas(sheet) -> list:
     return anketas
 
 
+@in_lane(BULK)
 async def distribute_anketas(force: bool = False):
     """Ротация анкет: распределяет активные анкеты среди операторов по кругу."""
     if not OPERATORS or not GOOGLE_SHEET_ID:
@@ -2666,6 +3721,13 @@ async def distribute_anketas(force: bool = False):
     # Распределяем — каждая анкета только одному оператору
     assigned_ops = []
     unassigned_ops = []
+    planned = []  # [(оператор, tg_id, анкета)]
+    jobs = []
+
+    async def send_anketa(op_name: str, op_tg_id: int, anketa: dict, msg: str):
+        # Записываем в таблицу имя оператора (столбец E)
+        sheet.update_cell(anketa["row"], 5, op_name)
+        await bot.send_message(op_tg_id, msg, parse_mode=ParseMode.HTML)
 
     for i, (op_name, op_tg_id) in enumerate(op_list):
         if i >= num_anketas:
@@ -2685,22 +3747,23 @@ async def distribute_anketas(force: bool = False):
             f"Отправь номер телефона, который поставишь на эту анкету:"
         )
 
-        try:
-            # Записываем в таблицу имя оператора (столбец E)
-            sheet.update_cell(anketa["row"], 5, op_name)
-
-            await bot.send_message(op_tg_id, msg, parse_mode=ParseMode.HTML)
+        planned.append((op_name, op_tg_id, anketa))
+        jobs.append((op_name, send_anketa(op_name, op_tg_id, anketa, msg)))
 
-            # Сохраняем привязку оператор -> строка (работает весь день)
-            anketa_assignments[op_tg_id] = {
-                "row": anketa["row"],
-                "anketa": anketa,
-                "date": today,
-            }
-            assigned_ops.append((op_name, anketa))
-            print(f"Анкета {anketa['login']} → {op_name}")
-        except Exception as e:
-            print(f"Ошибка отправки анкеты {op_name}: {e}")
+    # Всем операторам разом; привязки — только тем, кому анкета дошла
+    results = await fan_out(jobs)
+    for op_name, op_tg_id, anketa in planned:
+        if results[op_name] is not None:
+            print(f"Ошибка отправки анкеты {op_name}: {results[op_name]}")
+            continue
+        # Сохраняем привязку оператор -> строка (работает весь день)
+        anketa_assignments[op_tg_id] = {
+            "row": anketa["row"],
+            "anketa": anketa,
+            "date": today,
+        }
+        assigned_ops.append((op_name, anketa))
+        print(f"Анкета {anketa['login']} → {op_name}")
 
     # Уведомляем владельцев
     summary = f"<b>Анкеты распределены на {today}:</b>\n\n"
@@ -2710,11 +3773,7 @@ async def distribute_anketas(force: bool = False):
     if unassigned_ops:
         summary += f"\n<b>Без анкеты (не хватило):</b> {', '.join(unassigned_ops)}\n"
 
-    for owner_id in OWNERS:
-        try:
-            await bot.send_message(owner_id, summary, parse_mode=ParseMode.HTML)
-        except:
-            pass
+    log_failures("Анкеты владельцам", await broadcast(OWNERS, summary, parse_mode=ParseMode.HTML))
 
 
 # Хранилище привязок оператор -> строка в таблице (для записи номера)
@@ -2797,6 +3856,7 @@ def get_recent_usdt_transfers(wallet: str, limit: int = 5) -> list:
     return []
 
 
+@in_lane(ALERT)
 async def check_crypto_payments():
     """Проверяет новые входящие USDT транзакции и отправляет уведомления."""
     global last_seen_tx
@@ -2859,18 +3919,12 @@ async def check_crypto_payments():
                 f"<b>Баланс кошелька:</b> {balance:.2f} USDT"
             )
 
-            try:
-                await bot.send_message(CRYPTO_CHAT, msg_chat, parse_mode=ParseMode.HTML,
-                                       message_thread_id=CRYPTO_TOPIC)
-            except Exception as e:
-                print(f"Ошибка отправки крипто-уведомления в чат: {e}")
-
-            # Дублируем владельцам в ЛС
-            for owner_id in OWNERS:
-                try:
-                    await bot.send_message(owner_id, msg_owner, parse_mode=ParseMode.HTML)
-                except:
-                    pass
+            # В чат КРИПТА и дублем владельцам в ЛС — одновременно
+            jobs = [(CRYPTO_CHAT, bot.send_message(CRYPTO_CHAT, msg_chat, parse_mode=ParseMode.HTML,
+                                                   message_thread_id=CRYPTO_TOPIC))]
+            jobs += [(owner_id, bot.send_message(owner_id, msg_owner, parse_mode=ParseMode.HTML))
+                     for owner_id in OWNERS]
+            log_failures("Крипто-уведомление", await fan_out(jobs))
 
     except Exception as e:
         print(f"Ошибка проверки крипто: {e}")
@@ -2912,17 +3966,93 @@ async def scheduler():
         await asyncio.sleep(30)
 
 
+# ==================== ПРИЁМ АПДЕЙТОВ: POLLING / WEBHOOK ====================
+async def run_webhook():
+    """Апдейты приходят POST-запросами на WEBHOOK_PATH; чужие запросы без
+    X-Telegram-Bot-Api-Secret-Token отсекает SimpleRequestHandler.
+    set_webhook сам выключает getUpdates — накопленные апдейты Telegram дошлёт сюда."""
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                          allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=False)
+    print(f"Webhook: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH} → {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    # Как start_polling: SIGTERM/SIGINT завершают приём штатно, и finally в main() дописывает данные
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows — остаётся KeyboardInterrupt
+            pass
+    try:
+        await stop.wait()
+        print("Webhook: остановка по сигналу")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+        # Вебхук не снимаем: пока бот перезапускается, Telegram копит апдейты.
+        # cleanup останавливает сервер и закрывает сессию бота (on_shutdown aiogram)
+        await runner.cleanup()
+
+
+async def run_polling():
+    # Переключение с webhook: снимаем его, не выбрасывая накопленные апдейты
+    await bot.delete_webhook(drop_pending_updates=False)
+    await dp.start_polling(bot)
+
+
 async def main():
+    # Вся загрузка — здесь: импорт bot.py не трогает файлы
+    if STORAGE_BACKEND == "sqlite":
+        store.migrate_from_json(json_store)
     load_data()
     load_history()
+    load_rate_history()
+    migrate_parsed_fields()
+    rebuild_rollups()
+    rebuild_booking_indexes()
     load_expenses()
     load_settings()
+    if store.journal_entries:
+        save_data()  # проиграли журнал при загрузке — сразу фиксируем снимок
+    writer_task = asyncio.create_task(writer.run())
+    await refresh_exchange_rates()
+    asyncio.create_task(rates_refresher())
+    await warm_chat_titles()
+    load_timers()
+    asyncio.create_task(timer_loop())
     await daily_job()
     asyncio.create_task(scheduler())
+    asyncio.create_task(journal_compactor())
     if CRYPTO_WALLET and CRYPTO_CHAT:
         asyncio.create_task(crypto_monitor_loop())
         print(f"Крипто-мониторинг запущен: {CRYPTO_WALLET[:8]}...")
-    await dp.start_polling(bot)
+    try:
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            await run_polling()
+    finally:
+        # Дописываем на диск всё, что не успел записать фоновый writer
+        # flush, прерванный отменой, возвращает недописанное в очередь
+        writer_task.cancel()
+        await asyncio.gather(writer_task, return_exceptions=True)
+        await writer.flush()
+        if store.journal_entries:
+            writer.mark_dirty("data")
+            await writer.flush()
+        store.close()
 
 
 if __name__ == "__main__":
@@ -31,3 +31,17 @@ GOOGLE_SHEET_NAME = "xGeorgia"
 GOOGLE_CREDS_FILE = "google_creds.json"
 
 
+
+# Хранилище: "json" (data.json / history.json / expenses.json) или "sqlite" (bot.db, WAL)
+STORAGE_BACKEND = "json"
+
+# Итоги смены владельцам: True — один дайджест по всем чатам, False — отдельное сообщение на каждый чат
+SUMMARY_DIGEST = True
+
+# Доставка апдейтов: пустой WEBHOOK_URL — long polling; иначе публичный https-адрес
+# бота (без пути), бот сам поставит вебхук и поднимет aiohttp-сервер
+WEBHOOK_URL = ""
+# WEBHOOK_HOST = "0.0.0.0"
+# WEBHOOK_PORT = 8080
+# WEBHOOK_PATH = "/webhook"
+# WEBHOOK_SECRET = "длинная-случайная-строка"   # A-Z, a-z, 0-9, _ и -
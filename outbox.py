@@ -0,0 +1,186 @@
+# outbox.py — исходящие запросы к Bot API: лимиты Telegram, retry_after, полосы приоритета
+import asyncio
+import bisect
+import contextvars
+import functools
+import itertools
+import time
+from contextlib import contextmanager
+
+from aiogram.exceptions import TelegramRetryAfter
+
+# ==================== ПОЛОСЫ ПРИОРИТЕТА ====================
+# Меньше — важнее. Полоса берётся из контекста задачи (with lane(...)),
+# по умолчанию — INTERACTIVE: ответ на действие пользователя.
+INTERACTIVE = 0  # «Добавлено!», правка брони, ответы на кнопки
+ALERT = 1        # крипто-поступления, таймеры
+BOARD = 2        # доски смен
+BULK = 3         # отчёты, итоги, рассылка анкет
+
+LANE_NAMES = {INTERACTIVE: "ответы", ALERT: "оповещения", BOARD: "доски", BULK: "отчёты"}
+
+_lane = contextvars.ContextVar("outbox_lane", default=INTERACTIVE)
+
+# Методы, которые пишут в чат и подпадают под лимиты (getChat, answerCallbackQuery,
+# getUpdates и прочие идут мимо очереди)
+LIMITED_PREFIXES = ("Send", "Edit", "Delete", "Forward", "Copy")
+
+
+@contextmanager
+def lane(priority: int):
+    """Все отправки внутри блока (в этой задаче) идут в полосе priority."""
+    token = _lane.set(priority)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def in_lane(priority: int):
+    """Декоратор корутины: всё, что она отправляет, идёт в полосе priority."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with lane(priority):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity; block() — пауза после retry_after."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет токен (0 — уже есть)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class Outbox:
+    """Центральная очередь исходящих запросов.
+
+    Каждый запрос ждёт токен своего чата и глобальный токен. Ожидающие
+    упорядочены по (полоса, очередь поступления); выдаётся первый, чей чат
+    не исчерпал лимит, — занятый чат не держит остальные. TelegramRetryAfter
+    замораживает чат на retry_after секунд, запрос повторяется до max_retries раз,
+    потом считается потерянным и ошибка уходит вызывающему.
+
+    Подключается как middleware сессии: bot.session.middleware(outbox.middleware)."""
+
+    def __init__(self, global_rate: float = 30, private=(1.0, 3), group=(20 / 60, 10), max_retries: int = 3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private = private  # (токенов в секунду, запас) для личек
+        self.group = group      # то же для групп (chat_id < 0)
+        self.max_retries = max_retries
+        self.buckets = {}       # {chat_id: TokenBucket}
+        self._waiting = []      # [(полоса, номер, chat_id, future)] по порядку выдачи
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._pump_task = None
+        self.stats = {"sent": 0, "throttled": 0, "retries": 0, "drops": 0, "max_depth": 0}
+
+    def bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        if key not in self.buckets:
+            rate, capacity = self.group if key.startswith("-") else self.private
+            self.buckets[key] = TokenBucket(rate, capacity)
+        return self.buckets[key]
+
+    def depth(self) -> dict:
+        """{полоса: сколько запросов ждут}"""
+        result = {}
+        for priority, _, _, _ in self._waiting:
+            result[priority] = result.get(priority, 0) + 1
+        return result
+
+    async def acquire(self, chat_id, priority: int):
+        loop = asyncio.get_running_loop()
+        if self._pump_task is None or self._pump_task.done():
+            self._wakeup = asyncio.Event()
+            self._pump_task = loop.create_task(self._pump())
+        entry = (priority, next(self._seq), str(chat_id), loop.create_future())
+        bisect.insort(self._waiting, entry)
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._waiting))
+        self._wakeup.set()
+        try:
+            await entry[3]
+        except asyncio.CancelledError:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+            raise
+
+    async def _pump(self):
+        while True:
+            delay = None
+            now = time.monotonic()
+            if self._waiting:
+                delay = self.global_bucket.wait_time(now)
+                if delay <= 0:
+                    delay = self._grant(now)
+                    if delay == 0:
+                        continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant(self, now: float):
+        """Выдаёт токен первому ожидающему с доступным чатом.
+        Возвращает 0, если выдал, иначе — сколько ждать до ближайшего токена (None — некого ждать)."""
+        delay = None
+        for i, (priority, _, chat_id, fut) in enumerate(self._waiting):
+            if fut.done():  # отменили, пока ждал
+                del self._waiting[i]
+                return 0
+            wait = self.bucket(chat_id).wait_time(now)
+            if wait <= 0:
+                self.bucket(chat_id).take()
+                self.global_bucket.take()
+                del self._waiting[i]
+                fut.set_result(None)
+                return 0
+            delay = wait if delay is None else min(delay, wait)
+        return delay
+
+    async def send(self, chat_id, call):
+        """call() — корутина-фабрика самого запроса; повторяется после retry_after."""
+        priority = _lane.get()
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            await self.acquire(chat_id, priority)
+            if time.monotonic() - started > 0.05:
+                self.stats["throttled"] += 1
+            try:
+                result = await call()
+            except TelegramRetryAfter as e:
+                self.bucket(chat_id).block(e.retry_after)
+                if attempt == self.max_retries:
+                    self.stats["drops"] += 1
+                    print(f"Outbox: сообщение в {chat_id} потеряно после {attempt + 1} попыток (retry_after {e.retry_after})")
+                    raise
+                self.stats["retries"] += 1
+                continue
+            self.stats["sent"] += 1
+            return result
+
+    async def middleware(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(LIMITED_PREFIXES):
+            return await make_request(bot, method)
+        return await self.send(chat_id, lambda: make_request(bot, method))
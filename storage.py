@@ -0,0 +1,882 @@
+# storage.py — бэкенды хранения: JSON-файлы (как раньше) и SQLite (WAL)
+import asyncio
+import bisect
+import copy
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+
+def date_to_iso(date_str: str) -> str:
+    """ДД.ММ.ГГГГ -> ГГГГ-ММ-ДД (для индексов и сортировки). Непонятное отдаём как есть."""
+    try:
+        return datetime.strptime((date_str or "").strip(), "%d.%m.%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return date_str or ""
+
+
+def month_of(date_str: str) -> str:
+    """ДД.ММ.ГГГГ -> ГГГГ-ММ — ключ месячного сегмента архива. Непонятные даты — в "0000-00"."""
+    try:
+        return datetime.strptime((date_str or "").strip(), "%d.%m.%Y").strftime("%Y-%m")
+    except ValueError:
+        return UNKNOWN_MONTH
+
+
+UNKNOWN_MONTH = "0000-00"
+
+
+def _read_json(path: str, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def write_json_atomic(path: str, obj):
+    """Пишем во временный файл и подменяем — файл никогда не остаётся наполовину записанным."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ==================== ЖУРНАЛ МУТАЦИЙ ====================
+# Одна строка журнала — одно изменение смены:
+#   add / done / cancel / delete / edit / update — {"booking": {...}} (бронь целиком, upsert по id)
+#   new_shift — {"date", "chat_title"}: брони и расходы смены сбрасываются
+#   meta      — {"fields": {...}}: board_msg, chat_title и т.п.
+#   expenses  — {"expenses": [...]}: расходы смены целиком (/expense)
+#   chat      — {"state": {...}}: чат целиком (новый чат)
+# Все операции идемпотентны, поэтому повторное проигрывание поверх свежего снимка безопасно.
+BOOKING_OPS = ("add", "done", "cancel", "delete", "edit", "update")
+
+
+def apply_mutation(data: dict, entry: dict):
+    chats = data.setdefault("chats", {})
+    op = entry.get("op")
+    chat_id = str(entry.get("chat", ""))
+    if op == "chat":
+        chats[chat_id] = entry["state"]
+        return
+    chat = chats.setdefault(chat_id, {
+        "bookings": [], "expenses": [], "board_msg": None, "date": "", "chat_title": "", "next_id": 1,
+    })
+    if op in BOOKING_OPS:
+        booking = entry["booking"]
+        bookings = chat.setdefault("bookings", [])
+        for i, b in enumerate(bookings):
+            if b.get("id") == booking.get("id"):
+                bookings[i] = booking
+                break
+        else:
+            bookings.append(booking)
+        chat["next_id"] = max(chat.get("next_id", 1), booking.get("id", 0) + 1)
+    elif op == "new_shift":
+        chat["bookings"] = []
+        chat["expenses"] = []
+        chat["next_id"] = 1
+        chat["date"] = entry.get("date", chat.get("date", ""))
+        chat["chat_title"] = entry.get("chat_title", chat.get("chat_title", ""))
+    elif op == "meta":
+        chat.update(entry.get("fields", {}))
+    elif op == "expenses":
+        chat["expenses"] = entry.get("expenses", [])
+
+
+# ==================== АРХИВ СМЕН ПО МЕСЯЦАМ ====================
+def date_ordinal(date_str: str):
+    """ДД.ММ.ГГГГ -> date.toordinal(). Непонятная дата — None."""
+    try:
+        return datetime.strptime((date_str or "").strip(), "%d.%m.%Y").toordinal()
+    except ValueError:
+        return None
+
+
+class DateIndex:
+    """Записи, отсортированные по дате (ordinal), плюс такие же корзины по chat_id.
+
+    Дата записи разбирается один раз при добавлении; выборка за период —
+    два bisect по отсортированным ключам (ordinal, порядковый номер).
+    Чтение безопасно из потоков пула отчётов: изменения и выборки под замком."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._items = []
+        self._chats = {}  # {chat_id: (ключи, записи)}
+        self._key_of = {}  # {id(запись): ключ}
+        self._seq = 0
+
+    def add(self, item, ordinal, chat_id=None):
+        """Добавляет запись; ordinal=None — запись без даты, в выборки не попадает."""
+        if ordinal is None:
+            return
+        with self._lock:
+            self._seq += 1
+            key = (ordinal, self._seq)
+            self._key_of[id(item)] = key
+            self._insert(self._keys, self._items, key, item)
+            if chat_id is not None:
+                keys, items = self._chats.setdefault(str(chat_id), ([], []))
+                self._insert(keys, items, key, item)
+
+    def remove(self, item, chat_id=None) -> bool:
+        with self._lock:
+            key = self._key_of.pop(id(item), None)
+            if key is None:
+                return False
+            self._delete(self._keys, self._items, key)
+            if chat_id is not None and str(chat_id) in self._chats:
+                self._delete(*self._chats[str(chat_id)], key)
+            return True
+
+    def between(self, date_from, date_to, chat_id=None) -> list:
+        """[(ordinal, запись)] с датой в [date_from, date_to] по порядку дат."""
+        with self._lock:
+            keys, items, lo, hi = self._bounds(date_from, date_to, chat_id)
+            return [(keys[i][0], items[i]) for i in range(lo, hi)]
+
+    def count(self, date_from, date_to, chat_id=None) -> int:
+        with self._lock:
+            _, _, lo, hi = self._bounds(date_from, date_to, chat_id)
+            return hi - lo
+
+    def _bounds(self, date_from, date_to, chat_id):
+        if chat_id is None:
+            keys, items = self._keys, self._items
+        else:
+            keys, items = self._chats.get(str(chat_id), ([], []))
+        lo = bisect.bisect_left(keys, (date_from.toordinal(),))
+        hi = bisect.bisect_left(keys, (date_to.toordinal() + 1,))
+        return keys, items, lo, hi
+
+    def clear(self):
+        self.__init__()
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def _insert(keys, items, key, item):
+        i = bisect.bisect_right(keys, key)
+        keys.insert(i, key)
+        items.insert(i, item)
+
+    @staticmethod
+    def _delete(keys, items, key):
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+            del items[i]
+
+
+class BookingIndex:
+    """Инвертированный индекс броней: ключ (оператор, чат, ...) -> [(дата, смена, бронь)].
+
+    key(shift, booking) вычисляет ключ. Архивные смены добавляются по одной и
+    больше не меняются. Текущая смена чата переиндексируется целиком (set_live):
+    в ней десятки броней, а правка может сменить и оператора, и статус.
+    Брони текущих смен хранятся копиями — отчёт в потоке видит снимок."""
+
+    def __init__(self, key):
+        self.key = key
+        self.names = {}     # {ключ: как ключ записан в первой брони} — для кнопок
+        self._archived = {}  # {ключ: DateIndex записей (смена, бронь)}
+        self._live = {}      # {chat_id: (ordinal, {ключ: [(смена, бронь)]})}
+
+    def _key_of(self, shift, booking):
+        raw = self.key(shift, booking)
+        key = raw.casefold()
+        self.names.setdefault(key, raw)
+        return key
+
+    def add_shift(self, shift: dict, ordinal, bookings):
+        """Архивная смена; bookings — какие её брони индексировать."""
+        if ordinal is None:
+            return
+        for b in bookings:
+            self._archived.setdefault(self._key_of(shift, b), DateIndex()).add((shift, b), ordinal)
+
+    def set_live(self, chat_id, shift: dict, ordinal, bookings):
+        """Заменяет записи текущей смены чата (shift — без броней, только шапка)."""
+        grouped = {}
+        for b in bookings:
+            grouped.setdefault(self._key_of(shift, b), []).append((shift, dict(b)))
+        self._live[str(chat_id)] = (ordinal, grouped)
+
+    def drop_live(self, chat_id):
+        self._live.pop(str(chat_id), None)
+
+    def between(self, key: str, date_from, date_to) -> list:
+        """[(ordinal, смена, бронь)] по ключу за период, архив по порядку дат + текущие смены."""
+        key = key.casefold()
+        result = []
+        if key in self._archived:
+            result = [(o, shift, b) for o, (shift, b) in self._archived[key].between(date_from, date_to)]
+        lo, hi = date_from.toordinal(), date_to.toordinal()
+        for ordinal, grouped in list(self._live.values()):
+            if ordinal is not None and lo <= ordinal <= hi:
+                result.extend((ordinal, shift, b) for shift, b in grouped.get(key, ()))
+        return result
+
+    def keys_between(self, date_from, date_to) -> list:
+        """Ключи, у которых есть брони в периоде — без обхода самих броней."""
+        keys = {k for k, idx in self._archived.items() if idx.count(date_from, date_to)}
+        lo, hi = date_from.toordinal(), date_to.toordinal()
+        for ordinal, grouped in list(self._live.values()):
+            if ordinal is not None and lo <= ordinal <= hi:
+                keys.update(k for k, entries in grouped.items() if entries)
+        return sorted(keys)
+
+    def clear(self):
+        self._archived.clear()
+        self._live.clear()
+        self.names.clear()
+
+
+# ==================== РЕЕСТР РАСХОДОВ ====================
+class ExpenseLedger:
+    """Расходы: словарь по id, корзины по чатам в порядке дат, итоги по категориям.
+
+    id выдаются счётчиком, который сохраняется вместе с расходами: id удалённого
+    расхода не достанется новому (иначе старая кнопка «Удалить» снесёт чужую запись).
+    Удаление и поиск — по словарю. Дата расхода разбирается один раз при добавлении (DateIndex).
+    totals — накопительные суммы {chat_id: {ordinal дня: {категория: {валюта: сумма}}}},
+    категория — тип расхода в нижнем регистре; итоги за период (category_totals)
+    складываются по дням, а не по записям. Читать можно из потоков пула отчётов."""
+
+    def __init__(self, expenses=None, next_id: Optional[int] = None):
+        self.by_id = {}
+        self.index = DateIndex()
+        self.totals = {}
+        self._lock = threading.Lock()
+        self.next_id = 1
+        for e in expenses or []:
+            self.add(e)
+        self.next_id = max(self.next_id, next_id or 1)
+
+    def new_id(self) -> int:
+        eid = self.next_id
+        self.next_id += 1
+        return eid
+
+    def add(self, expense: dict) -> dict:
+        """Добавляет запись; без id — выдаёт новый."""
+        if not expense.get("id"):
+            expense["id"] = self.new_id()
+        self.next_id = max(self.next_id, expense["id"] + 1)
+        self.by_id[expense["id"]] = expense
+        self.index.add(expense, date_ordinal(expense.get("date", "")), expense.get("chat_id", ""))
+        self._count(expense, 1)
+        return expense
+
+    def remove(self, expense_id) -> Optional[dict]:
+        expense = self.by_id.pop(expense_id, None)
+        if expense is not None:
+            self.index.remove(expense, expense.get("chat_id", ""))
+            self._count(expense, -1)
+        return expense
+
+    def get(self, expense_id) -> Optional[dict]:
+        return self.by_id.get(expense_id)
+
+    def between(self, date_from, date_to, chat_id=None) -> list:
+        """[(ordinal, расход)] за период по порядку дат; chat_id — только корзина чата."""
+        return self.index.between(date_from, date_to, chat_id)
+
+    def all(self) -> list:
+        return list(self.by_id.values())
+
+    def category_totals(self, date_from, date_to, chat_id=None) -> list:
+        """[(ordinal, категория, {валюта: сумма})] за период по порядку дат; chat_id — только этот чат."""
+        lo, hi = date_from.toordinal(), date_to.toordinal()
+        merged = {}
+        with self._lock:
+            chats = [self.totals.get(str(chat_id), {})] if chat_id is not None else list(self.totals.values())
+            for days in chats:
+                for ordinal, categories in days.items():
+                    if not lo <= ordinal <= hi:
+                        continue
+                    for category, amounts in categories.items():
+                        per_currency = merged.setdefault((ordinal, category), {})
+                        for currency, amount in amounts.items():
+                            per_currency[currency] = per_currency.get(currency, 0) + amount
+        return [(ordinal, category, amounts) for (ordinal, category), amounts in sorted(merged.items())]
+
+    def _count(self, expense: dict, sign: int):
+        ordinal = date_ordinal(expense.get("date", ""))
+        if ordinal is None:
+            return
+        category = (expense.get("type") or "").lower()
+        currency = expense.get("currency", "$")
+        with self._lock:
+            days = self.totals.setdefault(str(expense.get("chat_id", "")), {})
+            categories = days.setdefault(ordinal, {})
+            per_currency = categories.setdefault(category, {})
+            per_currency[currency] = per_currency.get(currency, 0) + sign * expense.get("amount", 0)
+            if sign < 0 and not any(per_currency.values()):
+                del categories[category]
+                if not categories:
+                    del days[ordinal]
+
+    def __len__(self):
+        return len(self.by_id)
+
+
+class ShiftArchive:
+    """Архив смен, разбитый на месячные сегменты по дате смены: {"2026-02": [смены]}.
+
+    Сегменты — единица хранения и очистки (удаляются целиком). Выборка за
+    период идёт по DateIndex: смены, отсортированные по дате, и корзины по чатам."""
+
+    def __init__(self, shifts=None):
+        self.partitions = {}
+        self.index = DateIndex()
+        for shift in shifts or []:
+            self.add(shift)
+
+    def add(self, shift: dict) -> str:
+        month = month_of(shift.get("date", ""))
+        self.partitions.setdefault(month, []).append(shift)
+        self.index.add(shift, date_ordinal(shift.get("date", "")), shift.get("chat_id"))
+        return month
+
+    def query(self, date_from: datetime, date_to: datetime, chat_id=None) -> list:
+        """Смены с датой в [date_from, date_to] (по дням), по порядку дат; chat_id — только этого чата."""
+        return [shift for _, shift in self.index.between(date_from, date_to, chat_id)]
+
+    def drop_before(self, cutoff: datetime) -> list:
+        """Удаляет сегменты, целиком лежащие раньше cutoff. Возвращает их ключи."""
+        cutoff_key = cutoff.strftime("%Y-%m")
+        dropped = sorted(k for k in self.partitions if k < cutoff_key)
+        for key in dropped:
+            for shift in self.partitions.pop(key):
+                self.index.remove(shift, shift.get("chat_id"))
+        return dropped
+
+    def all(self):
+        for key in sorted(self.partitions):
+            yield from self.partitions[key]
+
+    def __len__(self):
+        return sum(len(p) for p in self.partitions.values())
+
+
+class RateHistory:
+    """Курсы к USD по дням: {"ГГГГ-ММ-ДД": {"lari": .., "euro": .., "amd": ..}}.
+
+    Поиск курса на дату — ближайший предыдущий день с записью (bisect по
+    отсортированным ordinal-ам), для дат раньше первой записи — самая ранняя.
+    version растёт при каждом изменении таблицы; stamp() — версия курсов периода."""
+
+    def __init__(self, days=None):
+        self.days = {}
+        self._ordinals = []  # отсортированные date.toordinal() ключей days
+        self._by_ordinal = {}
+        self._stamps = {}  # {ordinal: version на момент последней записи дня}
+        self.version = 0
+        for key, rates in (days or {}).items():
+            try:
+                self.set(datetime.strptime(key, "%Y-%m-%d"), rates)
+            except (ValueError, TypeError):
+                continue
+
+    def set(self, day, rates: dict) -> bool:
+        """Записывает курсы на день. Возвращает True, если что-то поменялось."""
+        rates = {k: v for k, v in rates.items() if v}
+        key = day.strftime("%Y-%m-%d")
+        if self.days.get(key) == rates:
+            return False
+        ordinal = day.toordinal()
+        if key not in self.days:
+            bisect.insort(self._ordinals, ordinal)
+        self.days[key] = rates
+        self._by_ordinal[ordinal] = rates
+        self.version += 1
+        self._stamps[ordinal] = self.version
+        return True
+
+    def lookup(self, day):
+        """Курсы на день или None, если таблица пуста."""
+        if not self._ordinals:
+            return None
+        i = bisect.bisect_right(self._ordinals, day.toordinal())
+        return self._by_ordinal[self._ordinals[max(i - 1, 0)]]
+
+    def stamp(self, date_from, date_to) -> tuple:
+        """Записи, от которых зависят курсы дней [date_from, date_to], с их версиями.
+        Меняется, только если поменялся курс, действующий внутри периода."""
+        lo = max(bisect.bisect_right(self._ordinals, date_from.toordinal()) - 1, 0)
+        hi = max(bisect.bisect_right(self._ordinals, date_to.toordinal()), lo + 1)
+        return tuple((o, self._stamps[o]) for o in self._ordinals[lo:hi])
+
+    def to_dict(self) -> dict:
+        return dict(sorted(self.days.items()))
+
+    def __len__(self):
+        return len(self.days)
+
+
+# ==================== JSON (старый формат) ====================
+class JsonStorage:
+    """Всё хранится в data.json / history/ГГГГ-ММ.json / expenses.json.
+
+    Изменения смен дописываются строкой в data.json.journal; data.json — снимок,
+    который периодически переписывается целиком (compact) с обнулением журнала.
+    Архив пишется по месячным файлам: переписываются только затронутые месяцы.
+    Подсказки removed/changed игнорируются: expenses пишутся целиком."""
+
+    journaled = True  # изменения смен сразу уходят в журнал (log_mutation)
+
+    def __init__(self, data_file: str, history_file: str, expenses_file: str, history_dir: str = "history"):
+        self.data_file = data_file
+        self.history_file = history_file  # старый плоский history.json — только для миграции
+        self.history_dir = history_dir
+        self.expenses_file = expenses_file
+        self.journal_file = data_file + ".journal"
+        self.journal_entries = 0
+        self._journal = None
+        self._journal_lock = threading.Lock()
+
+    def load_data(self) -> dict:
+        """Снимок + проигрывание журнала поверх него."""
+        data = _read_json(self.data_file, {"chats": {}})
+        self.journal_entries = 0
+        # .old — журнал, который начали сжимать, но снимок не успел записаться
+        for path in (self.journal_file + ".old", self.journal_file):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # Оборванная последняя строка после падения — пропускаем
+                            continue
+                        apply_mutation(data, entry)
+                        self.journal_entries += 1
+            except FileNotFoundError:
+                pass
+        return data
+
+    def log_mutation(self, entry: dict, data: dict):
+        """O(1): одна строка в конец журнала вместо перезаписи всего data.json."""
+        line = _dumps(entry) + "\n"
+        with self._journal_lock:
+            if self._journal is None:
+                self._journal = open(self.journal_file, "a", encoding="utf-8")
+            self._journal.write(line)
+            self._journal.flush()
+            self.journal_entries += 1
+
+    def _rotate_journal(self):
+        """Текущий журнал уходит в .old, новые записи пишутся в чистый файл."""
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            old = self.journal_file + ".old"
+            if os.path.exists(self.journal_file):
+                if os.path.exists(old):
+                    # Прошлое сжатие не удалось — дописываем к недосжатому журналу
+                    with open(self.journal_file, "r", encoding="utf-8") as src, \
+                            open(old, "a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                    os.remove(self.journal_file)
+                else:
+                    os.replace(self.journal_file, old)
+            self.journal_entries = 0
+        return old
+
+    def snapshot_data(self, data: dict, changed=None):
+        """Полный снимок (сжатие журнала) в два шага.
+
+        Здесь, в event loop: копия data и переход на чистый журнал — всё, что
+        запишется в журнал после этого, проиграется поверх снимка при загрузке.
+        Возвращает функцию, которая пишет копию на диск (её вызывают в потоке записи)."""
+        snapshot = copy.deepcopy(data)
+        old = self._rotate_journal()
+
+        def write():
+            write_json_atomic(self.data_file, snapshot)
+            if os.path.exists(old):
+                os.remove(old)
+        return write
+
+    def save_data(self, data: dict, changed=None):
+        self.snapshot_data(data, changed)()
+
+    def _segment_path(self, month: str) -> str:
+        return os.path.join(self.history_dir, f"{month}.json")
+
+    def load_history(self, migrate: bool = True) -> ShiftArchive:
+        """migrate=False — только прочитать старый history.json, не разбивая его на файлы
+        (когда JSON лишь источник для переноса в SQLite)."""
+        if not os.path.isdir(self.history_dir):
+            if not migrate:
+                return ShiftArchive(_read_json(self.history_file, {"shifts": []})["shifts"])
+            return self._migrate_flat_history()
+        archive = ShiftArchive()
+        for name in sorted(os.listdir(self.history_dir)):
+            if name.endswith(".json"):
+                # Через add: смена попадает и в свой сегмент, и в DateIndex
+                for shift in _read_json(os.path.join(self.history_dir, name), {"shifts": []})["shifts"]:
+                    archive.add(shift)
+        return archive
+
+    def _migrate_flat_history(self) -> ShiftArchive:
+        """Одноразовая разбивка старого history.json на месячные файлы."""
+        archive = ShiftArchive(_read_json(self.history_file, {"shifts": []})["shifts"])
+        os.makedirs(self.history_dir, exist_ok=True)
+        self.save_history(archive.partitions)
+        if os.path.exists(self.history_file):
+            os.replace(self.history_file, self.history_file + ".migrated")
+            print(f"history.json разбит на {len(archive.partitions)} месячных файлов в {self.history_dir}/")
+        return archive
+
+    def save_history(self, partitions: dict, added=None):
+        """partitions — сегменты архива {месяц: [смены]}.
+        added — новые смены: переписываются только их месяцы. Без added — все месяцы."""
+        if added is None:
+            months = list(partitions)
+        else:
+            months = {month_of(s.get("date", "")) for s in added}
+        os.makedirs(self.history_dir, exist_ok=True)
+        for month in months:
+            write_json_atomic(self._segment_path(month), {"shifts": partitions.get(month, [])})
+
+    def prune_history(self, months: list):
+        """Удаляем файлы выброшенных месяцев — без перезаписи остальных."""
+        for month in months:
+            try:
+                os.remove(self._segment_path(month))
+            except FileNotFoundError:
+                pass
+
+    def load_expenses(self) -> tuple:
+        """(расходы, следующий id). Старый формат — голый список, счётчика в нём нет."""
+        stored = _read_json(self.expenses_file, [])
+        if isinstance(stored, list):
+            return stored, None
+        return stored.get("expenses", []), stored.get("next_id")
+
+    def save_expenses(self, expenses: list, next_id: int, added=None, removed=None):
+        write_json_atomic(self.expenses_file, {"next_id": next_id, "expenses": expenses})
+
+    def close(self):
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+# ==================== ОТЛОЖЕННАЯ ЗАПИСЬ ====================
+class WriteBehind:
+    """Фоновая запись с объединением: обработчики только помечают хранилище грязным,
+    одна фоновая задача не позже чем через delay секунд пишет его в отдельном потоке.
+
+    Серия нажатий за окно delay превращается в одну запись на диск.
+    Задача записи job(full, **подсказки) вызывается в event loop: снимает копию
+    данных и возвращает функцию без аргументов, которая пишет копию в потоке, —
+    поток не читает словари, которые в это время меняют обработчики."""
+
+    def __init__(self, delay: float = 2.0):
+        self.delay = delay
+        self.jobs = {}        # {имя: job(full, **подсказки) -> функция записи}
+        self.pending = {}     # {имя: {"full": bool, подсказка: [..]}}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self.requests = 0     # сколько раз помечали грязным
+        self.writes = 0       # сколько раз реально писали
+        self.errors = 0
+        self._wakeup = asyncio.Event()
+
+    def register(self, name: str, job):
+        self.jobs[name] = job
+
+    def mark_dirty(self, name: str, **hints):
+        """Без подсказок — хранилище пишется целиком; иначе подсказки (списки) копятся до записи."""
+        self.requests += 1
+        entry = {"full": not hints}
+        for key, values in hints.items():
+            if values is None:
+                entry["full"] = True
+            else:
+                entry[key] = list(values)
+        self._requeue(name, entry)
+
+    def _requeue(self, name: str, hints: dict):
+        entry = self.pending.setdefault(name, {"full": False})
+        entry["full"] = entry["full"] or hints["full"]
+        for key, values in hints.items():
+            if key != "full":
+                entry.setdefault(key, []).extend(values)
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.delay)  # окно объединения
+            await self.flush()
+
+    async def flush(self):
+        self._wakeup.clear()
+        pending, self.pending = self.pending, {}
+        loop = asyncio.get_running_loop()
+        names = list(pending)
+        for i, name in enumerate(names):
+            hints = pending[name]
+            try:
+                write = self.jobs[name](hints["full"], **{k: v for k, v in hints.items() if k != "full"})
+                await loop.run_in_executor(self.executor, write)
+                self.writes += 1
+            except asyncio.CancelledError:
+                # Задачу остановили посреди записи: текущее (могло не дописаться)
+                # и всё, до чего не дошли, возвращаем в очередь — допишет следующий flush
+                for rest in names[i:]:
+                    self._requeue(rest, pending[rest])
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"Ошибка записи {name}: {e}")
+                self._requeue(name, hints)
+
+
+# ==================== SQLITE ====================
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    chat_id TEXT NOT NULL,
+    booking_id INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (chat_id, booking_id)
+);
+CREATE TABLE IF NOT EXISTS shifts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    shift_date TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+-- Брони по чату ищутся по первичному ключу (chat_id, booking_id). Выборки за период
+-- идут по данным в памяти, индекс по дате смены нужен очистке старого архива.
+CREATE INDEX IF NOT EXISTS idx_shifts_date ON shifts(shift_date);
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    expense_date TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+"""
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+class SqliteStorage:
+    """Хранение в одном файле SQLite в режиме WAL.
+
+    Текущие брони лежат построчно (чат × бронь), архив смен и расходы — по строке на запись.
+    Сохранение пишет только изменившиеся строки, а не весь набор данных."""
+
+    journal_entries = 0  # сжимать нечего — строки пишутся сразу
+    journaled = False    # журнала нет: строки изменённых чатов переписывает writer (snapshot_data)
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        # Последнее записанное состояние — чтобы не переписывать неизменённые строки
+        self._chat_rows = {}      # {chat_id: state_json}
+        self._booking_rows = {}   # {(chat_id, booking_id): body_json}
+
+    # ----------- служебное -----------
+    def _get_meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def migrate_from_json(self, source: JsonStorage) -> bool:
+        """Одноразовый перенос data.json / history.json / expenses.json в базу."""
+        with self.lock:
+            if self._get_meta("migrated_from_json"):
+                return False
+        data = source.load_data()
+        history = source.load_history(migrate=False)
+        expenses, next_id = source.load_expenses()
+        self.save_data(data)
+        self.save_history(history.partitions)
+        self.save_expenses(expenses, next_id or max((e.get("id", 0) for e in expenses), default=0) + 1)
+        with self.lock:
+            self._set_meta("migrated_from_json", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        print(f"Миграция в SQLite: {len(data.get('chats', {}))} чатов, "
+              f"{len(history)} смен, {len(expenses)} расходов")
+        return True
+
+    # ----------- текущие смены -----------
+    def load_data(self) -> dict:
+        with self.lock:
+            chats = {}
+            for chat_id, state in self.conn.execute("SELECT chat_id, state FROM chats"):
+                chat = json.loads(state)
+                chat["bookings"] = []
+                chats[chat_id] = chat
+                self._chat_rows[chat_id] = state
+            rows = self.conn.execute(
+                "SELECT chat_id, booking_id, body FROM bookings ORDER BY chat_id, booking_id"
+            )
+            for chat_id, booking_id, body in rows:
+                if chat_id in chats:
+                    chats[chat_id]["bookings"].append(json.loads(body))
+                    self._booking_rows[(chat_id, booking_id)] = body
+        return {"chats": chats}
+
+    @staticmethod
+    def _changed_chats(data: dict, changed) -> list:
+        if changed is None:
+            return list(data.get("chats", {}).keys())
+        if isinstance(changed, (list, tuple, set)):
+            return [str(c) for c in changed]
+        return [str(changed)]
+
+    def snapshot_data(self, data: dict, changed=None):
+        """Копия изменённых чатов — в event loop; возвращает функцию записи для потока."""
+        chats = data.get("chats", {})
+        snapshot = {"chats": copy.deepcopy({c: chats[c] for c in self._changed_chats(data, changed) if c in chats})}
+        return lambda: self.save_data(snapshot)
+
+    def save_data(self, data: dict, changed=None):
+        """changed — id чата (или список id), если известно, что менялся только он."""
+        chats = data.get("chats", {})
+        chat_ids = self._changed_chats(data, changed)
+
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for chat_id in chat_ids:
+                    chat = chats.get(chat_id)
+                    if chat is None:
+                        continue
+                    state = _dumps({k: v for k, v in chat.items() if k != "bookings"})
+                    if self._chat_rows.get(chat_id) != state:
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO chats (chat_id, state) VALUES (?, ?)", (chat_id, state)
+                        )
+                        self._chat_rows[chat_id] = state
+
+                    seen = set()
+                    for b in chat.get("bookings", []):
+                        key = (chat_id, b.get("id"))
+                        seen.add(key)
+                        body = _dumps(b)
+                        if self._booking_rows.get(key) != body:
+                            self.conn.execute(
+                                "INSERT OR REPLACE INTO bookings (chat_id, booking_id, body) VALUES (?, ?, ?)",
+                                (chat_id, b.get("id"), body),
+                            )
+                            self._booking_rows[key] = body
+                    # Брони, которых больше нет в смене (новая смена начинает id заново)
+                    stale = [k for k in self._booking_rows if k[0] == chat_id and k not in seen]
+                    for key in stale:
+                        self.conn.execute(
+                            "DELETE FROM bookings WHERE chat_id = ? AND booking_id = ?", key
+                        )
+                        del self._booking_rows[key]
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    # ----------- архив смен -----------
+    def load_history(self) -> ShiftArchive:
+        with self.lock:
+            rows = self.conn.execute("SELECT body FROM shifts ORDER BY id").fetchall()
+        return ShiftArchive([json.loads(body) for (body,) in rows])
+
+    def save_history(self, partitions: dict, added=None):
+        """partitions — сегменты архива {месяц: [смены]}.
+        added — новые смены (уже лежат в partitions): обычный путь, только INSERT.
+        Без added база синхронизируется целиком. Так пишут лишь правки «задним числом»
+        (migrate_parsed_fields дополняет брони во всех сменах сразу) и mark_dirty
+        без подсказок: какие смены изменились, неизвестно, а строки shifts не связаны со
+        сменами в памяти ключом — одна транзакция DELETE + INSERT проще и не дороже
+        поштучного сравнения, как и перезапись всех месяцев у JsonStorage."""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                if added is None:
+                    self.conn.execute("DELETE FROM shifts")
+                    added = [s for month in sorted(partitions) for s in partitions[month]]
+                self.conn.executemany(
+                    "INSERT INTO shifts (chat_id, shift_date, body) VALUES (?, ?, ?)",
+                    [(str(s.get("chat_id", "")), date_to_iso(s.get("date", "")), _dumps(s)) for s in added],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def prune_history(self, months: list):
+        """Удаляем выброшенные месяцы по индексу shift_date (сегмент = диапазон дат)."""
+        with self.lock:
+            for month in months:
+                if month == UNKNOWN_MONTH:
+                    self.conn.execute("DELETE FROM shifts WHERE shift_date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-*'")
+                else:
+                    self.conn.execute(
+                        "DELETE FROM shifts WHERE shift_date BETWEEN ? AND ?", (f"{month}-01", f"{month}-31")
+                    )
+
+    # ----------- расходы -----------
+    def load_expenses(self) -> tuple:
+        """(расходы, следующий id)."""
+        with self.lock:
+            rows = self.conn.execute("SELECT body FROM expenses ORDER BY id").fetchall()
+            next_id = self._get_meta("expenses_next_id")
+        return [json.loads(body) for (body,) in rows], int(next_id) if next_id else None
+
+    def save_expenses(self, expenses: list, next_id: int, added=None, removed=None):
+        """added / removed — изменённые записи. Без подсказок таблица переписывается целиком."""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self._set_meta("expenses_next_id", str(next_id))
+                if added is None and removed is None:
+                    self.conn.execute("DELETE FROM expenses")
+                    added = expenses
+                for e in removed or []:
+                    self.conn.execute("DELETE FROM expenses WHERE id = ?", (e.get("id"),))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO expenses (id, chat_id, expense_date, body) VALUES (?, ?, ?, ?)",
+                    [(e.get("id"), str(e.get("chat_id", "")), date_to_iso(e.get("date", "")), _dumps(e))
+                     for e in added or []],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,29 @@
+import asyncio
+import itertools
+
+import pytest
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """Модуль bot.py с пустым состоянием; все его файлы пишутся в tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    import bot
+
+    store = bot.JsonStorage(bot.DATA_FILE, bot.HISTORY_FILE, bot.EXPENSES_FILE, history_dir=bot.HISTORY_DIR)
+    for name, value in {
+        "store": store, "json_store": store,
+        "data": {"chats": {}}, "history": bot.ShiftArchive(), "settings": {},
+        "rate_history": bot.RateHistory(), "expenses": bot.ExpenseLedger(), "rollups": {},
+        "report_cache": bot.OrderedDict(), "report_cache_stats": {"hits": 0, "misses": 0},
+        "data_versions": {"counter": 0, "global": 0, "settings": 0}, "date_versions": {},
+        "timer_records": {}, "timer_heap": [], "timer_ids": itertools.count(1), "timer_wakeup": asyncio.Event(),
+        "chat_locks": {}, "chat_wait_stats": {},
+    }.items():
+        monkeypatch.setattr(bot, name, value)
+    for index in bot.BOOKING_INDEXES:
+        index.clear()
+    bot.writer.pending.clear()
+    yield bot
+    bot.writer.pending.clear()
+    store.close()
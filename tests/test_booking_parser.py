@@ -0,0 +1,62 @@
+from booking_parser import currency_key, parse_booking_line
+
+
+# ----------- как и прежние регулярки -----------
+def test_full_line():
+    p = parse_booking_line("18:30 Анна 1ч 30мин 300 лари")
+    assert p["time"] == "18:30"
+    assert p["info"] == "Анна"
+    assert p["operator"] == "Анна"
+    assert p["duration_sec"] == 5400
+    assert p["duration"] == "1ч 30мин"
+    assert p["amounts"] == {"лари": 300}
+
+
+def test_dollars_and_default_duration():
+    p = parse_booking_line("12:00 Катя вип 200$")
+    assert p["info"] == "Катя вип 200$"
+    assert p["duration_sec"] == 0 and p["duration"] == "30 мин"
+    assert p["amounts"] == {"$": 200}
+
+
+def test_minutes_only_and_several_currencies():
+    p = parse_booking_line("9:05 Оля 45 мин 100 долларов 50 евро")
+    assert p["duration"] == "45 мин"
+    assert p["amounts"] == {"$": 100, "евро": 50}
+
+
+def test_without_time_whole_line_is_text():
+    p = parse_booking_line("Анна 1ч")
+    assert p["time"] == ""
+    assert p["info"] == "Анна"
+    assert p["duration_sec"] == 3600
+
+
+def test_empty_info():
+    p = parse_booking_line("10:00 1ч")
+    assert p["info"] == "Без имени"
+    assert p["operator"] == "Без"  # как extract_operator_name: первое слово info
+
+
+# ----------- намеренные отличия -----------
+def test_usdt_is_crypto_not_dollars():
+    assert parse_booking_line("10:00 Анна 1ч 200 usdt")["amounts"] == {"крипта": 200}
+    assert currency_key("USDT") == "крипта"
+    assert currency_key("usd") == "$"
+
+
+def test_gel_and_eur_aliases():
+    assert parse_booking_line("10:00 Анна 1ч 300 gel 20 eur")["amounts"] == {"лари": 300, "евро": 20}
+    assert currency_key("GEL") == "лари"
+    assert currency_key("eur") == "евро"
+
+
+def test_digit_grouping_is_one_amount():
+    assert parse_booking_line("10:00 Анна 2ч 1 000 лари")["amounts"] == {"лари": 1000}
+    assert parse_booking_line("10:00 Анна 2ч 1 500$")["amounts"] == {"$": 1500}
+
+
+def test_time_is_not_part_of_amount():
+    p = parse_booking_line("10:15 300 лари")
+    assert p["time"] == "10:15"
+    assert p["amounts"] == {"лари": 300}
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from outbox import BULK, INTERACTIVE, Outbox, TokenBucket, lane
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = bucket.updated
+    for _ in range(2):
+        assert bucket.wait_time(now) == 0
+        bucket.take()
+    assert bucket.wait_time(now) == pytest.approx(0.1)
+    assert bucket.wait_time(now + 0.1) == pytest.approx(0)
+    # Запас не копится сверх capacity
+    assert bucket.wait_time(now + 60) == 0 and bucket.tokens == 2
+
+
+def test_token_bucket_block_overrides_tokens():
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.block(5)
+    assert bucket.wait_time(bucket.updated) > 4
+
+
+def test_interactive_lane_goes_before_bulk():
+    order = []
+
+    async def scenario():
+        outbox = Outbox(private=(50, 1))
+
+        async def send(name, priority):
+            with lane(priority):
+                await outbox.send(1, lambda: asyncio.sleep(0, order.append(name)))
+
+        await send("первое", BULK)  # забирает единственный токен чата
+        # Обе ждут токен; отчёт пришёл раньше, но ответ на кнопку важнее
+        await asyncio.gather(send("отчёт", BULK), send("ответ", INTERACTIVE))
+
+    asyncio.run(scenario())
+    assert order == ["первое", "ответ", "отчёт"]
+
+
+def test_busy_chat_does_not_hold_others():
+    order = []
+
+    async def scenario():
+        outbox = Outbox(private=(1, 1))
+
+        async def send(chat_id, name):
+            await outbox.send(chat_id, lambda: asyncio.sleep(0, order.append(name)))
+
+        await send(1, "чат 1")
+        # Чат 1 исчерпал лимит на секунду — чат 2 не ждёт за ним
+        await asyncio.wait_for(send(2, "чат 2"), 0.5)
+        return outbox
+
+    outbox = asyncio.run(scenario())
+    assert order == ["чат 1", "чат 2"]
+    assert outbox.depth() == {}
+
+
+def retry_after(seconds=0):
+    return TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "Too Many Requests", seconds)
+
+
+def test_retry_after_is_retried():
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise retry_after()
+        return "ok"
+
+    async def scenario():
+        outbox = Outbox()
+        return outbox, await outbox.send(1, call)
+
+    outbox, result = asyncio.run(scenario())
+    assert result == "ok"
+    assert len(attempts) == 2
+    assert outbox.stats["retries"] == 1 and outbox.stats["sent"] == 1 and outbox.stats["drops"] == 0
+
+
+def test_retry_after_drops_after_max_retries():
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        raise retry_after()
+
+    async def scenario():
+        outbox = Outbox(max_retries=2)
+        with pytest.raises(TelegramRetryAfter):
+            await outbox.send(1, call)
+        return outbox
+
+    outbox = asyncio.run(scenario())
+    assert len(attempts) == 3
+    assert outbox.stats["drops"] == 1 and outbox.stats["retries"] == 2 and outbox.stats["sent"] == 0
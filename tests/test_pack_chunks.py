@@ -0,0 +1,53 @@
+import re
+
+TAG = re.compile(r"<(/?)([a-z]+)[^>]*>")
+
+
+def unclosed(chunk):
+    """Теги, оставшиеся открытыми к концу части (в порядке открытия)."""
+    stack = []
+    for m in TAG.finditer(chunk):
+        if not m.group(1):
+            stack.append(m.group(2))
+        else:
+            assert stack and stack[-1] == m.group(2), chunk
+            stack.pop()
+    return stack
+
+
+def test_small_pieces_go_in_one_message(bot):
+    assert list(bot.pack_chunks(["<b>Итоги</b>\n", "строка 1\n", "строка 2\n"])) == \
+        ["<b>Итоги</b>\nстрока 1\nстрока 2"]
+
+
+def test_split_by_lines_within_limit(bot):
+    lines = [f"строка {i}\n" for i in range(100)]
+    chunks = list(bot.pack_chunks(lines, limit=300))
+    assert len(chunks) > 1
+    assert all(len(c) <= 300 for c in chunks)
+    assert "\n".join(chunks).split("\n") == [line.rstrip("\n") for line in lines]
+
+
+def test_tag_open_at_boundary_is_closed_and_reopened(bot):
+    body = "".join(f"бронь {i}\n" for i in range(60))
+    chunks = list(bot.pack_chunks(["<b>Чат</b>\n", '<a href="x">' + "<i>" + body + "</i></a>\n", "итог\n"],
+                                  limit=300))
+    assert len(chunks) > 2
+    for c in chunks:
+        assert unclosed(c) == [], c
+        assert len(c) <= 300
+    # Середина списка: теги закрыты в конце и открыты заново в начале
+    assert chunks[1].startswith('<a href="x"><i>')
+    assert chunks[0].endswith("</i></a>")
+    assert chunks[-1].endswith("итог")
+
+
+def test_long_line_is_not_cut_inside_tag_or_entity(bot):
+    # Граница части (limit - TAG_RESERVE = 200) приходится на &amp;, потом на <b>
+    line = "x" * 197 + "&amp;" + "y" * 193 + "<b>жирный</b>" + "\n"
+    chunks = list(bot.pack_chunks([line], limit=300))
+    assert chunks[0] == "x" * 197
+    assert chunks[1] == "&amp;" + "y" * 193
+    assert chunks[2] == "<b>жирный</b>"
+    for c in chunks:
+        assert unclosed(c) == []
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def report(bot):
+    """Отчёт-счётчик: возвращает номер своей сборки."""
+    builds = []
+
+    @bot.cached_report("test")
+    def render(date_from, date_to, *filters, agg=None):
+        builds.append((date_from.date(), date_to.date(), filters))
+        yield "сборка "
+        yield str(len(builds))
+
+    render.builds = builds
+    return render
+
+
+WEEK = (datetime(2026, 3, 2), datetime(2026, 3, 8, 23, 59))
+
+
+def test_repeat_is_served_from_cache(bot, report):
+    assert report(*WEEK) == "сборка 1"
+    assert report(*WEEK) == "сборка 1"
+    assert report(*WEEK, "Анна") == "сборка 2"  # фильтр — часть ключа
+    assert len(report.builds) == 2
+    assert bot.report_cache_stats == {"hits": 1, "misses": 2}
+
+
+def test_only_touched_days_invalidate(bot, report):
+    report(*WEEK)
+    bot.touch_dates("10.03.2026")  # после периода
+    assert report(*WEEK) == "сборка 1"
+    bot.touch_dates("05.03.2026")
+    assert report(*WEEK) == "сборка 2"
+    bot.touch_all()
+    assert report(*WEEK) == "сборка 3"
+
+
+def test_live_booking_change_invalidates_its_shift_date(bot, report):
+    bot.data["chats"]["-1"] = {"date": "04.03.2026", "bookings": []}
+    report(*WEEK)
+    bot.mark_changed("-1")
+    assert report(*WEEK) == "сборка 2"
+
+
+def test_rates_stamp_covers_only_rates_of_the_period(bot, report):
+    bot.rate_history.set(datetime(2026, 2, 1), {"lari": 0.37})
+    report(*WEEK)
+    bot.rate_history.set(datetime(2026, 3, 20), {"lari": 0.5})  # курс после периода
+    assert report(*WEEK) == "сборка 1"
+    bot.rate_history.set(datetime(2026, 3, 4), {"lari": 0.4})
+    assert report(*WEEK) == "сборка 2"
+
+
+def test_settings_change_invalidates(bot, report):
+    report(*WEEK)
+    bot.touch_settings()
+    assert report(*WEEK) == "сборка 2"
+
+
+def test_lru_evicts_least_recently_used(bot, report, monkeypatch):
+    monkeypatch.setattr(bot, "REPORT_CACHE_SIZE", 2)
+    weeks = [(datetime(2026, 3, d), datetime(2026, 3, d + 6)) for d in (2, 9, 16)]
+    report(*weeks[0])
+    report(*weeks[1])
+    report(*weeks[0])  # первая неделя снова свежая
+    report(*weeks[2])  # вытесняет вторую
+    assert len(bot.report_cache) == 2
+    assert report(*weeks[0]) == "сборка 1"
+    assert report(*weeks[1]) == "сборка 4"
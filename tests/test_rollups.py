@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import pytest
+
+PERIOD = (datetime(2026, 3, 1), datetime(2026, 3, 31, 23, 59))
+
+
+def booking(bot, bid, text, **status):
+    p = bot.parse_booking_line(text)
+    return {"id": bid, "author_id": 1, "time": p["time"], "info": p["info"], "duration": p["duration"],
+            "original_text": text, "amounts": p["amounts"], "operator": p["operator"], **status}
+
+
+def recompute(bot):
+    """Итоги периода прямым обходом всех броней — эталон для роллапов."""
+    totals = {}
+    for d, shift in bot.get_shifts_for_period(*PERIOD):
+        rates = bot.rates_on(d)
+        for b in shift["bookings"]:
+            key = (str(shift["chat_id"]), shift["date"], bot.extract_operator_name(b))
+            t = totals.setdefault(key, {"usd": 0.0, "total": 0, "came": 0, "cancelled": 0, "no_show": 0})
+            t["total"] += 1
+            if b.get("deleted"):
+                t["cancelled"] += 1
+            elif b.get("cancelled"):
+                t["no_show"] += 1
+            elif b.get("done"):
+                t["came"] += 1
+                t["usd"] += bot.extract_booking_usd(b, rates)[0]
+    return totals
+
+
+def from_rollups(bot):
+    return {(r["chat_id"], r["date"], r["operator"]):
+            {k: r[k] for k in ("usd", "total", "came", "cancelled", "no_show")}
+            for r in bot.get_rollups_for_period(*PERIOD)}
+
+
+def assert_matches(bot):
+    expected, actual = recompute(bot), from_rollups(bot)
+    assert actual.keys() == expected.keys()
+    for key, t in expected.items():
+        assert actual[key] == {**t, "usd": pytest.approx(t["usd"])}, key
+
+
+def start_shift(bot, chat_str, date_str, bookings):
+    bot.data["chats"][chat_str] = {"date": date_str, "chat_title": f"чат {chat_str}", "bookings": bookings}
+    bot.mark_changed(chat_str)
+
+
+def test_rollups_match_full_recompute(bot):
+    bot.rate_history.set(datetime(2026, 2, 1), {"lari": 0.37, "euro": 1.08})
+    first = [booking(bot, 1, "10:00 Анна 1ч 300 лари", done=True),
+             booking(bot, 2, "11:00 Анна 1ч 100$", cancelled=True),
+             booking(bot, 3, "12:00 Катя 2ч 1 000 лари 50 eur", done=True),
+             booking(bot, 4, "13:00 Катя 1ч 200$", deleted=True)]
+    start_shift(bot, "-1", "02.03.2026", first)
+    bot.archive_shift("-1")
+    start_shift(bot, "-1", "03.03.2026", [booking(bot, 1, "10:00 Анна 1ч 150$", done=True)])
+    start_shift(bot, "-2", "03.03.2026", [booking(bot, 1, "09:00 Оля 1ч 200 usdt"),
+                                           booking(bot, 2, "10:00 Оля 1ч 500 лари", done=True)])
+    assert_matches(bot)
+
+    # Правки текущих смен видны сразу
+    live = bot.data["chats"]["-2"]["bookings"]
+    live[0]["done"] = True
+    live[1].update(done=False, cancelled=True)
+    bot.mark_changed("-2")
+    assert_matches(bot)
+
+    # Поздняя правка брони, уже ушедшей в архив, архив не меняет
+    first[0]["deleted"] = True
+    assert_matches(bot)
+    assert from_rollups(bot)[("-1", "02.03.2026", "Анна")]["came"] == 1
+
+
+def test_rate_change_recalculates_without_touching_cached_rows(bot):
+    bot.rate_history.set(datetime(2026, 2, 1), {"lari": 0.37})
+    start_shift(bot, "-1", "02.03.2026", [booking(bot, 1, "10:00 Анна 1ч 1000 лари", done=True)])
+    bot.archive_shift("-1")
+    bot.data["chats"].clear()
+    assert from_rollups(bot)[("-1", "02.03.2026", "Анна")]["usd"] == pytest.approx(370)
+
+    bot.rate_history.set(datetime(2026, 3, 1), {"lari": 0.4})
+    assert_matches(bot)
+    assert from_rollups(bot)[("-1", "02.03.2026", "Анна")]["usd"] == pytest.approx(400)
+    cached = bot.rollups["02.03.2026"][("-1", "Анна")]
+    assert cached["usd"] == pytest.approx(370) and cached["rates"][0] == 0.37
+
+    # После rebuild_rollups — те же итоги, что и у пересчёта на лету
+    before = from_rollups(bot)
+    bot.rebuild_rollups()
+    assert from_rollups(bot) == before
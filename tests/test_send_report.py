@@ -0,0 +1,35 @@
+import asyncio
+import threading
+from datetime import datetime
+
+WEEK = (datetime(2026, 3, 2), datetime(2026, 3, 8, 23, 59))
+
+
+def test_builds_in_pool_and_sends_chunks(bot, monkeypatch):
+    sent = []
+
+    async def send_chunks(target, chunks, edit=False):
+        sent.extend(chunks)
+        return True
+
+    monkeypatch.setattr(bot, "send_chunks", send_chunks)
+    assert asyncio.run(bot.send_report(None, 1, bot.generate_operator_stats, *WEEK)) is True
+    assert "Статистика операторов" in "".join(sent)
+    assert any(key[0] == "operator_stats" for key in bot.report_cache)
+    assert not bot._report_cancel
+
+
+def test_cache_hit_cancels_previous_build(bot, monkeypatch):
+    sent = []
+
+    async def safe_send(target, text, edit=False):
+        sent.append(text)
+
+    monkeypatch.setattr(bot, "safe_send", safe_send)
+    render = bot.generate_operator_stats
+    bot.report_cache_put(bot.report_key(render.kind, *WEEK, ()), "готовый отчёт")
+    in_flight = bot._report_cancel[1] = threading.Event()  # прошлая сборка ещё идёт
+
+    assert asyncio.run(bot.send_report(None, 1, render, *WEEK)) is True
+    assert sent == ["готовый отчёт"]
+    assert in_flight.is_set()
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+
+def handler_object(observer, name):
+    return next(h for h in observer.handlers if h.callback.__name__ == name)
+
+
+def message(chat_id):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+
+
+def test_report_handlers_are_flagged(bot):
+    for observer, name in ((bot.dp.callback_query, "report_callbacks"),
+                           (bot.dp.callback_query, "my_salary_callbacks"),
+                           (bot.dp.message, "handle_period_input")):
+        assert handler_object(observer, name).flags == bot.REPORT_FLAGS
+    assert "serial" not in handler_object(bot.dp.callback_query, "actions").flags
+
+
+def test_same_chat_is_serialized_other_chats_are_not(bot):
+    log = []
+    regular = {"handler": handler_object(bot.dp.callback_query, "actions")}
+
+    def slow(name):
+        async def handle(event, data_):
+            log.append(f"{name}+")
+            await asyncio.sleep(0.02)
+            log.append(f"{name}-")
+        return handle
+
+    async def scenario():
+        await asyncio.gather(
+            bot.serialize_per_chat(slow("a1"), message(-1), dict(regular)),
+            bot.serialize_per_chat(slow("a2"), message(-1), dict(regular)),
+            bot.serialize_per_chat(slow("b1"), message(-2), dict(regular)),
+        )
+
+    asyncio.run(scenario())
+    # a2 ждёт конца a1, b1 из другого чата идёт сразу
+    assert log.index("a2+") > log.index("a1-")
+    assert log.index("b1+") < log.index("a1-")
+    assert bot.chat_wait_stats[-1]["updates"] == 2 and bot.chat_wait_stats[-1]["waited"] == 1
+
+
+def test_report_bypasses_busy_chat(bot):
+    log = []
+    regular = {"handler": handler_object(bot.dp.callback_query, "actions")}
+    report = {"handler": handler_object(bot.dp.callback_query, "report_callbacks")}
+    release = None
+
+    async def busy(event, data_):
+        log.append("бронь+")
+        await release.wait()
+        log.append("бронь-")
+
+    async def build(event, data_):
+        log.append("отчёт")
+        release.set()
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.create_task(bot.serialize_per_chat(busy, message(-3), regular))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(bot.serialize_per_chat(build, message(-3), report), 1)
+        await first
+
+    asyncio.run(scenario())
+    assert log == ["бронь+", "отчёт", "бронь-"]
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from storage import ExpenseLedger, JsonStorage, ShiftArchive, SqliteStorage, WriteBehind
+
+
+def make_store(tmp_path):
+    return JsonStorage(str(tmp_path / "data.json"), str(tmp_path / "history.json"),
+                       str(tmp_path / "expenses.json"), history_dir=str(tmp_path / "history"))
+
+
+def shift(chat_id, date_str):
+    return {"chat_id": chat_id, "date": date_str, "chat_title": "касса",
+            "bookings": [{"id": 1, "done": True, "text": "10:00 200$"}]}
+
+
+def test_history_reload_keeps_date_index(tmp_path):
+    archive = ShiftArchive([shift("-1", "28.02.2026"), shift("-1", "02.03.2026"), shift("-2", "03.03.2026")])
+    make_store(tmp_path).save_history(archive.partitions)
+
+    loaded = make_store(tmp_path).load_history()
+
+    assert len(loaded) == 3
+    assert len(loaded.index) == 3
+    march = loaded.query(datetime(2026, 3, 1), datetime(2026, 3, 31))
+    assert [s["date"] for s in march] == ["02.03.2026", "03.03.2026"]
+    assert [s["date"] for s in loaded.query(datetime(2026, 2, 1), datetime(2026, 3, 31), chat_id="-1")] == \
+        ["28.02.2026", "02.03.2026"]
+
+
+def test_cancelled_flush_requeues_unwritten(tmp_path):
+    written = []
+
+    def job(name):
+        def prepare(full, **hints):
+            return lambda: (time.sleep(0.05), written.append(name))
+        return prepare
+
+    async def scenario():
+        writer = WriteBehind(delay=0)
+        for name in ("data", "history", "expenses"):
+            writer.register(name, job(name))
+        writer.mark_dirty("data")
+        writer.mark_dirty("history", added=[{"date": "01.03.2026"}])
+        writer.mark_dirty("expenses")
+        task = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0.01)  # первая запись уже в потоке
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert set(writer.pending) == {"data", "history", "expenses"}
+        assert writer.pending["history"]["added"] == [{"date": "01.03.2026"}]
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert not writer.pending
+    assert written.count("history") == 1 and written.count("expenses") == 1
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_drop_before_prunes_whole_months(tmp_path, backend):
+    def open_store():
+        return make_store(tmp_path) if backend == "json" else SqliteStorage(str(tmp_path / "bot.db"))
+
+    archive = ShiftArchive([shift("-1", "31.01.2026"), shift("-1", "15.02.2026"),
+                            shift("-1", "01.03.2026"), shift("-2", "20.03.2026")])
+    store = open_store()
+    store.save_history(archive.partitions)
+
+    dropped = archive.drop_before(datetime(2026, 3, 15))
+    assert dropped == ["2026-01", "2026-02"]
+    assert archive.query(datetime(2026, 1, 1), datetime(2026, 2, 28)) == []
+    store.prune_history(dropped)
+    store.close()
+
+    loaded = open_store().load_history()
+    assert sorted(loaded.partitions) == ["2026-03"]
+    assert [s["date"] for s in loaded.query(datetime(2026, 1, 1), datetime(2026, 3, 31))] == \
+        ["01.03.2026", "20.03.2026"]
+
+
+def test_sqlite_import_leaves_flat_history_alone(tmp_path):
+    with open(tmp_path / "history.json", "w", encoding="utf-8") as f:
+        json.dump({"shifts": [shift("-1", "02.03.2026")]}, f)
+    db = SqliteStorage(str(tmp_path / "bot.db"))
+    db.migrate_from_json(make_store(tmp_path))
+    db.close()
+
+    assert (tmp_path / "history.json").exists()
+    assert not (tmp_path / "history").exists()
+    loaded = SqliteStorage(str(tmp_path / "bot.db")).load_history()
+    assert [s["date"] for s in loaded.query(datetime(2026, 3, 1), datetime(2026, 3, 31))] == ["02.03.2026"]
+
+
+def test_expense_ids_survive_restart_after_delete(tmp_path):
+    for store in (make_store(tmp_path), SqliteStorage(str(tmp_path / "bot.db"))):
+        ledger = ExpenseLedger()
+        for amount in (10, 20, 30):
+            ledger.add({"chat_id": "-1", "date": "02.03.2026", "type": "такси", "amount": amount})
+        store.save_expenses(ledger.all(), ledger.next_id)
+        removed = ledger.remove(3)
+        store.save_expenses(ledger.all(), ledger.next_id, added=[], removed=[removed])
+
+        records, next_id = store.load_expenses()
+        reloaded = ExpenseLedger(records, next_id)
+        assert sorted(reloaded.by_id) == [1, 2]
+        assert reloaded.add({"chat_id": "-1", "date": "03.03.2026", "type": "фото", "amount": 5})["id"] == 4
+
+
+def test_expense_totals_follow_add_and_remove():
+    ledger = ExpenseLedger()
+    ledger.add({"chat_id": "-1", "date": "02.03.2026", "type": "Такси", "amount": 10})
+    ledger.add({"chat_id": "-1", "date": "02.03.2026", "type": "такси", "amount": 50, "currency": "лари"})
+    ledger.add({"chat_id": "-2", "date": "02.03.2026", "type": "такси", "amount": 5})
+    photo = ledger.add({"chat_id": "-1", "date": "03.03.2026", "type": "фото", "amount": 20})
+    march = (datetime(2026, 3, 1), datetime(2026, 3, 31))
+    day = datetime(2026, 3, 2).toordinal()
+
+    assert ledger.category_totals(*march) == [(day, "такси", {"$": 15, "лари": 50}),
+                                              (day + 1, "фото", {"$": 20})]
+    assert ledger.category_totals(*march, chat_id="-2") == [(day, "такси", {"$": 5})]
+    ledger.remove(photo["id"])
+    assert [c for _, c, _ in ledger.category_totals(*march)] == ["такси"]
+    assert ledger.totals["-1"] == {day: {"такси": {"$": 10, "лари": 50}}}
+
+
+def booking(bid, **status):
+    return {"id": bid, "time": "10:00", "info": "Анна 1ч", "done": False, "cancelled": False, "deleted": False,
+            **status}
+
+
+def test_journal_replays_over_snapshot(tmp_path):
+    store = make_store(tmp_path)
+    data = {"chats": {"-1": {"bookings": [], "expenses": [], "date": "02.03.2026", "next_id": 1}}}
+    store.save_data(data)
+    for entry in ({"op": "add", "chat": "-1", "booking": booking(1)},
+                  {"op": "add", "chat": "-1", "booking": booking(2)},
+                  {"op": "done", "chat": "-1", "booking": booking(1, done=True)},
+                  {"op": "meta", "chat": "-1", "fields": {"board_msg": 55}}):
+        store.log_mutation(entry, data)
+    store.close()
+    with open(tmp_path / "data.json.journal", "a", encoding="utf-8") as f:
+        f.write('{"op": "delete", "chat": "-1", "boo')  # оборванная строка после падения
+
+    restarted = make_store(tmp_path)
+    chat = restarted.load_data()["chats"]["-1"]
+    assert restarted.journal_entries == 4
+    assert [(b["id"], b["done"]) for b in chat["bookings"]] == [(1, True), (2, False)]
+    assert chat["next_id"] == 3 and chat["board_msg"] == 55
+
+
+def test_compaction_interrupted_before_write_loses_nothing(tmp_path):
+    store = make_store(tmp_path)
+    data = {"chats": {}}
+    store.log_mutation({"op": "add", "chat": "-1", "booking": booking(1)}, data)
+    write = store.snapshot_data({"chats": {"-1": {"bookings": [booking(1)], "next_id": 2}}})
+    # Журнал уже сменён, а снимок ещё не записан — новая правка идёт в новый журнал
+    store.log_mutation({"op": "add", "chat": "-1", "booking": booking(2)}, data)
+    store.close()
+
+    assert [b["id"] for b in make_store(tmp_path).load_data()["chats"]["-1"]["bookings"]] == [1, 2]
+
+    write()
+    assert not (tmp_path / "data.json.journal.old").exists()
+    reloaded = make_store(tmp_path)
+    assert [b["id"] for b in reloaded.load_data()["chats"]["-1"]["bookings"]] == [1, 2]
+    assert reloaded.journal_entries == 1
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+
+def test_timers_survive_restart(bot):
+    bot.schedule_timer(-1, 7, "10:00 — Анна", 101, 3600)
+    bot.schedule_timer(-2, 3, "11:00 — Катя", 102, 60)
+    assert "timers" in bot.writer.pending
+    asyncio.run(bot.writer.flush())
+    with open(bot.TIMERS_FILE, encoding="utf-8") as f:
+        assert {r["bid"] for r in json.load(f)} == {7, 3}
+
+    # «Перезапуск»: память пуста, всё берётся из файла
+    bot.timer_records.clear()
+    bot.timer_heap.clear()
+    bot.load_timers()
+
+    assert set(bot.timer_records) == {1, 2}
+    deadline, _, first = bot.timer_heap[0]
+    assert first["bid"] == 3 and deadline == first["fire_at"]
+    bot.schedule_timer(-1, 8, "12:00 — Оля", 103, 60)
+    assert max(bot.timer_records) == 3  # id продолжаются после загруженных
+
+
+def test_overdue_timer_fires_and_cleans_up_after_restore(bot, monkeypatch):
+    now = time.time()
+    with open(bot.TIMERS_FILE, "w", encoding="utf-8") as f:
+        json.dump([{"id": 5, "chat_id": -1, "bid": 2, "label": "10:00 — Анна", "start_msg": 101,
+                    "fire_at": now - 600, "cleanup_at": now - 575, "fired": False}], f)
+    sent, deleted = [], []
+
+    async def send_message(chat_id, text, **kwargs):
+        sent.append((chat_id, text))
+        return SimpleNamespace(message_id=200)
+
+    async def delete_message(chat_id, message_id):
+        deleted.append((chat_id, message_id))
+
+    monkeypatch.setattr(bot.bot, "send_message", send_message)
+    monkeypatch.setattr(bot.bot, "delete_message", delete_message)
+    monkeypatch.setattr(bot, "TIMER_CLEANUP_DELAY", 0)
+    bot.load_timers()
+
+    async def scenario():
+        loop_task = asyncio.create_task(bot.timer_loop())
+        for _ in range(100):
+            if deleted:
+                break
+            await asyncio.sleep(0.01)
+        loop_task.cancel()
+        await asyncio.gather(loop_task, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert len(sent) == 1
+    assert sent[0][0] == -1 and "Время вышло!" in sent[0][1] and "с опозданием 10 мин" in sent[0][1]
+    assert deleted == [(-1, 101)]
+    assert bot.timer_records == {} and bot.timer_heap == []
+    assert "timers" in bot.writer.pending